@@ -7,6 +7,15 @@ Helper functions for using native code generation together with pyodesys.
 from __future__ import print_function, absolute_import, division
 
 from collections import OrderedDict
+import os
+import shutil
+import sys
+import tempfile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 try:
     from pyodesys.native import native_sys
@@ -20,6 +29,8 @@ else:
 
 
 from .. import Substance
+from ..util.diskcache import content_hash, default_cache_dir, file_lock
+from ..util.pyutil import memoize
 
 _anon = """
     template <typename T>
@@ -107,7 +118,165 @@ def _get_subst_comp(rsys, odesys, comp_keys, skip_keys):
     return subst_comp
 
 
-def get_native(rsys, odesys, integrator, skip_keys=(0,), steady_state_root=False, conc_roots=None):
+_loaded_binaries = {}  # fingerprint -> module (per process reuse)
+
+
+def _strip_timestamps(source):
+    # pyodesys stamps the generation time into the rendered sources
+    return '\n'.join(line for line in source.splitlines() if 'This file was generated using' not in line)
+
+
+def _canonical_str(value):
+    return str(sorted(value)) if isinstance(value, (set, frozenset)) else str(value)
+
+
+def _batch_rows(table, idxs):
+    if isinstance(table, dict):
+        return {k: (np.asarray(v)[idxs] if np.ndim(v) > 0 else v) for k, v in table.items()}
+    return np.asarray(table)[idxs]
+
+
+def _integrate_batch(self, tout, y0, params=(), special_settings=None, **kwargs):
+    """ Integrates a batch of cases (one row of ``y0`` and ``params`` per case)
+
+    All cases sharing the same ``special_settings`` are integrated in a single call
+    to the compiled module, which distributes them over (OpenMP) threads (see
+    ``OMP_NUM_THREADS``). The pre- and post-processors are applied to each group
+    as a whole.
+
+    Parameters
+    ----------
+    tout : array_like
+        Output time points (shared by all cases, at least 3).
+    y0 : 2D array_like or dict
+        Initial values, one row per case (a dict maps names to arrays/scalars).
+    params : 2D array_like or dict
+        Parameters, one row per case.
+    special_settings : array_like, optional
+        Shape ``(n_cases, n)`` or ``(n,)`` (shared), e.g. the root values used
+        together with ``conc_roots`` or the tolerance factor of ``steady_state_root``.
+    \\*\\*kwargs :
+        Keyword arguments passed on to ``integrate``.
+
+    Returns
+    -------
+    chempy.kinetics.ode.EnsembleResult
+
+    """
+    from .ode import EnsembleResult, _n_rows
+    if len(tout) < 3:
+        raise ValueError("Need at least 3 output time points")
+    n_cases = max(_n_rows(y0), _n_rows(params) if len(params) else 1)
+    if special_settings is None or np.ndim(special_settings) < 2:
+        groups = [(np.arange(n_cases), special_settings)]
+    else:
+        special_settings = np.asarray(special_settings, dtype=np.float64)
+        if special_settings.shape[0] != n_cases:
+            raise ValueError("Need one row of special_settings per case")
+        uniq, inverse = np.unique(special_settings, axis=0, return_inverse=True)
+        groups = [(np.flatnonzero(inverse.ravel() == gi), row) for gi, row in enumerate(uniq)]
+
+    result = None
+    for idxs, settings in groups:
+        kw = dict(kwargs)
+        if settings is not None:
+            kw['special_settings'] = list(settings)
+        y0_rows = _batch_rows(y0, idxs)
+        p_rows = _batch_rows(params, idxs) if len(params) else np.zeros((len(idxs), 0))
+        results = self.integrate(tout, y0_rows, p_rows, **kw)
+        if not isinstance(results, list):
+            results = [results]
+        for i, res in zip(idxs, results):
+            if result is None:
+                result = EnsembleResult(tout, n_cases, res.yout.shape[-1], self.names)
+            result.yout[i, ...] = res.yout
+            for k in EnsembleResult.attrs:
+                if k in res.info:
+                    getattr(result, k)[i] = res.info[k]
+    return result
+
+
+@memoize(None)
+def _native_sys_class(integrator, cache_dir=None):
+    """ Subclass of ``native_sys[integrator]`` with :meth:`integrate_batch`
+
+    When ``cache_dir`` is given, compiled binaries are reused from (and stored under)
+    that directory. The binaries are keyed on a fingerprint of the rendered sources
+    (sans time stamps), the integrator, the namespace overrides/extensions and the
+    compilation options.
+    """
+    NativeSys = native_sys[integrator]
+    namespace = {'integrate_batch': _integrate_batch}
+    if cache_dir is None:
+        return type(NativeSys.__name__, (NativeSys,), namespace)
+
+    class NativeCode(NativeSys._NativeCode):
+
+        def fingerprint(self):
+            sources = []
+            for path in sorted(self._written_files):
+                if path.endswith(('.cpp', '.hpp', '.pyx')):
+                    with open(path, 'rt') as ifh:
+                        sources.append((os.path.basename(path), _strip_timestamps(ifh.read())))
+            return content_hash(
+                integrator, sys.version_info[:2], self.so_file, sources, sorted(self.compile_kwargs.items()),
+                sorted((k, _canonical_str(v)) for k, v in self.namespace_override.items()),
+                sorted((k, _canonical_str(v)) for k, v in self.namespace_extend.items()))
+
+        def compile_and_import_binary(self):
+            from pycodeexport.codeexport import Interceptor
+            key = self.fingerprint()
+            if key in _loaded_binaries:
+                return _loaded_binaries[key]
+            entry_dir = os.path.join(cache_dir, key)
+            binary = os.path.join(entry_dir, self.so_file)
+            if not os.path.exists(binary):
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                with file_lock(entry_dir + '.lock'):
+                    if not os.path.exists(binary):  # not built by another process meanwhile
+                        self._compile()
+                        tmp_dir = tempfile.mkdtemp(dir=cache_dir)
+                        shutil.copy(os.path.join(self._tempdir, self.so_file), tmp_dir)
+                        os.rename(tmp_dir, entry_dir)
+            _loaded_binaries[key] = Interceptor(binary)
+            return _loaded_binaries[key]
+
+    NativeCode.__name__ = 'Cached' + NativeSys._NativeCode.__name__
+    namespace['_NativeCode'] = NativeCode
+    return type('Cached' + NativeSys.__name__, (NativeSys,), namespace)
+
+
+def get_native(rsys, odesys, integrator, skip_keys=(0,), steady_state_root=False, conc_roots=None, cache=None):
+    """ Creates a natively compiled ODE system (see :mod:`pyodesys.native`)
+
+    Parameters
+    ----------
+    rsys : ReactionSystem
+    odesys : pyodesys.symbolic.SymbolicSys
+        E.g. from :func:`chempy.kinetics.ode.get_odesys`.
+    integrator : str
+        One of the keys of ``pyodesys.native.native_sys``, e.g. ``'cvode'``.
+    skip_keys : tuple
+        Composition keys excluded from upper bound of concentrations.
+    steady_state_root : bool
+        Add a root function for detection of steady state.
+    conc_roots : iterable of str
+        Substance keys for which roots (at values given by ``special_settings``) are added.
+    cache : bool or str, optional
+        Reuse compiled binaries across processes and runs. The binaries are stored in
+        sub-directories (named by a fingerprint of the rendered sources, integrator and
+        namespaces) of ``cache`` (or of ``native`` in
+        :func:`chempy.util.diskcache.default_cache_dir` when ``True``). A lock file
+        prevents concurrent duplicate builds.
+
+    Returns
+    -------
+    Instance of a subclass of ``pyodesys.native.native_sys[integrator]``, which in addition
+    offers ``integrate_batch`` (see :func:`_integrate_batch`) for integrating a table of cases
+    (with per case ``special_settings``).
+
+    """
     comp_keys = Substance.composition_keys(rsys.substances.values(), skip_keys=skip_keys)
     if PartiallySolvedSystem is None:
         raise ValueError("Failed to import 'native_sys' from 'pyodesys.native'")
@@ -119,6 +288,8 @@ def get_native(rsys, odesys, integrator, skip_keys=(0,), steady_state_root=False
     kw = dict(namespace_override={
         'p_get_dx_max': True,
     })
+    if getattr(odesys, 'sparse', False):
+        kw['sparse'] = True  # not among SymbolicSys._attrs_to_copy
     if all(subst.composition is None for subst in rsys.substances.values()):
         pass
     else:
@@ -163,4 +334,8 @@ def get_native(rsys, odesys, integrator, skip_keys=(0,), steady_state_root=False
     if 'p_includes' not in ns_extend:
         ns_extend['p_includes'] = set()
     ns_extend['p_includes'] |= {"<type_traits>",  "<vector>"}
-    return native_sys[integrator].from_other(odesys, namespace_extend=ns_extend, **kw)
+    if cache:
+        cache_dir = os.path.abspath(os.path.join(default_cache_dir(), 'native') if cache is True else cache)
+    else:
+        cache_dir = None
+    return _native_sys_class(integrator, cache_dir).from_other(odesys, namespace_extend=ns_extend, **kw)
@@ -36,6 +36,125 @@ def _dominant_reaction_effects(substance_key, rsys, rates, linthreshy, eqk1, eqk
     return data, tot
 
 
+def _net_stoich_csc(rsys, substance_keys):
+    """ Net stoichiometry of the substances as a sparse ``(nr, len(substance_keys))`` matrix (CSC) """
+    from scipy.sparse import csc_matrix
+    rows, cols, data = [], [], []
+    for ci, sk in enumerate(substance_keys):
+        for ri, n in rsys.per_reaction_effect_on_substance(sk).items():
+            rows.append(ri)
+            cols.append(ci)
+            data.append(n)
+    return csc_matrix((np.array(data, dtype=np.float64), (rows, cols)), shape=(rsys.nr, len(substance_keys)))
+
+
+def _xyp_chunks(xyp, chunk_size, unit_registry=None):
+    from ..util.chunkstore import ChunkedStore
+    if isinstance(xyp, ChunkedStore):
+        for start in range(0, len(xyp), chunk_size):
+            yield xyp.as_arrays(slice(start, start + chunk_size), unit_registry)
+        return
+    xout, yout, params = xyp
+    params = np.asarray(params)
+    for start in range(0, np.shape(xout)[0], chunk_size):
+        sl = slice(start, start + chunk_size)
+        yield xout[sl], yout[sl], params[sl] if params.ndim > 1 else params
+
+
+def reaction_contributions(xyp, rsys, rate_exprs_cb, substance_keys=None, top_k=5, chunk_size=4096,
+                           unit_registry=None):
+    """ Largest per reaction contributions to the rate of change of substances.
+
+    The reaction rates are evaluated (in chunks of ``chunk_size`` time points) for
+    all reactions at once and multiplied by the (sparse) net stoichiometry, only the
+    ``top_k`` contributions (by magnitude) per time point and substance are kept.
+
+    Parameters
+    ----------
+    xyp : ``pyodesys.results.Result`` instance or length 3 tuple or xout,yout,params
+        or :class:`chempy.util.chunkstore.ChunkedStore` (read one chunk at a time).
+    rsys : ReactionSystem
+    rate_exprs_cb : callback
+        E.g. ``extra['rate_exprs_cb']`` from :func:`chempy.kinetics.ode.get_odesys`.
+    substance_keys : iterable of str, optional
+        Default: all substances of ``rsys``.
+    top_k : int
+    chunk_size : int
+    unit_registry : dict, optional
+        When given, rates are converted to molar per second.
+
+    Returns
+    -------
+    ridx : ndarray of ints, shape ``(n_t, len(substance_keys), top_k)``
+        Reaction indices ordered by decreasing magnitude of contribution (padded with -1).
+    contrib : ndarray, shape ``(n_t, len(substance_keys), top_k)``
+        Corresponding contributions (padded with zeros).
+    total : ndarray, shape ``(n_t, len(substance_keys))``
+        Rate of change of the substances (from all reactions).
+
+    Examples
+    --------
+    >>> from chempy import Reaction, ReactionSystem
+    >>> from chempy.kinetics.numeric import NumericRHS
+    >>> rsys = ReactionSystem([Reaction({'A': 1}, {'B': 1}, 3.0), Reaction({'B': 1}, {'A': 1}, 2.0),
+    ...                        Reaction({'B': 1}, {'C': 1}, 5.0)], 'A B C')
+    >>> ridx, contrib, total = reaction_contributions(
+    ...     ([0.0], [[1.0, 1.0, 0.0]], []), rsys, NumericRHS(rsys).rates, ['B'], top_k=2)
+    >>> ridx.tolist(), contrib.tolist(), total.tolist()
+    ([[[2, 0]]], [[[-5.0, 3.0]]], [[-4.0]])
+
+    """
+    try:
+        from pyodesys.results import Result
+    except ImportError:
+        Result = ()  # xyp cannot be a Result instance
+    if isinstance(xyp, Result):
+        xyp = xyp.odesys.to_arrays(xyp.xout, xyp.yout, xyp.params, reshape=False)
+    if substance_keys is None:
+        substance_keys = rsys.substances.keys()
+    substance_keys = list(substance_keys)
+    N = _net_stoich_csc(rsys, substance_keys)
+    ridx_chunks, contrib_chunks, total_chunks = [], [], []
+    for x, y, p in _xyp_chunks(xyp, chunk_size, unit_registry):
+        rates = rate_exprs_cb(x, y, p)
+        if unit_registry is not None:
+            time_unit = get_derived_unit(unit_registry, 'time')
+            conc_unit = get_derived_unit(unit_registry, 'concentration')
+            rates = to_unitless(rates*conc_unit/time_unit, u.molar/u.second)
+        rates = np.atleast_2d(np.asarray(rates, dtype=np.float64))
+        total_chunks.append(np.asarray(N.T.dot(rates.T)).T)
+        ridx = np.full((rates.shape[0], len(substance_keys), top_k), -1, dtype=int)
+        contrib = np.zeros(ridx.shape)
+        for ci in range(len(substance_keys)):
+            rows, coeffs = N.indices[N.indptr[ci]:N.indptr[ci+1]], N.data[N.indptr[ci]:N.indptr[ci+1]]
+            c = rates[:, rows]*coeffs
+            k = min(top_k, rows.size)
+            if k == 0:
+                continue
+            if k < rows.size:
+                sel = np.argpartition(-np.abs(c), k - 1, axis=1)[:, :k]
+                c_sel = np.take_along_axis(c, sel, axis=1)
+            else:
+                sel, c_sel = np.broadcast_to(np.arange(rows.size), c.shape), c
+            order = np.argsort(-np.abs(c_sel), axis=1, kind='stable')
+            ridx[:, ci, :k] = rows[np.take_along_axis(sel, order, axis=1)]
+            contrib[:, ci, :k] = np.take_along_axis(c_sel, order, axis=1)
+        ridx_chunks.append(ridx)
+        contrib_chunks.append(contrib)
+    return np.concatenate(ridx_chunks), np.concatenate(contrib_chunks), np.concatenate(total_chunks)
+
+
+def _top_reaction_effects(rsys, ridx, contrib, linthreshy):
+    data = []
+    for ri in np.unique(ridx[ridx >= 0]):
+        mask = ridx == ri
+        y = np.where(np.any(mask, axis=-1), np.sum(np.where(mask, contrib, 0), axis=-1), np.nan)
+        if np.all(~(np.abs(y) >= linthreshy)):
+            continue
+        data.append((y, rsys.rxns[ri]))
+    return data
+
+
 def _combine_rxns_to_eq(rsys):
     eqk1, eqk2 = zip(*rsys.identify_equilibria())
     eqs = [Equilibrium(
@@ -52,19 +171,28 @@ def plot_reaction_contributions(
         xyp, rsys, rate_exprs_cb, substance_keys=None, varied=None, axes=None,
         total=False, linthreshy=1e-9, relative=False, xscale='log', yscale='symlog',
         xlabel='Time', ylabel=None, combine_equilibria=False, selection=slice(None),
-        unit_registry=None):
+        unit_registry=None, top_k=None):
     """ Plots per reaction contributions to concentration evolution of a substance.
 
     Parameters
     ----------
     xyp : ``pyodesys.results.Result`` instance or length 3 tuple or xout,yout,params
+        or :class:`chempy.util.chunkstore.ChunkedStore` (read lazily, only the rows
+        given by ``selection``).
     result : pyodesys.results.Result
     substance_key : str
+    top_k : int, optional
+        Only plot the ``top_k`` largest contributions at each point (see
+        :func:`reaction_contributions`), a reaction's line is interrupted where
+        it is not among them. Not supported together with ``combine_equilibria``.
 
     """
     from pyodesys.results import Result
+    from ..util.chunkstore import ChunkedStore
     if isinstance(xyp, Result):
         xyp = xyp.odesys.to_arrays(xyp.xout, xyp.yout, xyp.params, reshape=False)
+    elif isinstance(xyp, ChunkedStore):
+        xyp = xyp.as_arrays(selection, unit_registry)
     if varied is None:
         varied = xyp[0]
     if xyp[1].shape[-2] != varied.size:
@@ -73,16 +201,26 @@ def plot_reaction_contributions(
         substance_keys = rsys.substances.keys()
     if axes is None:
         _fig, axes = plt.subplots(len(substance_keys))
-    rates = rate_exprs_cb(*xyp)
-    if unit_registry is not None:
-        time_unit = get_derived_unit(unit_registry, 'time')
-        conc_unit = get_derived_unit(unit_registry, 'concentration')
-        rates = to_unitless(rates*conc_unit/time_unit, u.molar/u.second)
+    if top_k is None:
+        rates = rate_exprs_cb(*xyp)
+        if unit_registry is not None:
+            time_unit = get_derived_unit(unit_registry, 'time')
+            conc_unit = get_derived_unit(unit_registry, 'concentration')
+            rates = to_unitless(rates*conc_unit/time_unit, u.molar/u.second)
+    elif combine_equilibria:
+        raise ValueError("top_k is not supported together with combine_equilibria")
+    else:
+        substance_keys = list(substance_keys)
+        top_ridx, top_contrib, top_total = reaction_contributions(
+            xyp, rsys, rate_exprs_cb, substance_keys, top_k=top_k, unit_registry=unit_registry)
 
     eqk1, eqk2, eqs = _combine_rxns_to_eq(rsys) if combine_equilibria else ([], [], [])
 
-    for sk, ax in zip(substance_keys, axes):
-        data, tot = _dominant_reaction_effects(sk, rsys, rates, linthreshy, eqk1, eqk2, eqs)
+    for si, (sk, ax) in enumerate(zip(substance_keys, axes)):
+        if top_k is None:
+            data, tot = _dominant_reaction_effects(sk, rsys, rates, linthreshy, eqk1, eqk2, eqs)
+        else:
+            data, tot = _top_reaction_effects(rsys, top_ridx[:, si], top_contrib[:, si], linthreshy), top_total[:, si]
         factor = 1/xyp[1][:, rsys.as_substance_index(sk)] if relative else 1
         if total:
             ax.plot(varied, factor*tot, c='k', label='Total', linewidth=2, ls=':')
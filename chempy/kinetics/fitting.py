@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+Estimation of kinetic parameters (e.g. rate constants) from observed time series.
+
+The residuals are minimized using :func:`scipy.optimize.least_squares` where the
+Jacobian is given by the forward sensitivities of the ODE-system (see the
+``sensitivities`` argument of :func:`chempy.kinetics.ode.get_odesys`). Several
+(random) starting guesses may be optimized in parallel using a process pool.
+"""
+from __future__ import (absolute_import, division, print_function)
+
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+_compiled_systems = OrderedDict()  # per process cache of ODE-systems, see _fit_system
+_max_compiled_systems = 8
+
+
+def _fit_system(rsys, odesys_kwargs):
+    """ Returns (odesys, extra) from :func:`get_odesys`, cached per process (when possible) """
+    from .ode import get_odesys, _get_odesys_cache_key
+    kw = dict(odesys_kwargs)
+    kw.pop('cache', None)
+    args = [kw.pop(k, default) for k, default in (
+        ('include_params', True), ('substitutions', None), ('unit_registry', None),
+        ('cstr', False), ('constants', None), ('engine', 'symbolic'))]
+    key = _get_odesys_cache_key(rsys, *(args + [kw]))
+    if key is not None and key in _compiled_systems:
+        _compiled_systems.move_to_end(key)
+        return _compiled_systems[key]
+    result = get_odesys(rsys, **odesys_kwargs)
+    if key is not None:
+        _compiled_systems[key] = result
+        while len(_compiled_systems) > _max_compiled_systems:
+            _compiled_systems.popitem(last=False)
+    return result
+
+
+class _FitProblem(object):
+    """ Unitless description of a fitting problem (picklable, sent to worker processes) """
+
+    def __init__(self, rsys, odesys_kwargs, series, fit_keys, log_scale, integrate_kwargs):
+        self.rsys = rsys
+        self.odesys_kwargs = odesys_kwargs
+        self.series = series
+        self.fit_keys = fit_keys
+        self.log_scale = log_scale
+        self.integrate_kwargs = integrate_kwargs
+
+    def to_params(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        return np.exp(x) if self.log_scale else x
+
+    def from_params(self, p):
+        p = np.asarray(p, dtype=np.float64)
+        return np.log(p) if self.log_scale else p
+
+    def residuals_jacobian(self, x):
+        """ Weighted residuals and their Jacobian w.r.t. ``x`` (concatenated over the series) """
+        odesys, extra = _fit_system(self.rsys, self.odesys_kwargs)
+        p_fit = self.to_params(x)
+        resid, jac = [], []
+        for s in self.series:
+            params = dict(s['params'])
+            params.update(zip(self.fit_keys, p_fit))
+            res = odesys.integrate(s['tout'], s['c0'], params, force_predefined=True, **self.integrate_kwargs)
+            if not res.info['success']:
+                raise RuntimeError("Integration failed: %s" % res.info.get('message', ''))
+            yout, sens = res.yout[s['offset']:], extra['sensitivities'](res.yout[s['offset']:])
+            for idx, obs, w in s['observed']:
+                mask = np.isfinite(obs)
+                resid.append(((yout[:, idx] - obs)*w)[mask])
+                jac.append((sens[:, idx, :]*w[:, None])[mask])
+        J = np.concatenate(jac)
+        if self.log_scale:
+            J = J*p_fit
+        return np.concatenate(resid), J
+
+    def solve(self, x0, bounds, **kwargs):
+        from scipy.optimize import least_squares
+        last = {}
+
+        def _eval(x):
+            if 'x' not in last or not np.array_equal(last['x'], x):
+                last['x'] = np.array(x)
+                last['rj'] = self.residuals_jacobian(x)
+            return last['rj']
+
+        res = least_squares(lambda x: _eval(x)[0], x0, jac=lambda x: _eval(x)[1], bounds=bounds, **kwargs)
+        return res
+
+
+_fit_problem = None  # per process problem used by _fit_start
+
+
+def _fit_init(problem):
+    global _fit_problem
+    _fit_problem = problem
+
+
+def _fit_start(x0, bounds, least_squares_kwargs):
+    try:
+        res = _fit_problem.solve(x0, bounds, **least_squares_kwargs)
+    except Exception as exc:  # e.g. failing integration at an extreme starting guess
+        return dict(x0=x0, x=None, cost=np.inf, success=False, message=str(exc), nfev=0, njev=0)
+    return dict(x0=x0, x=res.x, cost=res.cost, success=bool(res.success), message=res.message,
+                nfev=res.nfev, njev=res.njev or 0, fun=res.fun, jac=res.jac)
+
+
+def _unitless(value, unit):
+    from ..units import is_quantity, to_unitless
+    if unit is not None and is_quantity(value):
+        value = to_unitless(value, unit)
+    return np.asarray(value, dtype=np.float64)
+
+
+def _unitless_param(value, unit_registry):
+    from ..units import is_quantity, unitless_in_registry
+    if unit_registry is None or not is_quantity(value):
+        return value
+    return unitless_in_registry(value, unit_registry)
+
+
+def _prepare_series(rsys, series, unit_registry):
+    from ..units import get_derived_unit
+    if unit_registry is None:
+        time_unit = conc_unit = None
+    else:
+        time_unit = get_derived_unit(unit_registry, 'time')
+        conc_unit = get_derived_unit(unit_registry, 'concentration')
+    substance_keys = list(rsys.substances)
+    prepared = []
+    for s in series:
+        unknown = [k for k in s if k not in ('tout', 'c0', 'observed', 'params', 'sigma', 't0')]
+        if unknown:
+            raise ValueError("Unknown key(s) in series: %s" % ', '.join(unknown))
+        tout = _unitless(s['tout'], time_unit)
+        t0 = _unitless(s.get('t0', 0), time_unit)
+        offset = 0 if tout[0] == t0 else 1
+        c0 = dict.fromkeys(substance_keys, 0.0)
+        c0.update((k, float(_unitless(v, conc_unit))) for k, v in s['c0'].items())
+        sigma = s.get('sigma', 1)
+        observed = []
+        for k, obs in s['observed'].items():
+            if k not in rsys.substances:
+                raise ValueError("Unknown substance key: %s" % k)
+            obs = _unitless(obs, conc_unit)
+            if obs.shape != tout.shape:
+                raise ValueError("Shape of observed %s does not match tout" % k)
+            sig = sigma[k] if isinstance(sigma, dict) else sigma
+            w = np.ones_like(obs)/_unitless(sig, conc_unit)
+            observed.append((substance_keys.index(k), obs, w))
+        prepared.append(dict(
+            tout=tout if offset == 0 else np.concatenate(([t0], tout)), offset=offset, c0=c0, observed=observed,
+            params={k: _unitless_param(v, unit_registry) for k, v in s.get('params', {}).items()}))
+    return prepared
+
+
+def fit_kinetic_params(rsys, series, fit_keys, guess=None, bounds=None, params=None, n_starts=1, spread=1.0,
+                       seed=None, workers=None, log_scale=True, absolute_sigma=False, unit_registry=None,
+                       odesys_kwargs=None, integrate_kwargs=None, mp_context=None, **kwargs):
+    """ Fits (rate) parameters of a reaction system to observed time series.
+
+    The weighted residuals of all series are minimized simultaneously using
+    :func:`scipy.optimize.least_squares` with the Jacobian obtained from forward
+    sensitivities. Several starting guesses (``n_starts``) may be optimized in a
+    process pool (each worker creates the ODE-system once, and reuses it).
+
+    Parameters
+    ----------
+    rsys : ReactionSystem
+    series : iterable of dicts
+        Each with the keys:
+
+            - 'tout': array_like, time points of the observations.
+            - 'c0': dict, initial concentrations (at ``t0``).
+            - 'observed': dict mapping substance keys to array_like (of same length
+              as ``tout``), NaN indicates a missing value.
+            - 'params' (optional): dict of parameter values specific to the serie
+              (e.g. temperature), overriding ``params``.
+            - 'sigma' (optional): standard deviation of the observations, a scalar or
+              a dict mapping substance keys to scalars or array_like (default: 1).
+            - 't0' (optional): initial time (default: 0).
+
+    fit_keys : iterable of str
+        Keys of the parameters to fit (among ``extra['param_keys']`` and the unique keys
+        of the rate expressions, see :func:`get_odesys`).
+    guess : dict, optional
+        Initial guess per key in ``fit_keys``. Default: the values of the rate expressions.
+    bounds : dict, optional
+        Mapping of keys in ``fit_keys`` to (lower, upper) bounds, also used for sampling
+        the random starting guesses when both are finite.
+    params : dict, optional
+        Values of the remaining parameters.
+    n_starts : int
+        Number of starting guesses, the first one being ``guess``.
+    spread : float
+        Random starting guesses (lacking finite bounds) are sampled log-uniformly within
+        ``spread`` decades of ``guess``.
+    seed : int, optional
+        Seed of the random number generator for the starting guesses.
+    workers : int, optional
+        Number of worker processes, default: in-process (serial) optimization.
+    log_scale : bool
+        Optimize the logarithm of the parameters (which then need to be positive).
+    absolute_sigma : bool
+        When ``False`` the covariance is scaled by the reduced chi-square of the fit
+        (cf. :func:`scipy.optimize.curve_fit`).
+    unit_registry : dict, optional
+        Needed when the series, parameters and guesses are given with units,
+        see :func:`chempy.units.get_derived_unit`.
+    odesys_kwargs : dict, optional
+        Keyword arguments passed to :func:`get_odesys` (default: ``include_params=False``).
+    integrate_kwargs : dict, optional
+        Keyword arguments passed to :meth:`pyodesys.ODESys.integrate`.
+    mp_context : multiprocessing context, optional
+        Passed to :class:`concurrent.futures.ProcessPoolExecutor`.
+    \\*\\*kwargs :
+        Keyword arguments passed on to :func:`scipy.optimize.least_squares`.
+
+    Returns
+    -------
+    params : OrderedDict
+        Best fit values (with the units of ``guess`` when given with units).
+    cov : ndarray of shape ``(len(fit_keys), len(fit_keys))``
+        Covariance of the fitted parameters (in the units of ``params``).
+    info : dict
+        With keys 'success', 'cost', 'message', 'nfev', 'njev', 'dof', 'residuals'
+        and 'starts' (list of dicts with the outcome of each start, sorted by cost).
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from chempy import ReactionSystem, Substance
+    >>> rsys = ReactionSystem.from_string("A -> B; MassAction(unique_keys=('k',))", substance_factory=Substance)
+    >>> tout = np.linspace(0, 2, 9)
+    >>> serie = dict(tout=tout, c0={'A': 1, 'B': 0}, observed={'A': np.exp(-1.7*tout)})
+    >>> best, cov, info = fit_kinetic_params(rsys, [serie], ['k'], guess={'k': 1.0},
+    ...                                      integrate_kwargs=dict(integrator='scipy', atol=1e-12, rtol=1e-10))
+    >>> round(best['k'], 6), bool(info['success'])
+    (1.7, True)
+
+    """
+    fit_keys = tuple(fit_keys)
+    odesys_kwargs = dict({'include_params': False} if odesys_kwargs is None else odesys_kwargs,
+                         sensitivities=fit_keys)
+    if odesys_kwargs.get('unit_registry') is not None:
+        raise ValueError("Pass unit_registry to fit_kinetic_params (not in odesys_kwargs)")
+    integrate_kwargs = integrate_kwargs or {}
+    guess = guess or {}
+    bounds = bounds or {}
+    for k in list(guess) + list(bounds):
+        if k not in fit_keys:
+            raise ValueError("Not in fit_keys: %s" % k)
+
+    odesys, extra = _fit_system(rsys, odesys_kwargs)
+    x_units = []
+    p0 = []
+    for k in fit_keys:
+        if k in guess:
+            value = guess[k]
+        elif extra['unique'].get(k) is not None:
+            value = extra['unique'][k]
+        else:
+            raise ValueError("No guess for: %s" % k)
+        if unit_registry is not None:
+            from ..units import default_unit_in_registry, is_quantity
+            x_units.append(default_unit_in_registry(value, unit_registry) if is_quantity(value) else None)
+        else:
+            x_units.append(None)
+        p0.append(_unitless_param(value, unit_registry))
+    p0 = np.array(p0, dtype=np.float64)
+    lower = np.array([_unitless_param(bounds.get(k, (-np.inf, np.inf))[0], unit_registry)
+                      for k in fit_keys], dtype=np.float64)
+    upper = np.array([_unitless_param(bounds.get(k, (-np.inf, np.inf))[1], unit_registry)
+                      for k in fit_keys], dtype=np.float64)
+    if log_scale:
+        if np.any(p0 <= 0):
+            raise ValueError("log_scale requires positive guesses")
+        with np.errstate(divide='ignore'):
+            lower, upper = np.log(np.maximum(lower, 0)), np.log(upper)
+    if np.any(lower >= upper):
+        raise ValueError("Empty bounds")
+
+    base_params = {k: _unitless_param(v, unit_registry) for k, v in (params or {}).items()}
+    prepared = _prepare_series(rsys, series, unit_registry)
+    for s in prepared:
+        s['params'] = dict(base_params, **s['params'])
+    problem = _FitProblem(rsys, odesys_kwargs, prepared, fit_keys, log_scale, integrate_kwargs)
+
+    x0 = np.clip(problem.from_params(p0), lower, upper)
+    rng = np.random.default_rng(seed)
+    starts = [x0]
+    finite = np.isfinite(lower) & np.isfinite(upper)
+    for _ in range(n_starts - 1):
+        if log_scale:
+            around = x0 + np.log(10)*spread*rng.uniform(-1, 1, x0.size)
+        else:
+            around = x0*10**(spread*rng.uniform(-1, 1, x0.size))
+        starts.append(np.clip(np.where(finite, rng.uniform(np.where(finite, lower, 0), np.where(finite, upper, 1)),
+                                       around), lower, upper))
+
+    global _fit_problem
+    ori = _fit_problem
+    try:
+        if workers is None or workers == 1 or n_starts == 1:
+            _fit_init(problem)
+            outcomes = [_fit_start(x, (lower, upper), kwargs) for x in starts]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=_fit_init,
+                                     initargs=(problem,)) as executor:
+                outcomes = list(executor.map(_fit_start, starts, [(lower, upper)]*len(starts),
+                                             [kwargs]*len(starts)))
+    finally:
+        _fit_problem = ori
+
+    outcomes.sort(key=lambda o: o['cost'])
+    best = outcomes[0]
+    if best['x'] is None:
+        raise RuntimeError("All starts failed, e.g.: %s" % best['message'])
+    p_best = problem.to_params(best['x'])
+    J = best['jac']*(1/p_best if log_scale else 1)  # Jacobian w.r.t. the parameters
+    dof = best['fun'].size - len(fit_keys)
+    cov = np.linalg.pinv(J.T.dot(J))
+    if not absolute_sigma:
+        cov = cov*(2*best['cost']/dof if dof > 0 else np.inf)
+
+    scale = np.ones(len(fit_keys))
+    result = OrderedDict()
+    for i, (k, unit) in enumerate(zip(fit_keys, x_units)):
+        if unit is None:
+            result[k] = float(p_best[i])
+        else:
+            scale[i] = _unitless_param(1*unit, unit_registry)
+            result[k] = p_best[i]/scale[i]*unit
+    cov = cov/np.outer(scale, scale)
+    for o in outcomes:
+        o['params'] = None if o['x'] is None else OrderedDict(zip(fit_keys, problem.to_params(o['x'])))
+        o.pop('jac', None)
+    info = dict(success=best['success'], cost=best['cost'], message=best['message'],
+                nfev=sum(o['nfev'] for o in outcomes), njev=sum(o['njev'] for o in outcomes),
+                dof=dof, residuals=best['fun'], starts=outcomes)
+    return result, cov, info
@@ -0,0 +1,1011 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains a numerical (SymPy free) representation of the
+right-hand-side of the ODE-system of a :class:`ReactionSystem`.
+
+The stoichiometry and the reactant orders of the mass-action rate expressions
+are turned into integer index arrays once, after which the rates and
+their net effect on the concentrations are evaluated using NumPy.
+"""
+from __future__ import (absolute_import, division, print_function)
+
+from collections import OrderedDict
+import math
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from pyodesys import ODESys
+except ImportError:
+    ODESys = object  # makes module importable.
+
+from ..util._expr import Expr, EvaluationContext
+from .rates import MassAction, RadiolyticBase
+
+_FD_REL_STEP = 2**-26  # ~sqrt(machine epsilon)
+
+
+def _required_unique_keys(expr):
+    """ Unique keys of ``expr`` (and its arguments) which lack default values """
+    if expr.args is None:
+        return set(expr.unique_keys or ())
+    keys = set()
+    for arg in expr.args:
+        if isinstance(arg, Expr):
+            keys |= _required_unique_keys(arg)
+    return keys
+
+
+def _default_param_keys(ratexs, substitutions, cstr_fr_fc=None):
+    keys = set()
+    if cstr_fr_fc:
+        keys.add(cstr_fr_fc[0])
+        keys.update(cstr_fr_fc[1].values())
+    for expr in list(ratexs) + [v for v in substitutions.values() if isinstance(v, Expr)]:
+        keys |= expr.all_parameter_keys() | _required_unique_keys(expr)
+    return sorted(k for k in keys if k not in substitutions and k != 'time')
+
+
+def _is_mass_action(ratex):
+    """ Whether ``ratex`` is of (plain) mass-action type, i.e. not overriding its rate law """
+    return (isinstance(ratex, MassAction) and type(ratex).__call__ is MassAction.__call__ and
+            type(ratex).active_conc_prod is MassAction.active_conc_prod)
+
+
+def _is_constant_coeff(ratex, variable_keys):
+    if not _is_mass_action(ratex) or ratex.args is None:
+        return False
+    arg, = ratex.args
+    if isinstance(arg, (Expr, str)) or np.ndim(arg) != 0:
+        return False
+    return not any(uk in variable_keys for uk in (ratex.unique_keys or ()))
+
+
+class NumericRHS(object):
+    """ Numerical representation of the rates of a :class:`ReactionSystem`.
+
+    The reactant orders of all :class:`MassAction` rate expressions are
+    stored as a (padded) index/exponent array pair, and the net stoichiometry
+    as coordinate arrays of its non-zero entries. Rate coefficients which are
+    plain numbers are evaluated once, the remaining ones (and rate expressions
+    which are not of mass-action type, e.g. :class:`Radiolytic`) are evaluated
+    from the parameters on each call.
+
+    All methods accept batched input: ``y`` of shape ``(..., ns)`` and ``p`` of
+    shape ``(..., len(param_keys))``.
+
+    Parameters
+    ----------
+    rsys : ReactionSystem
+    param_keys : iterable of str, optional
+        Order of parameters in ``p``. Default: all (sorted) parameter keys of
+        the rate expressions (and of ``cstr_fr_fc``) which are not in ``substitutions``.
+    ratexs : list of Expr instances, optional
+        Per reaction rate expressions. Default: ``[rxn.rate_expr() for rxn in rsys.rxns]``.
+    substitutions : OrderedDict, optional
+        Evaluated (in order) after the parameters have been assigned, values
+        may be instances of :class:`Expr`.
+    cstr_fr_fc : tuple (str, dict), optional
+        See :meth:`ReactionSystem.rates`.
+
+    Attributes
+    ----------
+    reac_idx : ndarray of ints, shape (nr, max_terms)
+        Substance index of reactant terms, padded with ``ns``.
+    reac_exp : ndarray, shape (nr, max_terms)
+        Exponents corresponding to ``reac_idx`` (padding has exponent zero).
+    net_ridx, net_sidx, net_coeff : ndarrays
+        Coordinate format of the non-zero net stoichiometric coefficients.
+    jac_indptr, jac_indices : ndarrays of ints
+        Sparsity pattern of the Jacobian in compressed sparse row (CSR) format.
+
+    Examples
+    --------
+    >>> from chempy import Reaction, ReactionSystem
+    >>> r1 = Reaction({'A': 2}, {'B': 1}, 3.0)
+    >>> r2 = Reaction({'B': 1}, {'C': 1}, MassAction(unique_keys=('kB',)))
+    >>> rsys = ReactionSystem([r1, r2], 'A B C')
+    >>> rhs = NumericRHS(rsys)
+    >>> rhs.param_keys
+    ('kB',)
+    >>> rhs.f(0, [5, 7, 0], [11]).tolist()
+    [-150.0, -2.0, 77.0]
+
+    """
+
+    def __init__(self, rsys, param_keys=None, ratexs=None, substitutions=None, cstr_fr_fc=None):
+        self.rxns = list(rsys.rxns)
+        self.ratexs = [rxn.rate_expr() for rxn in self.rxns] if ratexs is None else list(ratexs)
+        if len(self.ratexs) != len(self.rxns):
+            raise ValueError("Incorrect number of rate expressions")
+        self.substance_keys = tuple(rsys.substances)
+        self.substitutions = OrderedDict(substitutions or {})
+        if param_keys is None:
+            param_keys = _default_param_keys(self.ratexs, self.substitutions, cstr_fr_fc)
+        self.param_keys = tuple(param_keys)
+        self.cstr_fr_fc = cstr_fr_fc
+
+        idx = {k: i for i, k in enumerate(self.substance_keys)}
+        self._mass_action = np.array([_is_mass_action(ratex) for ratex in self.ratexs], dtype=bool)
+        self._conc_dependent = [  # rate expressions needing concentrations among their variables
+            ri for ri, ratex in enumerate(self.ratexs)
+            if not (self._mass_action[ri] or isinstance(ratex, RadiolyticBase))
+        ]
+
+        max_terms = max([len(rxn.reac) for rxn, ma in zip(self.rxns, self._mass_action) if ma] + [1])
+        exps = [v for rxn in self.rxns for v in rxn.reac.values()]
+        integral = all(float(v).is_integer() for v in exps)
+        self.reac_idx = np.full((self.nr, max_terms), self.ns, dtype=int)
+        self.reac_exp = np.zeros((self.nr, max_terms), dtype=int if integral else np.float64)
+        for ri, rxn in enumerate(self.rxns):
+            if not self._mass_action[ri]:
+                continue
+            for ti, (sk, v) in enumerate(rxn.reac.items()):
+                self.reac_idx[ri, ti] = idx[sk]
+                self.reac_exp[ri, ti] = v
+
+        net = sorted((ri, idx[sk], n) for ri, rxn in enumerate(self.rxns)
+                     for sk, n in zip(rxn.keys(), rxn.net_stoich(rxn.keys())) if n != 0)
+        self.net_ridx, self.net_sidx, self.net_coeff = (
+            np.array([elem[i] for elem in net], dtype=dt) for i, dt in enumerate((int, int, np.float64)))
+
+        variable_keys = set(self.param_keys) | set(self.substitutions)
+        self._k_const = np.zeros(self.nr)
+        self._k_var = []
+        for ri, (rxn, ratex) in enumerate(zip(self.rxns, self.ratexs)):
+            if _is_constant_coeff(ratex, variable_keys):
+                self._k_const[ri] = ratex.rate_coeff({}, reaction=rxn)
+            else:
+                self._k_var.append(ri)
+
+        if cstr_fr_fc:
+            self._cstr_sidx = np.array([idx[sk] for sk in cstr_fr_fc[1]], dtype=int)
+            self._cstr_fc_keys = list(cstr_fr_fc[1].values())
+
+        self._init_jac_sparsity(idx)
+
+    def _init_jac_sparsity(self, idx):
+        # Column dependencies of each reaction's rate: the reactants of mass-action reactions,
+        # all participating substances (see Reaction.keys) for other concentration dependent ones.
+        net_of_rxn = [[] for _ in range(self.nr)]
+        for sidx, ridx, coeff in zip(self.net_sidx, self.net_ridx, self.net_coeff):
+            net_of_rxn[ridx].append((sidx, coeff))
+        self._net_of_rxn = net_of_rxn
+        ma_terms, fd_terms, nonzero = [], [], set()
+        for ri in range(self.nr):
+            if self._mass_action[ri]:
+                for ti in range(len(self.rxns[ri].reac)):
+                    col = self.reac_idx[ri, ti]
+                    for row, coeff in net_of_rxn[ri]:
+                        ma_terms.append((ri, ti, coeff, (row, col)))
+                        nonzero.add((row, col))
+        for ri in self._conc_dependent:
+            for col in sorted(idx[sk] for sk in self.rxns[ri].keys()):
+                for row, coeff in net_of_rxn[ri]:
+                    fd_terms.append((ri, col, coeff, (row, col)))
+                    nonzero.add((row, col))
+        if self.cstr_fr_fc:
+            nonzero.update((si, si) for si in self._cstr_sidx)
+
+        nonzero = sorted(nonzero)
+        pos = {rc: i for i, rc in enumerate(nonzero)}
+        rows = np.array([r for r, c in nonzero], dtype=int)
+        self.jac_indices = np.array([c for r, c in nonzero], dtype=int)
+        self.jac_indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=self.ns)))).astype(int)
+        self._jac_rows = rows
+        self._jac_ma = tuple(np.array([elem[i] for elem in ma_terms], dtype=dt) for i, dt in enumerate(
+            (int, int, np.float64))) + (np.array([pos[elem[3]] for elem in ma_terms], dtype=int),)
+        self._jac_fd = [(ri, col, coeff, pos[rc]) for ri, col, coeff, rc in fd_terms]
+        if self.cstr_fr_fc:
+            self._jac_cstr_pos = np.array([pos[(si, si)] for si in self._cstr_sidx], dtype=int)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_dprefactors_cache', None)  # lambdified by SymPy (recreated on demand)
+        return state
+
+    @property
+    def ns(self):
+        """ Number of substances """
+        return len(self.substance_keys)
+
+    @property
+    def nr(self):
+        """ Number of reactions """
+        return len(self.rxns)
+
+    @property
+    def ny(self):
+        """ Number of dependent variables """
+        return self.ns
+
+    @property
+    def nnz(self):
+        """ Number of structurally non-zero entries in the Jacobian """
+        return len(self.jac_indices)
+
+    def jac_sparsity(self):
+        """ Returns the CSR sparsity pattern (``indptr``, ``indices``) of the Jacobian. """
+        return self.jac_indptr, self.jac_indices
+
+    def subset(self, ridx, cstr=True):
+        """ A :class:`NumericRHS` of the reactions with indices ``ridx`` (same substances & parameters).
+
+        The CSTR terms (if any) are kept when ``cstr`` is ``True``.
+        """
+        from ..reactionsystem import ReactionSystem
+        rsys = ReactionSystem([self.rxns[ri] for ri in ridx], self.substance_keys, checks=())
+        return NumericRHS(rsys, self.param_keys, [self.ratexs[ri] for ri in ridx], self.substitutions,
+                          self.cstr_fr_fc if cstr else None)
+
+    def _batch_shape(self, t, y, p):
+        return np.broadcast_shapes(np.shape(t), np.shape(y)[:-1], np.shape(p)[:-1])
+
+    def variables(self, t, p, y=None, backend=math):
+        """ Returns a dict with parameters, time, substitutions (and optionally concentrations). """
+        if np.ndim(p) > 1:
+            p = np.moveaxis(np.asarray(p), -1, 0)
+        if len(p) != len(self.param_keys):
+            raise ValueError("Incorrect number of parameters: %d (expected %d)" % (len(p), len(self.param_keys)))
+        variables = EvaluationContext(zip(self.param_keys, p))
+        if 'time' in variables:
+            raise ValueError("Key 'time' is reserved.")
+        variables['time'] = t
+        if y is not None:
+            variables.update(zip(self.substance_keys, np.moveaxis(y, -1, 0)))
+        for k, v in self.substitutions.items():
+            variables[k] = v(variables, backend=backend) if isinstance(v, Expr) else v
+        return variables
+
+    def _needs_variables(self):
+        return len(self._k_var) > 0 or bool(self.cstr_fr_fc)
+
+    def _compiled_k_var(self):
+        """ The prefactors of the non-constant reactions compiled into one function (``None`` if untraceable) """
+        if '_compiled_k_var_cache' not in self.__dict__:
+            from ..util._expr_compile import compile_exprs
+            order = list(self.param_keys) + ['time']
+            order += [k for k, v in self.substitutions.items() if isinstance(v, Expr)]
+            if self._conc_dependent:
+                order += list(self.substance_keys)
+            constants = {k: v for k, v in self.substitutions.items() if not isinstance(v, Expr)}
+            cbs = []
+            for ri in self._k_var:
+                rxn, ratex = self.rxns[ri], self.ratexs[ri]
+                if self._mass_action[ri]:
+                    cbs.append(lambda v, be, rxn=rxn, ratex=ratex: ratex.rate_coeff(v, backend=be, reaction=rxn))
+                else:
+                    cbs.append(lambda v, be, rxn=rxn, ratex=ratex: ratex(v, backend=be, reaction=rxn))
+            try:
+                compiled = compile_exprs(cbs, order, constants=constants)
+            except (NotImplementedError, KeyError):
+                compiled = None
+            self._compiled_k_var_cache = compiled
+        return self._compiled_k_var_cache
+
+    def _prefactors(self, variables, batch, backend):
+        out = np.empty(batch + (self.nr,))
+        out[...] = self._k_const
+        if not self._k_var:
+            return out
+        compiled = self._compiled_k_var() if backend in (math, np) else None
+        if compiled is not None:
+            out[..., self._k_var] = compiled.from_dict(variables)
+            return out
+        for ri in self._k_var:
+            rxn, ratex = self.rxns[ri], self.ratexs[ri]
+            if self._mass_action[ri]:
+                out[..., ri] = ratex.rate_coeff(variables, backend=backend, reaction=rxn)
+            else:
+                out[..., ri] = ratex(variables, backend=backend, reaction=rxn)
+        return out
+
+    def _conc_prod(self, y):
+        y_ext = np.concatenate((y, np.ones(y.shape[:-1] + (1,))), axis=-1)
+        return np.prod(y_ext[..., self.reac_idx]**self.reac_exp, axis=-1)
+
+    def _conc_prod_partials(self, y):
+        """ Derivatives of the concentration products w.r.t. each reactant term, shape ``(..., nr, max_terms)``. """
+        y_ext = np.concatenate((y, np.ones(y.shape[:-1] + (1,))), axis=-1)
+        conc = y_ext[..., self.reac_idx]
+        powers = conc**self.reac_exp
+        ones = np.ones(powers.shape[:-1] + (1,))
+        left = np.cumprod(np.concatenate((ones, powers[..., :-1]), axis=-1), axis=-1)
+        right = np.cumprod(np.concatenate((ones, powers[..., :0:-1]), axis=-1), axis=-1)[..., ::-1]
+        with np.errstate(divide='ignore'):
+            dpow = np.where(self.reac_exp == 0, 0, self.reac_exp*conc**(self.reac_exp - 1))
+        return dpow*left*right
+
+    @staticmethod
+    def _sum_into(idx, weights, n):
+        if weights.ndim == 1:
+            return np.bincount(idx, weights=weights, minlength=n).astype(np.float64, copy=False)  # int if empty
+        out = np.zeros(weights.shape[:-1] + (n,))
+        np.add.at(out, (Ellipsis, idx), weights)
+        return out
+
+    def _scatter(self, r):
+        return self._sum_into(self.net_sidx, r[..., self.net_ridx]*self.net_coeff, self.ns)
+
+    def _setup(self, t, y, p, backend):
+        t = np.asarray(t, dtype=np.float64) if np.ndim(t) > 0 else t  # e.g. lists
+        y = np.asarray(y, dtype=np.float64)
+        p = np.asarray(p, dtype=np.float64)
+        batch = self._batch_shape(t, y, p)
+        if backend is None:
+            backend = np if batch else math
+        if self._needs_variables():
+            variables = self.variables(t, p, y if self._conc_dependent else None, backend=backend)
+        else:
+            variables = None
+        return y, batch, backend, variables
+
+    def _fd_rate_partial(self, ri, col, y, variables, backend, r0):
+        rxn, ratex = self.rxns[ri], self.ratexs[ri]
+        ycol = y[..., col]
+        scale = np.max(np.abs(y), axis=-1)
+        h = _FD_REL_STEP*np.maximum(np.abs(ycol), np.where(scale > 0, scale, 1))
+        perturbed = dict(variables)
+        perturbed[self.substance_keys[col]] = ycol + h
+        return (ratex(perturbed, backend=backend, reaction=rxn) - r0)/h
+
+    def jac_data(self, t, y, p=(), backend=None):
+        """ Non-zero entries of the Jacobian (ordered as :attr:`jac_indices`), shape ``(..., nnz)``.
+
+        The derivatives of mass-action rates are evaluated analytically, other
+        concentration dependent rate expressions are differentiated by finite differences.
+        """
+        y, batch, backend, variables = self._setup(t, y, p, backend)
+        prefactors = self._prefactors(variables, batch, backend)
+        ridx, tidx, coeff, pos = self._jac_ma
+        partials = prefactors[..., None]*self._conc_prod_partials(y)
+        data = self._sum_into(pos, partials[..., ridx, tidx]*coeff, self.nnz)
+        for ri, col, coeff, pos in self._jac_fd:
+            data[..., pos] += coeff*self._fd_rate_partial(ri, col, y, variables, backend, prefactors[..., ri])
+        if self.cstr_fr_fc:
+            data[..., self._jac_cstr_pos] -= np.asarray(variables[self.cstr_fr_fc[0]])[..., None]
+        return data
+
+    def jac_csr(self, t, y, p=(), backend=None):
+        """ Jacobian as an instance of ``scipy.sparse.csr_matrix`` (structural zeros are kept). """
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.jac_data(t, y, p, backend), self.jac_indices, self.jac_indptr),
+                          shape=(self.ns, self.ns))
+
+    def jac(self, t, y, p=(), backend=None):
+        """ Dense Jacobian, shape ``(..., ns, ns)``. """
+        data = self.jac_data(t, y, p, backend)
+        out = np.zeros(data.shape[:-1] + (self.ns, self.ns))
+        out[..., self._jac_rows, self.jac_indices] = data
+        return out
+
+    def _dprefactors_dp(self, keys):
+        """ Non-zero derivatives of the prefactors w.r.t. ``keys`` as list of (ridx, kidx, callback) """
+        cache = self.__dict__.setdefault('_dprefactors_cache', {})
+        if keys not in cache:
+            import sympy
+            t = sympy.Symbol('t')
+            ys = sympy.symbols('y_:%d' % self.ns)
+            ps = sympy.symbols('p_:%d' % len(self.param_keys))
+            variables = dict(zip(self.param_keys, ps))
+            variables['time'] = t
+            variables.update(zip(self.substance_keys, ys))
+            for k, v in self.substitutions.items():
+                variables[k] = v(variables, backend=sympy) if isinstance(v, Expr) else v
+            terms = []
+            for ri, (rxn, ratex) in enumerate(zip(self.rxns, self.ratexs)):
+                if self._mass_action[ri]:
+                    expr = ratex.rate_coeff(variables, backend=sympy, reaction=rxn)
+                else:
+                    expr = ratex(variables, backend=sympy, reaction=rxn)
+                for ki, k in enumerate(keys):
+                    d = sympy.diff(sympy.sympify(expr), ps[self.param_keys.index(k)])
+                    if d != 0:
+                        terms.append((ri, ki, sympy.lambdify((t, ys, ps), d, modules='numpy')))
+            cache[keys] = terms
+        return cache[keys]
+
+    def dfdp(self, t, y, p=(), keys=None, backend=None):
+        """ Derivatives of :meth:`f` w.r.t. the parameters, shape ``(..., ns, len(keys))``.
+
+        The derivatives of the rate coefficients (e.g. of :class:`Arrhenius` parameters) are
+        obtained by symbolic differentiation (using SymPy) on the first call for a set of ``keys``.
+
+        Parameters
+        ----------
+        t, y, p, backend :
+            See :meth:`f`.
+        keys : iterable of str, optional
+            Subset of :attr:`param_keys` (default: all).
+
+        """
+        keys = self.param_keys if keys is None else tuple(keys)
+        for k in keys:
+            if k not in self.param_keys:
+                raise ValueError("Unknown parameter key: %s" % k)
+        y, batch, backend, variables = self._setup(t, y, p, backend)
+        conc_prod = self._conc_prod(y)  # unity for rate expressions not of mass-action type
+        yseq = np.moveaxis(y, -1, 0)
+        pseq = np.moveaxis(np.asarray(p, dtype=np.float64), -1, 0)
+        out = np.zeros(batch + (self.ns, len(keys)))
+        tarr = np.asarray(t, dtype=np.float64)
+        for ri, ki, cb in self._dprefactors_dp(keys):
+            dr = np.broadcast_to(cb(tarr, yseq, pseq), batch)*conc_prod[..., ri]
+            for sidx, coeff in self._net_of_rxn[ri]:
+                out[..., sidx, ki] += coeff*dr
+        if self.cstr_fr_fc:
+            fr_key = self.cstr_fr_fc[0]
+            if fr_key in keys:
+                fc = np.stack([np.broadcast_to(variables[k], batch) for k in self._cstr_fc_keys], axis=-1)
+                out[..., self._cstr_sidx, keys.index(fr_key)] += fc - y[..., self._cstr_sidx]
+            for sidx, fck in zip(self._cstr_sidx, self._cstr_fc_keys):
+                if fck in keys:
+                    out[..., sidx, keys.index(fck)] += variables[fr_key]
+        return out
+
+    def rate_coeffs(self, t, y, p=(), backend=None):
+        """ Per reaction prefactors of the concentration products.
+
+        For mass-action reactions this is the rate coefficient, for
+        other rate expressions it is the rate itself.
+        """
+        y, batch, backend, variables = self._setup(t, y, p, backend)
+        return self._prefactors(variables, batch, backend)
+
+    def rates(self, t, y, p=(), backend=None):
+        """ Per reaction rates, shape ``(..., nr)``. """
+        y, batch, backend, variables = self._setup(t, y, p, backend)
+        return self._prefactors(variables, batch, backend)*self._conc_prod(y)
+
+    def f(self, t, y, p=(), backend=None):
+        """ Time derivatives of the concentrations, shape ``(..., ns)``.
+
+        Parameters
+        ----------
+        t : float or array_like
+        y : array_like
+            Concentrations (last axis ordered as ``substance_keys``).
+        p : array_like
+            Parameters (last axis ordered as ``param_keys``).
+        backend : module, optional
+            Used by the parameter expressions, default: ``math`` for unbatched
+            input, otherwise ``numpy``.
+
+        Sequences (e.g. lists) are converted to arrays (of ``float64``).
+
+        """
+        y, batch, backend, variables = self._setup(t, y, p, backend)
+        return self._dydt(self._prefactors(variables, batch, backend)*self._conc_prod(y), y, batch, variables)
+
+    def _dydt(self, r, y, batch, variables):
+        dydt = self._scatter(r)
+        if self.cstr_fr_fc:
+            fr = np.asarray(variables[self.cstr_fr_fc[0]])[..., None]
+            fc = np.stack([np.broadcast_to(variables[k], batch) for k in self._cstr_fc_keys], axis=-1)
+            dydt[..., self._cstr_sidx] += fr*(fc - y[..., self._cstr_sidx])
+        return dydt
+
+
+class SensitivityRHS(object):
+    r""" Right-hand-side of a :class:`NumericRHS` augmented with forward sensitivities.
+
+    The dependent variables are the concentrations followed by the sensitivities
+    :math:`S_j = \partial y / \partial p_j` (one block of ``ns`` per parameter), with
+
+    .. math ::
+
+        \frac{dS_j}{dt} = J S_j + \frac{\partial f}{\partial p_j}
+
+    The Jacobian callbacks return the block diagonal part (the state Jacobian
+    repeated along the diagonal) of the Jacobian of the augmented system. Hence the
+    Newton matrix of an implicit integrator consists of identical blocks (as in the
+    simultaneous corrector of CVODES), and the (neglected) second order terms only
+    affect the rate of convergence of the Newton iterations, not the accuracy.
+
+    Parameters
+    ----------
+    kernel : NumericRHS
+    keys : iterable of str
+        Parameter keys (subset of ``kernel.param_keys``).
+
+    """
+
+    def __init__(self, kernel, keys):
+        self.kernel = kernel
+        self.keys = tuple(keys)
+        for k in self.keys:
+            if k not in kernel.param_keys:
+                raise ValueError("Unknown parameter key: %s" % k)
+        nb = 1 + len(self.keys)
+        ns, nnz = kernel.ns, kernel.nnz
+        self.jac_indices = np.concatenate([kernel.jac_indices + b*ns for b in range(nb)]).astype(int)
+        self.jac_indptr = np.concatenate([[0]] + [kernel.jac_indptr[1:] + b*nnz for b in range(nb)]).astype(int)
+        self._jac_rows = np.concatenate([kernel._jac_rows + b*ns for b in range(nb)]).astype(int)
+
+    @property
+    def param_keys(self):
+        return self.kernel.param_keys
+
+    @property
+    def ns(self):
+        """ Number of substances """
+        return self.kernel.ns
+
+    @property
+    def ny(self):
+        """ Number of dependent variables (concentrations & sensitivities) """
+        return self.ns*(1 + len(self.keys))
+
+    @property
+    def nnz(self):
+        return len(self.jac_indices)
+
+    def jac_sparsity(self):
+        """ Returns the CSR sparsity pattern (``indptr``, ``indices``) of the (block diagonal) Jacobian. """
+        return self.jac_indptr, self.jac_indices
+
+    def _split(self, y):
+        y = np.asarray(y, dtype=np.float64)
+        return y[..., :self.ns], y[..., self.ns:].reshape(y.shape[:-1] + (len(self.keys), self.ns))
+
+    def sensitivities(self, y):
+        """ Sensitivities from (augmented) ``y``, shape ``(..., ns, len(keys))``. """
+        return np.swapaxes(self._split(y)[1], -1, -2)
+
+    def rates(self, t, y, p=(), backend=None):
+        return self.kernel.rates(t, self._split(y)[0], p, backend)
+
+    def f(self, t, y, p=(), backend=None):
+        kernel = self.kernel
+        c, S = self._split(y)
+        data = kernel.jac_data(t, c, p, backend)
+        JS = kernel._sum_into(kernel._jac_rows, data[..., None, :]*S[..., kernel.jac_indices], self.ns)
+        dS = JS + np.swapaxes(kernel.dfdp(t, c, p, self.keys, backend), -1, -2)
+        return np.concatenate((kernel.f(t, c, p, backend), dS.reshape(dS.shape[:-2] + (-1,))), axis=-1)
+
+    def jac_data(self, t, y, p=(), backend=None):
+        data = self.kernel.jac_data(t, self._split(y)[0], p, backend)
+        return np.concatenate([data]*(1 + len(self.keys)), axis=-1)
+
+    def jac_csr(self, t, y, p=(), backend=None):
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.jac_data(t, y, p, backend), self.jac_indices, self.jac_indptr),
+                          shape=(self.ny, self.ny))
+
+    def jac(self, t, y, p=(), backend=None):
+        data = self.jac_data(t, y, p, backend)
+        out = np.zeros(data.shape[:-1] + (self.ny, self.ny))
+        out[..., self._jac_rows, self.jac_indices] = data
+        return out
+
+
+class ExtentRHS(object):
+    r""" Right-hand-side of a :class:`NumericRHS` augmented with reaction extents.
+
+    The dependent variables are the concentrations followed by the extents
+    :math:`\xi_i` of the selected reactions, with :math:`d\xi_i/dt = r_i`.
+    Since no rate depends on the extents, their columns of the Jacobian are
+    empty: the sparsity pattern only grows by one row per extent (holding the
+    reactant partials of that reaction's rate).
+
+    Parameters
+    ----------
+    kernel : NumericRHS
+    ridx : iterable of ints
+        Indices of the reactions whose extents are integrated.
+
+    """
+
+    def __init__(self, kernel, ridx):
+        self.kernel = kernel
+        self.ridx = np.array(ridx, dtype=int).reshape(-1)
+        if np.any((self.ridx < 0) | (self.ridx >= kernel.nr)):
+            raise ValueError("Reaction index out of range")
+        idx = {k: i for i, k in enumerate(kernel.substance_keys)}
+        conc_dependent = set(kernel._conc_dependent)
+        ma_terms, fd_terms, indices, indptr = [], [], [], [0]
+        for ri in self.ridx:
+            if kernel._mass_action[ri]:
+                terms = sorted((kernel.reac_idx[ri, ti], ti) for ti in range(len(kernel.rxns[ri].reac)))
+                for col, ti in terms:
+                    ma_terms.append((ri, ti, kernel.nnz + len(indices)))
+                    indices.append(col)
+            elif ri in conc_dependent:
+                for col in sorted(idx[sk] for sk in kernel.rxns[ri].keys()):
+                    fd_terms.append((ri, col, kernel.nnz + len(indices)))
+                    indices.append(col)
+            indptr.append(len(indices))
+        self._ext_ma = tuple(np.array([term[i] for term in ma_terms], dtype=int) for i in range(3))
+        self._ext_fd = fd_terms
+        self.jac_indices = np.concatenate((kernel.jac_indices, np.array(indices, dtype=int))).astype(int)
+        self.jac_indptr = np.concatenate((kernel.jac_indptr, kernel.nnz + np.array(indptr[1:], dtype=int)))
+        self._jac_rows = np.concatenate((kernel._jac_rows, kernel.ns + np.repeat(
+            np.arange(self.ridx.size), np.diff(indptr)))).astype(int)
+
+    @property
+    def param_keys(self):
+        return self.kernel.param_keys
+
+    @property
+    def ns(self):
+        """ Number of substances """
+        return self.kernel.ns
+
+    @property
+    def ny(self):
+        """ Number of dependent variables (concentrations & extents) """
+        return self.ns + self.ridx.size
+
+    @property
+    def nnz(self):
+        return len(self.jac_indices)
+
+    def jac_sparsity(self):
+        """ Returns the CSR sparsity pattern (``indptr``, ``indices``) of the Jacobian. """
+        return self.jac_indptr, self.jac_indices
+
+    def extents(self, y):
+        """ Extents from (augmented) ``y``, shape ``(..., len(ridx))``. """
+        return np.asarray(y)[..., self.ns:]
+
+    def rates(self, t, y, p=(), backend=None):
+        return self.kernel.rates(t, np.asarray(y, dtype=np.float64)[..., :self.ns], p, backend)
+
+    def f(self, t, y, p=(), backend=None):
+        kernel = self.kernel
+        c, batch, backend, variables = kernel._setup(t, np.asarray(y, dtype=np.float64)[..., :self.ns], p, backend)
+        r = kernel._prefactors(variables, batch, backend)*kernel._conc_prod(c)
+        return np.concatenate((kernel._dydt(r, c, batch, variables), r[..., self.ridx]), axis=-1)
+
+    def _rate_partials_data(self, t, c, p, backend):
+        kernel = self.kernel
+        c, batch, backend, variables = kernel._setup(t, c, p, backend)
+        prefactors = kernel._prefactors(variables, batch, backend)
+        out = np.zeros(batch + (self.nnz - kernel.nnz,))
+        ridx, tidx, pos = self._ext_ma
+        if pos.size:
+            out[..., pos - kernel.nnz] = (prefactors[..., None]*kernel._conc_prod_partials(c))[..., ridx, tidx]
+        for ri, col, pos in self._ext_fd:
+            out[..., pos - kernel.nnz] = kernel._fd_rate_partial(ri, col, c, variables, backend, prefactors[..., ri])
+        return out
+
+    def rate_partials(self, t, y, p=(), backend=None):
+        """ Partial derivatives of the rates of the selected reactions, shape ``(..., len(ridx), ns)``. """
+        data = self._rate_partials_data(t, np.asarray(y, dtype=np.float64)[..., :self.ns], p, backend)
+        out = np.zeros(data.shape[:-1] + (self.ridx.size, self.ns))
+        nnz = self.kernel.nnz
+        out[..., self._jac_rows[nnz:] - self.ns, self.jac_indices[nnz:]] = data
+        return out
+
+    def jac_data(self, t, y, p=(), backend=None):
+        c = np.asarray(y, dtype=np.float64)[..., :self.ns]
+        data = self.kernel.jac_data(t, c, p, backend)
+        return np.concatenate((data, self._rate_partials_data(t, c, p, backend)), axis=-1)
+
+    def jac_csr(self, t, y, p=(), backend=None):
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.jac_data(t, y, p, backend), self.jac_indices, self.jac_indptr),
+                          shape=(self.ny, self.ny))
+
+    def jac(self, t, y, p=(), backend=None):
+        data = self.jac_data(t, y, p, backend)
+        out = np.zeros(data.shape[:-1] + (self.ny, self.ny))
+        out[..., self._jac_rows, self.jac_indices] = data
+        return out
+
+
+class EquilibriumRHS(object):
+    r""" Right-hand-side of a :class:`NumericRHS` with fast equilibria as algebraic constraints.
+
+    Each pair of (mass-action) reactions forming an equilibrium (see
+    :meth:`ReactionSystem.identify_equilibria`) is replaced by the constraint that
+    its net rate :math:`r_k = r_{f,k} - r_{b,k}` vanishes (i.e. the reaction quotient
+    equals :math:`K_k = k_{f,k}/k_{b,k}`). The concentrations move along the
+    equilibria with velocities :math:`\dot{\xi}` keeping the constraints satisfied
+    (the index-1 DAE differentiated once):
+
+    .. math ::
+
+        \frac{dy}{dt} = f_s + N^T \dot{\xi}, \quad
+        \left(\frac{\partial r}{\partial y} N^T\right) \dot{\xi} = -\frac{\partial r}{\partial y} f_s
+
+    where :math:`f_s` is the right-hand-side of the remaining (slow) reactions and the
+    rows of :math:`N` are the net stoichiometries of the forward reactions. The fast
+    relaxation modes are thereby removed from the Jacobian. The initial concentrations
+    need to satisfy the constraints (see :meth:`equilibrate`), the equilibrium constants
+    are assumed not to depend explicitly on time.
+
+    The Jacobian callbacks approximate the Jacobian as the projection of the Jacobian
+    of the slow reactions (neglecting the curvature of the constraints), which only
+    affects the rate of convergence of the Newton iterations of implicit integrators.
+
+    Parameters
+    ----------
+    kernel : NumericRHS
+    pairs : iterable of pairs of ints
+        Indices of the forward & backward reactions of the equilibria.
+
+    """
+
+    def __init__(self, kernel, pairs):
+        self.kernel = kernel
+        self.pairs = tuple((int(fw), int(bw)) for fw, bw in pairs)
+        fast = [ri for pair in self.pairs for ri in pair]
+        if len(set(fast)) != len(fast):
+            raise ValueError("Reactions occur in more than one pair")
+        for ri in fast:
+            if not kernel._mass_action[ri]:
+                raise ValueError("Equilibria require mass-action reactions")
+        self.slow = kernel.subset([ri for ri in range(kernel.nr) if ri not in fast])
+        self.fast = ExtentRHS(kernel.subset(fast, cstr=False), range(len(fast)))
+        self.stoich = np.zeros((len(self.pairs), kernel.ns))
+        for ri, sidx, coeff in zip(kernel.net_ridx, kernel.net_sidx, kernel.net_coeff):
+            if ri in fast[::2]:
+                self.stoich[fast[::2].index(ri), sidx] = coeff
+        ny = kernel.ns
+        self.jac_indices = np.tile(np.arange(ny), ny)
+        self.jac_indptr = np.arange(0, ny*ny + 1, ny)
+        self._jac_rows = np.repeat(np.arange(ny), ny)
+
+    @property
+    def param_keys(self):
+        return self.kernel.param_keys
+
+    @property
+    def ns(self):
+        """ Number of substances """
+        return self.kernel.ns
+
+    @property
+    def ny(self):
+        return self.ns
+
+    @property
+    def nnz(self):
+        return len(self.jac_indices)
+
+    def jac_sparsity(self):
+        """ Returns the CSR sparsity pattern (``indptr``, ``indices``) of the (dense) Jacobian. """
+        return self.jac_indptr, self.jac_indices
+
+    def net_rates(self, t, y, p=(), backend=None):
+        """ Net rates of the equilibria, shape ``(..., len(pairs))``. """
+        r = self.fast.rates(t, y, p, backend)
+        return r[..., ::2] - r[..., 1::2]
+
+    def _constraint_jac(self, t, y, p, backend):
+        drdy = self.fast.rate_partials(t, y, p, backend)
+        return drdy[..., ::2, :] - drdy[..., 1::2, :]
+
+    def _projection(self, t, y, p, backend):
+        G = self._constraint_jac(t, y, p, backend)
+        A = G @ self.stoich.T
+        return np.eye(self.ns) - self.stoich.T @ np.linalg.solve(A, G)
+
+    def rates(self, t, y, p=(), backend=None):
+        return self.kernel.rates(t, y, p, backend)
+
+    def f(self, t, y, p=(), backend=None):
+        y = np.asarray(y, dtype=np.float64)
+        fs = self.slow.f(t, y, p, backend)
+        return (self._projection(t, y, p, backend) @ fs[..., None])[..., 0]
+
+    def jac(self, t, y, p=(), backend=None):
+        y = np.asarray(y, dtype=np.float64)
+        return self._projection(t, y, p, backend) @ self.slow.jac(t, y, p, backend)
+
+    def jac_data(self, t, y, p=(), backend=None):
+        J = self.jac(t, y, p, backend)
+        return J.reshape(J.shape[:-2] + (-1,))
+
+    def jac_csr(self, t, y, p=(), backend=None):
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.jac_data(t, y, p, backend), self.jac_indices, self.jac_indptr),
+                          shape=(self.ny, self.ny))
+
+    def equilibrate(self, t, y, p=(), rtol=1e-12, maxiter=100):
+        """ Concentrations satisfying the constraints (reachable from ``y`` through the equilibria)
+
+        Newton's method on the extents of the equilibria, steps are limited to
+        keep the concentrations non-negative.
+
+        Parameters
+        ----------
+        t : float
+        y : array_like
+            Concentrations (unbatched).
+        p : array_like
+        rtol : float
+            Tolerance of the net rates relative to the forward & backward rates.
+        maxiter : int
+
+        """
+        y = np.array(y, dtype=np.float64)
+        if not self.pairs:
+            return y
+        for _ in range(maxiter):
+            r = self.fast.rates(t, y, p)
+            net = r[::2] - r[1::2]
+            if np.all(np.abs(net) <= rtol*np.maximum(r[::2], r[1::2])):
+                return y
+            A = self._constraint_jac(t, y, p, None) @ self.stoich.T
+            dy = np.linalg.solve(A, -net) @ self.stoich
+            with np.errstate(divide='ignore', invalid='ignore'):
+                limits = np.where(dy < 0, -y/dy, np.inf)
+            scale = min(1.0, 0.9*np.min(limits))
+            y = np.maximum(y + scale*dy, 0)
+        raise ValueError("Failed to equilibrate (maxiter=%d)" % maxiter)
+
+
+def _rebuild_numeric_sys(cls, kernel, sparse, breakpoints, kwargs):
+    return cls(kernel, sparse, breakpoints, **kwargs)
+
+
+class NumericSys(ODESys):
+    """ A :class:`pyodesys.ODESys` evaluating its callbacks through a :class:`NumericRHS`.
+
+    In addition to the integrators of :class:`pyodesys.ODESys` this class supports
+    ``integrator='solve_ivp'`` (see :meth:`_integrate_solve_ivp`), which does not
+    require any compiled extension modules.
+
+    Parameters
+    ----------
+    kernel : NumericRHS or SensitivityRHS
+    sparse : bool
+        When ``True`` the Jacobian callback returns a ``scipy.sparse.csr_matrix``
+        (and ``nnz`` is set), allowing e.g. CVODE to use a sparse (KLU) solver.
+    breakpoints : iterable of floats, optional
+        Times where the right-hand-side is discontinuous (e.g. switching times of a
+        :class:`chempy.kinetics.rates.TimeSchedule`), the ``'solve_ivp'`` integrator
+        restarts at these (within the same call to ``integrate``).
+    \\*\\*kwargs :
+        Keyword arguments passed on to :class:`pyodesys.ODESys`.
+
+    Notes
+    -----
+    Instances can be pickled (e.g. sent to ``multiprocessing`` workers) when the keyword
+    arguments can: the system is reconstructed from the kernel (stoichiometry index arrays
+    and rate expressions) without any symbolic manipulation.
+
+    """
+
+    def __init__(self, kernel, sparse=False, breakpoints=None, **kwargs):
+        self.kernel = kernel
+        self.sparse = sparse
+        self.breakpoints = () if breakpoints is None else tuple(sorted(breakpoints))
+        self._init_kwargs = dict(kwargs)
+        if sparse:
+            kwargs['nnz'] = kernel.nnz
+        super(NumericSys, self).__init__(kernel.f, kernel.jac_csr if sparse else kernel.jac, **kwargs)
+
+    def __reduce__(self):
+        # Reconstructed from the (picklable) kernel, the callbacks of ODESys are bound methods & closures.
+        return _rebuild_numeric_sys, (type(self), self.kernel, self.sparse, self.breakpoints, self._init_kwargs)
+
+    def _integrate_scipy(self, *args, **kwargs):
+        if not self.sparse:
+            return super(NumericSys, self)._integrate_scipy(*args, **kwargs)
+        j_cb, self.j_cb = self.j_cb, self.kernel.jac  # scipy.integrate.ode requires a dense jacobian
+        try:
+            return super(NumericSys, self)._integrate_scipy(*args, **kwargs)
+        finally:
+            self.j_cb = j_cb
+
+    def _integrate_solve_ivp(self, intern_xout, intern_y0, intern_p, atol=1e-8, rtol=1e-8,
+                             first_step=None, with_jacobian=True, force_predefined=False,
+                             method='BDF', **kwargs):
+        """ Do not use directly (use ``integrate(..., integrator='solve_ivp')``).
+
+        Uses `scipy.integrate.solve_ivp <https://docs.scipy.org/doc/scipy/reference/
+        generated/scipy.integrate.solve_ivp.html>`_ with a vectorized right-hand-side
+        (evaluating all columns of the finite difference stencil in one call).
+
+        Parameters
+        ----------
+        \\*args :
+            See :meth:`pyodesys.ODESys.integrate`.
+        with_jacobian : bool
+            When ``True`` the analytic Jacobian is used (``scipy.sparse.csr_matrix``
+            if the system was created with ``sparse=True``, except for 'LSODA'), otherwise
+            the Jacobian is approximated by finite differences using the sparsity pattern
+            of the reaction network (``jac_sparsity``).
+        method : str
+            One of the implicit methods: 'BDF', 'Radau' or 'LSODA'.
+        \\*\\*kwargs :
+            Keyword arguments passed onto ``solve_ivp``.
+
+        Returns
+        -------
+        See :meth:`pyodesys.ODESys.integrate`.
+        """
+        from scipy.integrate import solve_ivp
+        from scipy.sparse import csr_matrix
+        if method not in ('BDF', 'Radau', 'LSODA'):
+            raise ValueError("Unknown method: %s (expected one of 'BDF', 'Radau', 'LSODA')" % method)
+        kernel = self.kernel
+        nx = intern_xout.shape[-1]
+        pattern = csr_matrix((np.ones(kernel.nnz), kernel.jac_indices, kernel.jac_indptr),
+                             shape=(kernel.ny, kernel.ny))
+        results = []
+        for _xout, _y0, _p in zip(intern_xout, intern_y0, intern_p):
+            def rhs(t, y):
+                rhs.ncall += 1
+                return kernel.f(t, y.T, _p).T  # y has shape (ny, k) with vectorized=True
+            rhs.ncall = 0
+
+            ivp_kw = dict(method=method, atol=atol, rtol=rtol, vectorized=True)
+            if first_step is not None:
+                ivp_kw['first_step'] = first_step
+            if with_jacobian:
+                jac_cb = kernel.jac_csr if self.sparse and method != 'LSODA' else kernel.jac
+
+                def jac(t, y):
+                    jac.ncall += 1
+                    return jac_cb(t, y, _p)
+                jac.ncall = 0
+                ivp_kw['jac'] = jac
+            elif method != 'LSODA':
+                ivp_kw['jac_sparsity'] = pattern
+            predefined = nx > 2 or force_predefined
+            ivp_kw.update(kwargs)
+
+            # restart at discontinuities: the output points are distributed over the segments
+            direction = 1 if _xout[-1] >= _xout[0] else -1
+            lo, hi = sorted((_xout[0], _xout[-1]))
+            switches = [bp for bp in self.breakpoints[::direction] if lo < bp < hi]
+            bounds = [_xout[0]] + switches + [_xout[-1]]
+            seg_idx = np.searchsorted(direction*np.array(switches), direction*_xout, side='left')
+            xs, ys = [_xout[:1]] if predefined else [], [_y0[None, :]] if predefined else []
+            counts = dict(nfev=0, njev=0, nlu=0)
+            y_start = _y0
+            time_cpu, time_wall = time.process_time(), time.time()
+            for si, (x_start, x_end) in enumerate(zip(bounds[:-1], bounds[1:])):
+                if predefined:
+                    t_eval = _xout[(seg_idx == si) & (_xout != x_start)]
+                    requested = t_eval.size
+                    if requested == 0 or t_eval[-1] != x_end:
+                        t_eval = np.append(t_eval, x_end)
+                    ivp_kw['t_eval'] = t_eval
+                sol = solve_ivp(rhs, (x_start, x_end), y_start, **ivp_kw)
+                if not sol.success:
+                    raise RuntimeError("solve_ivp failed: %s" % sol.message)
+                for k in counts:
+                    counts[k] += getattr(sol, k)
+                y_start = sol.y[:, -1]
+                if predefined:
+                    xs.append(sol.t[:requested])
+                    ys.append(sol.y.T[:requested])
+                else:
+                    xs.append(sol.t if si == 0 else sol.t[1:])
+                    ys.append(sol.y.T if si == 0 else sol.y.T[1:])
+            time_cpu, time_wall = time.process_time() - time_cpu, time.time() - time_wall
+            xout_, yout_ = np.concatenate(xs), np.concatenate(ys)
+            info = {
+                'internal_xout': xout_,
+                'internal_yout': yout_,
+                'internal_params': _p,
+                'success': sol.success,
+                'message': sol.message,
+                'nfev': counts['nfev'],
+                'njev': counts['njev'],
+                'nlu': counts['nlu'],
+                'n_steps': -1 if predefined else len(xout_) - 1,
+                'n_restarts': len(switches),
+                'name': 'solve_ivp',
+                'method': method,
+                'mode': 'predefined' if predefined else 'adaptive',
+                'atol': atol,
+                'rtol': rtol,
+                'time_cpu': time_cpu,
+                'time_wall': time_wall,
+            }
+            results.append(info)
+        return results
+
+    @property
+    def ny(self):
+        return self.kernel.ny
@@ -11,6 +11,7 @@ from functools import reduce, partial
 from itertools import chain
 from operator import attrgetter, mul
 import math
+import sys
 import warnings
 
 try:
@@ -23,7 +24,7 @@ from ..units import (
     default_unit_in_registry, default_units as u
 )
 from ..util.pyutil import deprecated
-from ..util._expr import Expr, Symbol
+from ..util._expr import Expr, Symbol, EvaluationContext
 from .rates import RateExpr, MassAction
 
 
@@ -105,7 +106,8 @@ def dCdt_list(rsys, rates):
 
 
 def get_odesys(rsys, include_params=True, substitutions=None, SymbolicSys=None, unit_registry=None,
-               output_conc_unit=None, output_time_unit=None, cstr=False, constants=None, **kwargs):
+               output_conc_unit=None, output_time_unit=None, cstr=False, constants=None, engine='symbolic',
+               cache=None, sensitivities=None, schedule_roots=True, extents=None, equilibria=None, **kwargs):
     """ Creates a :class:`pyneqsys.SymbolicSys` from a :class:`ReactionSystem`
 
     The parameters passed to RateExpr will contain the key ``'time'`` corresponding to the
@@ -135,12 +137,57 @@ def get_odesys(rsys, include_params=True, substitutions=None, SymbolicSys=None,
     constants : module
         e.g. ``chempy.units.default_constants``, parameter keys not found in
         substitutions will be looked for as an attribute of ``constants`` when provided.
+    engine : str
+        ``'symbolic'`` (default) or ``'numeric'``. The latter skips SymPy altogether and
+        returns a :class:`chempy.kinetics.numeric.NumericSys` (evaluating the right-hand-side
+        using NumPy), useful for large systems where symbolic manipulation is too slow.
+        Note that the numeric engine does not provide ``linear_dependencies``. Passing
+        ``sparse=True`` makes the Jacobian callback of either engine return a sparse matrix
+        (the numeric engine derives it analytically from the reactant orders and stoichiometry).
+    cache : bool, str or :class:`chempy.util.diskcache.DiskCache`, optional
+        Persistent on-disk cache of the generated expressions (symbolic engine) or
+        kernel (numeric engine), keyed on a hash of the reactions, substances, substitutions,
+        unit registry and options. ``True`` uses the default cache directory, a string is
+        taken as the path of the cache directory. Ignored when ``kwargs`` contains callbacks
+        affecting the expressions (e.g. ``roots_cb``) or when a rate expression is not fully
+        describable (e.g. created by :meth:`Expr.from_callback` from a lambda or closure).
+    sensitivities : bool or iterable of str, optional
+        Augment the system with forward sensitivities :math:`S = \\partial y / \\partial p`
+        w.r.t. the parameters (``True``: all of ``param_names``, note that rate constants are
+        parameters only when ``include_params=False``). The sensitivities (which start at zero)
+        follow the concentrations among the dependent variables, named ``'d(%s)/d(%s)' %
+        (substance_key, param_key)``, and are extracted from ``yout`` by ``extra['sensitivities']``.
+        One integration of the augmented system replaces the repeated integrations needed
+        for finite differences. Not supported together with ``unit_registry``.
+    schedule_roots : bool
+        When substitutions (or rate expressions) contain instances of
+        :class:`chempy.kinetics.rates.TimeSchedule` (e.g. a pulsed dose rate), a root function
+        changing sign at every switching time is added (unless ``roots_cb`` is given), which
+        lets integrators with root finding (e.g. CVODE, also through ``get_native``) stop at the
+        discontinuities within one integration. The switching times are also available as
+        ``extra['breakpoints']``, where the ``'solve_ivp'`` integrator of the numeric engine
+        restarts the integration.
+    extents : bool or iterable of ints, optional
+        Augment the system with the extents :math:`\\xi_i` (:math:`d\\xi_i/dt = r_i`, starting at
+        zero) of the reactions with the given indices (``True``: all reactions), i.e. the time
+        integrated reaction fluxes are obtained from the same integration (with the same error
+        control) as the concentrations. The extents follow the concentrations among the dependent
+        variables, named ``'extent(%d)' % ri``, and are extracted from ``yout`` by
+        ``extra['extents']``. No rate depends on the extents, hence the Jacobian only gains one
+        (sparse) row per extent. Not supported together with ``sensitivities`` or ``unit_registry``.
+    equilibria : bool or iterable of pairs of ints, optional
+        Fast equilibria (pairs of indices of forward & backward mass-action reactions, ``True``:
+        all pairs found by :meth:`ReactionSystem.identify_equilibria`) which are treated as
+        algebraic constraints (net rate zero) instead of being integrated, removing their
+        (stiff) relaxation modes (see :class:`chempy.kinetics.numeric.EquilibriumRHS`). The
+        initial concentrations are equilibrated by a pre-processor. Requires ``engine='numeric'``,
+        not supported together with ``sensitivities`` or ``extents``.
     \\*\\*kwargs :
-        Keyword arguemnts passed on to `SymbolicSys`.
+        Keyword arguemnts passed on to `SymbolicSys` (or `NumericSys`).
 
     Returns
     -------
-    pyodesys.symbolic.SymbolicSys
+    pyodesys.symbolic.SymbolicSys (or chempy.kinetics.numeric.NumericSys)
     extra : dict, with keys:
         - param_keys : list of str instances
         - unique : OrderedDict mapping str to value (possibly None)
@@ -149,6 +196,12 @@ def get_odesys(rsys, include_params=True, substitutions=None, SymbolicSys=None,
         - linear_dependencies : None or factory of solver callback
         - rate_exprs_cb : callable
         - cstr_fr_fc : None or (feed-ratio-key, subtance-key-to-feed-conc-key-map)
+        - sensitivity_keys : None or tuple of parameter keys
+        - sensitivities : None or callable, ``sensitivities(yout) -> array of shape (..., ns, n_keys)``
+        - breakpoints : None or tuple of switching times of time schedules
+        - extent_indices : None or tuple of reaction indices
+        - extents : None or callable, ``extents(yout) -> array of shape (..., n_extents)``
+        - equilibria : None or tuple of pairs of reaction indices
 
     Examples
     --------
@@ -163,7 +216,45 @@ def get_odesys(rsys, include_params=True, substitutions=None, SymbolicSys=None,
     array([0.7042, 0.0042, 0.2958])
 
     """
-    if SymbolicSys is None:
+    if engine not in ('symbolic', 'numeric'):
+        raise ValueError("Unknown engine: %s" % engine)
+    if sensitivities and unit_registry is not None:
+        raise NotImplementedError("Sensitivities are not supported together with unit_registry")
+    if extents and (sensitivities or unit_registry is not None):
+        raise NotImplementedError("Extents are not supported together with sensitivities or unit_registry")
+    if extents is True:
+        extent_indices = tuple(range(rsys.nr))
+    elif extents:
+        extent_indices = tuple(int(ri) for ri in extents)
+        for ri in extent_indices:
+            if not 0 <= ri < rsys.nr:
+                raise ValueError("Reaction index out of range: %d" % ri)
+    else:
+        extent_indices = None
+    if equilibria:
+        if engine != 'numeric':
+            raise NotImplementedError("Equilibria as constraints require engine='numeric'")
+        if sensitivities or extents:
+            raise NotImplementedError("Equilibria are not supported together with sensitivities or extents")
+        found = rsys.identify_equilibria()
+        if equilibria is True:
+            equilibria = tuple(found)
+        else:
+            equilibria = tuple((int(fw), int(bw)) for fw, bw in equilibria)
+            for pair in equilibria:
+                if pair not in found and pair[::-1] not in found:
+                    raise ValueError("Not an equilibrium: %s" % str(pair))
+    else:
+        equilibria = None
+    cache_key = None
+    if cache:
+        cache_key = _get_odesys_cache_key(rsys, include_params, substitutions, unit_registry, cstr, constants,
+                                          engine, kwargs)
+        if cache_key is not None and not hasattr(cache, 'get'):
+            from ..util.diskcache import DiskCache
+            cache = DiskCache(None if cache is True else cache)
+    cached = None if cache_key is None else cache.get(cache_key)
+    if SymbolicSys is None and engine == 'symbolic':
         from pyodesys.symbolic import SymbolicSys
 
     r_exprs = [rxn.rate_expr() for rxn in rsys.rxns]
@@ -287,47 +378,9 @@ def get_odesys(rsys, include_params=True, substitutions=None, SymbolicSys=None,
         time_unit = get_derived_unit(unit_registry, 'time')
         conc_unit = get_derived_unit(unit_registry, 'concentration')
 
-        def post_processor(x, y, p):
-            time = x*time_unit
-            if output_time_unit is not None:
-                time = rescale(time, output_time_unit)
-            conc = y*conc_unit
-            if output_conc_unit is not None:
-                conc = rescale(conc, output_conc_unit)
-            return time, conc, np.array([elem*p_unit for elem, p_unit in zip(p.T, p_units)], dtype=object).T
-
-        kwargs['to_arrays_callbacks'] = (
-            lambda x: to_unitless(x, time_unit),
-            lambda y: to_unitless(y, conc_unit),
-            lambda p: np.array([to_unitless(px, p_unit) for px, p_unit in zip(
-                p.T if hasattr(p, 'T') else p, p_units)]).T
-        )
-        kwargs['post_processors'] = kwargs.get('post_processors', []) + [post_processor]
-
-    def dydt(t, y, p, backend=math):
-        variables = dict(chain(y.items(), p.items()))
-        if 'time' in variables:
-            raise ValueError("Key 'time' is reserved.")
-        variables['time'] = t
-        for k, act in _active_subst.items():
-            if unit_registry is not None and act.args:
-                _, act = act.dedimensionalisation(unit_registry)
-            variables[k] = act(variables, backend=backend)
-        variables.update(_passive_subst)
-        return rsys.rates(variables, backend=backend, ratexs=r_exprs, cstr_fr_fc=cstr_fr_fc)
-
-    def reaction_rates(t, y, p, backend=math):
-        variables = dict(chain(y.items(), p.items()))
-        if 'time' in variables:
-            raise ValueError("Key 'time' is reserved.")
-        variables['time'] = t
-        for k, act in _active_subst.items():
-            if unit_registry is not None and act.args:
-                _, act = act.dedimensionalisation(unit_registry)
-            variables[k] = act(variables, backend=backend)
-        variables.update(_passive_subst)
-        return [ratex(variables, backend=backend, reaction=rxn) for
-                rxn, ratex in zip(rsys.rxns, r_exprs)]
+        kwargs['to_arrays_callbacks'] = (_ToUnitless(time_unit), _ToUnitless(conc_unit), _ParamsToUnitless(p_units))
+        kwargs['post_processors'] = kwargs.get('post_processors', []) + [_UnitPostProcessor(
+            time_unit, conc_unit, p_units, output_time_unit, output_conc_unit)]
 
     names = [s.name for s in rsys.substances.values()]
     latex_names = [None if s.latex_name is None else ('\\mathrm{' + s.latex_name + '}')
@@ -335,35 +388,71 @@ def get_odesys(rsys, include_params=True, substitutions=None, SymbolicSys=None,
 
     compo_vecs, compo_names = rsys.composition_balance_vectors()
 
-    odesys = SymbolicSys.from_callback(
-        dydt, dep_by_name=True, par_by_name=True, names=names,
-        latex_names=latex_names, param_names=param_names_for_odesys,
-        linear_invariants=None if len(compo_vecs) == 0 else compo_vecs,
-        linear_invariant_names=None if len(compo_names) == 0 else list(map(str, compo_names)),
-        **kwargs)
-
-    symbolic_ratexs = reaction_rates(
-        odesys.indep, dict(zip(odesys.names, odesys.dep)),
-        dict(zip(odesys.param_names, odesys.params)), backend=odesys.be)
-    rate_exprs_cb = odesys._callback_factory(symbolic_ratexs)
+    subst_plan = _SubstitutionPlan(_active_subst, _passive_subst, unit_registry)
+    breakpoints = _schedule_breakpoints(chain(_active_subst.values(), r_exprs), unit_registry)
+    schedule_kw = {}
+    if breakpoints is not None and schedule_roots and 'roots_cb' not in kwargs and 'roots' not in kwargs:
+        schedule_kw = dict(roots_cb=_ScheduleRoots(breakpoints), nroots=1)
+
+    if engine == 'numeric':
+        from .numeric import NumericRHS, NumericSys
+        if cached is None:
+            kernel = NumericRHS(rsys, param_keys=param_names_for_odesys, ratexs=r_exprs,
+                                substitutions=subst_plan.as_dict(), cstr_fr_fc=cstr_fr_fc)
+            if cache_key is not None:
+                _cache_put(cache, cache_key, {'kernel': kernel})
+        else:
+            kernel = cached['kernel']
+        rhs = kernel
+        if equilibria:
+            from .numeric import EquilibriumRHS
+            rhs = EquilibriumRHS(kernel, equilibria)
+            kwargs['pre_processors'] = kwargs.get('pre_processors', []) + [_EquilibriumPreProcessor(rhs)]
+        odesys = NumericSys(rhs, sparse=kwargs.pop('sparse', False), breakpoints=breakpoints,
+                            dep_by_name=True, par_by_name=True, names=names, latex_names=latex_names,
+                            param_names=param_names_for_odesys, **dict(schedule_kw, **kwargs))
+        rate_exprs_cb = kernel.rates
+    else:
+        dydt = _RatesCallback(rsys, subst_plan, r_exprs, cstr_fr_fc)
+        reaction_rates = _RatesCallback(rsys, subst_plan, r_exprs, cstr_fr_fc, per_reaction=True)
+
+        sys_kw = dict(
+            dep_by_name=True, par_by_name=True, names=names,
+            latex_names=latex_names, param_names=param_names_for_odesys,
+            linear_invariants=None if len(compo_vecs) == 0 else compo_vecs,
+            linear_invariant_names=None if len(compo_names) == 0 else list(map(str, compo_names)),
+        )
+        if cached is None:
+            roots_kw = {'roots_cb': schedule_kw['roots_cb']} if schedule_kw else {}
+            # a bound method keeps pyodesys' arity inspection (``_ensure_4args``) happy
+            odesys = SymbolicSys.from_callback(dydt.__call__, **dict(sys_kw, **dict(roots_kw, **kwargs)))
+            symbolic_ratexs = reaction_rates(
+                odesys.indep, dict(zip(odesys.names, odesys.dep)),
+                dict(zip(odesys.param_names, odesys.params)), backend=odesys.be)
+            if cache_key is not None:
+                _cache_put(cache, cache_key, {
+                    'dep': odesys.dep, 'exprs': odesys.exprs, 'indep': odesys.indep, 'params': odesys.params,
+                    'jac': None if odesys.sparse or odesys._jac is False else odesys._jac,
+                    'dfdx': None if odesys._dfdx is False else odesys._dfdx,
+                    'ratexs': symbolic_ratexs})
+        else:
+            for k in ('jac', 'dfdx'):
+                if cached[k] is not None and k not in kwargs:
+                    kwargs[k] = cached[k]
+            roots_kw = {}
+            if schedule_kw:
+                from sym import Backend
+                be = Backend(kwargs.get('backend'))
+                roots_kw['roots'] = schedule_kw['roots_cb'](cached['indep'], None, None, be)
+            odesys = SymbolicSys(zip(cached['dep'], cached['exprs']), cached['indep'], cached['params'],
+                                 **dict(sys_kw, **dict(roots_kw, **kwargs)))
+            symbolic_ratexs = cached['ratexs']
+        rate_exprs_cb = odesys._callback_factory(symbolic_ratexs)
 
     if rsys.check_balance(strict=True):
         # Composition available, we can provide callback for calculating
         # maximum allowed Euler forward step at start of integration.
-        def max_euler_step_cb(x, y, p=()):
-            _x, _y, _p = odesys.pre_process(*odesys.to_arrays(x, y, p))
-            upper_bounds = rsys.upper_conc_bounds(_y)
-            fvec = odesys.f_cb(_x[0], _y, _p)
-            h = []
-            for idx, fcomp in enumerate(fvec):
-                if fcomp == 0:
-                    h.append(float('inf'))
-                elif fcomp > 0:
-                    h.append((upper_bounds[idx] - _y[idx])/fcomp)
-                else:  # fcomp < 0
-                    h.append(-_y[idx]/fcomp)
-            min_h = min(h)
-            return min(min_h, 1)
+        max_euler_step_cb = _MaxEulerStep(rsys, odesys)
 
         def linear_dependencies(preferred=None):
             if preferred is not None:
@@ -404,11 +493,61 @@ def get_odesys(rsys, include_params=True, substitutions=None, SymbolicSys=None,
 
             return analytic_solver
 
+        if engine == 'numeric':
+            linear_dependencies = None  # requires symbolic manipulation
     else:
         max_euler_step_cb = None
         linear_dependencies = None
 
-    return odesys, {
+    sens_odesys, sensitivity_keys, unpack_sensitivities, unpack_extents = odesys, None, None, None
+    if sensitivities:  # the closures above refer to the system without sensitivities
+        if sensitivities is True:
+            sensitivity_keys = tuple(param_names_for_odesys)
+        else:
+            sensitivity_keys = tuple(sensitivities)
+            for k in sensitivity_keys:
+                if k not in param_names_for_odesys:
+                    raise ValueError("Not a parameter: %s (rate constants require include_params=False)" % k)
+        sens_names = ['d(%s)/d(%s)' % (sk, pk) for pk in sensitivity_keys for sk in names]
+        sens_kw = dict({k: v for k, v in kwargs.items() if cached is None or k not in ('jac', 'dfdx')},
+                       names=names + sens_names, taken_names=sens_names,
+                       pre_processors=[_SensitivityPreProcessor(len(names), len(sens_names))])
+        if engine == 'numeric':
+            from .numeric import SensitivityRHS
+            sens_odesys = NumericSys(SensitivityRHS(kernel, sensitivity_keys), sparse=odesys.sparse,
+                                     breakpoints=breakpoints, dep_by_name=True, par_by_name=True,
+                                     latex_names=latex_names + [None]*len(sens_names),
+                                     param_names=param_names_for_odesys, **dict(schedule_kw, **sens_kw))
+        else:
+            sens_odesys = _symbolic_sensitivity_sys(
+                odesys, sensitivity_keys, SymbolicSys,
+                **dict(sys_kw, latex_names=latex_names + [None]*len(sens_names), linear_invariants=None,
+                       linear_invariant_names=None, roots=odesys.roots,  # roots_cb already applied
+                       **{k: v for k, v in sens_kw.items() if k not in ('roots_cb', 'roots')}))
+        rate_exprs_cb = _LeadingDepCallback(rate_exprs_cb, len(names))
+        unpack_sensitivities = _UnpackTrailing(len(names), len(sensitivity_keys))
+
+    if extent_indices:
+        ext_names = ['extent(%d)' % ri for ri in extent_indices]
+        ext_kw = dict({k: v for k, v in kwargs.items() if cached is None or k not in ('jac', 'dfdx')},
+                      names=names + ext_names, taken_names=ext_names,
+                      pre_processors=[_SensitivityPreProcessor(len(names), len(ext_names))])
+        if engine == 'numeric':
+            from .numeric import ExtentRHS
+            sens_odesys = NumericSys(ExtentRHS(kernel, extent_indices), sparse=odesys.sparse,
+                                     breakpoints=breakpoints, dep_by_name=True, par_by_name=True,
+                                     latex_names=latex_names + [None]*len(ext_names),
+                                     param_names=param_names_for_odesys, **dict(schedule_kw, **ext_kw))
+        else:
+            sens_odesys = _symbolic_extent_sys(
+                odesys, [symbolic_ratexs[ri] for ri in extent_indices], SymbolicSys,
+                **dict(sys_kw, latex_names=latex_names + [None]*len(ext_names), linear_invariants=None,
+                       linear_invariant_names=None, roots=odesys.roots,  # roots_cb already applied
+                       **{k: v for k, v in ext_kw.items() if k not in ('roots_cb', 'roots')}))
+        rate_exprs_cb = _LeadingDepCallback(rate_exprs_cb, len(names))
+        unpack_extents = _UnpackTrailing(len(names))
+
+    return sens_odesys, {
         'param_keys': all_pk,
         'unique': unique,
         'p_units': p_units,
@@ -416,9 +555,618 @@ def get_odesys(rsys, include_params=True, substitutions=None, SymbolicSys=None,
         'linear_dependencies': linear_dependencies,
         'rate_exprs_cb': rate_exprs_cb,
         'cstr_fr_fc': cstr_fr_fc,
-        'unit_registry': unit_registry
+        'unit_registry': unit_registry,
+        'sensitivity_keys': sensitivity_keys,
+        'sensitivities': unpack_sensitivities,
+        'breakpoints': breakpoints,
+        'extent_indices': extent_indices,
+        'extents': unpack_extents,
+        'equilibria': equilibria,
+    }
+
+
+class EnsembleResult(object):
+    """ Stacked results of :func:`integrate_ensemble`.
+
+    Attributes
+    ----------
+    tout : array_like
+        Shared output time points.
+    yout : ndarray, shape (n_cases, len(tout), ny)
+    names : list of str or None
+        Names of the dependent variables (ordering of the last axis of ``yout``).
+    success, nfev, njev, n_steps, time_cpu, time_wall : ndarrays of length n_cases
+        Per case solver information (zero when not reported by the integrator).
+
+    """
+
+    attrs = {
+        'success': bool,
+        'nfev': int, 'njev': int, 'n_steps': int,
+        'time_cpu': float, 'time_wall': float
     }
 
+    def __init__(self, tout, n_cases, ny, names=None):
+        self.tout = tout
+        self.names = names
+        self.yout = np.empty((n_cases, len(tout), ny))
+        for k, v in self.attrs.items():
+            setattr(self, k, np.zeros(n_cases, dtype=v))
+
+    def _store(self, slc, yout, info):
+        self.yout[slc, ...] = yout
+        for k, v in info.items():
+            getattr(self, k)[slc] = v
+
+    def named_dep(self, key):
+        """ Returns ``yout[..., idx]`` for dependent variable ``key`` (shape: n_cases x len(tout)) """
+        return self.yout[..., self.names.index(key)]
+
+
+_ensemble_odesys = None  # per process ODE system used by _integrate_shard
+
+
+def _ensemble_init(rsys_or_odesys, odesys_kwargs):
+    global _ensemble_odesys
+    if hasattr(rsys_or_odesys, 'integrate'):
+        _ensemble_odesys = rsys_or_odesys
+    else:
+        _ensemble_odesys = get_odesys(rsys_or_odesys, **odesys_kwargs)[0]
+
+
+def _n_rows(table):
+    if isinstance(table, dict):
+        return max([len(v) for v in table.values() if np.ndim(v) > 0] + [1])
+    return len(table)
+
+
+def _table_rows(table, slc):
+    """ Slices ``table`` (either a 2D array_like or a dict of 1D array_like/scalars) """
+    if isinstance(table, dict):
+        return {k: (v[slc] if np.ndim(v) > 0 else v) for k, v in table.items()}
+    return table[slc]
+
+
+def _table_row(table, i):
+    if isinstance(table, dict):
+        return {k: (v[i] if np.ndim(v) > 0 else v) for k, v in table.items()}
+    return table[i]
+
+
+def _integrate_shard(slc, c0_rows, param_rows, tout, integrate_kwargs):
+    n = slc.stop - slc.start
+    yout = np.empty((n, len(tout), 0))
+    info = {k: np.zeros(n, dtype=v) for k, v in EnsembleResult.attrs.items()}
+    for i in range(n):
+        res = _ensemble_odesys.integrate(tout, _table_row(c0_rows, i), _table_row(param_rows, i),
+                                         **integrate_kwargs)
+        if res.yout.shape[0] != len(tout):
+            raise ValueError("Integrator did not return output at the requested time points")
+        if i == 0:
+            yout = np.empty((n,) + res.yout.shape)
+        yout[i, ...] = res.yout
+        for k in info:
+            if k in res.info:
+                info[k][i] = res.info[k]
+    return slc, yout, info
+
+
+class _RatesCallback(object):
+    """ Rates (per substance or per reaction) of a :class:`ReactionSystem`, see :func:`get_odesys` """
+
+    def __init__(self, rsys, subst_plan, ratexs, cstr_fr_fc=None, per_reaction=False):
+        self.rsys = rsys
+        self.subst_plan = subst_plan
+        self.ratexs = ratexs
+        self.cstr_fr_fc = cstr_fr_fc
+        self.per_reaction = per_reaction
+
+    def __call__(self, t, y, p, backend=math):
+        variables = self.subst_plan.variables(t, y, p, backend)
+        if self.per_reaction:
+            return [ratex(variables, backend=backend, reaction=rxn) for
+                    rxn, ratex in zip(self.rsys.rxns, self.ratexs)]
+        return self.rsys.rates(variables, backend=backend, ratexs=self.ratexs, cstr_fr_fc=self.cstr_fr_fc)
+
+
+class _ToUnitless(object):
+    def __init__(self, unit):
+        self.unit = unit
+
+    def __call__(self, value):
+        return to_unitless(value, self.unit)
+
+
+class _ParamsToUnitless(object):
+    def __init__(self, p_units):
+        self.p_units = p_units
+
+    def __call__(self, p):
+        return np.array([to_unitless(px, p_unit) for px, p_unit in zip(
+            p.T if hasattr(p, 'T') else p, self.p_units)]).T
+
+
+class _UnitPostProcessor(object):
+    """ Attaches units to (unitless) time, concentrations & parameters """
+
+    def __init__(self, time_unit, conc_unit, p_units, output_time_unit=None, output_conc_unit=None):
+        self.time_unit = time_unit
+        self.conc_unit = conc_unit
+        self.p_units = p_units
+        self.output_time_unit = output_time_unit
+        self.output_conc_unit = output_conc_unit
+
+    def __call__(self, x, y, p):
+        time = x*self.time_unit
+        if self.output_time_unit is not None:
+            time = rescale(time, self.output_time_unit)
+        conc = y*self.conc_unit
+        if self.output_conc_unit is not None:
+            conc = rescale(conc, self.output_conc_unit)
+        return time, conc, np.array([elem*p_unit for elem, p_unit in zip(p.T, self.p_units)], dtype=object).T
+
+
+class _MaxEulerStep(object):
+    """ Maximum allowed Euler forward step at the start of integration (``max_euler_step_cb``) """
+
+    def __init__(self, rsys, odesys):
+        self.rsys = rsys
+        self.odesys = odesys
+
+    def __call__(self, x, y, p=()):
+        odesys = self.odesys
+        _x, _y, _p = odesys.pre_process(*odesys.to_arrays(x, y, p))
+        upper_bounds = self.rsys.upper_conc_bounds(_y)
+        fvec = odesys.f_cb(_x[0], _y, _p)
+        h = []
+        for idx, fcomp in enumerate(fvec):
+            if fcomp == 0:
+                h.append(float('inf'))
+            elif fcomp > 0:
+                h.append((upper_bounds[idx] - _y[idx])/fcomp)
+            else:  # fcomp < 0
+                h.append(-_y[idx]/fcomp)
+        min_h = min(h)
+        return min(min_h, 1)
+
+
+class _LeadingDepCallback(object):
+    """ Calls ``cb`` with the leading ``ny`` dependent variables (the concentrations) """
+
+    def __init__(self, cb, ny):
+        self.cb = cb
+        self.ny = ny
+
+    def __call__(self, x, y, p, *args, **kwargs):
+        return self.cb(x, np.asarray(y)[..., :self.ny], p, *args, **kwargs)
+
+
+class _UnpackTrailing(object):
+    """ The dependent variables following the concentrations (optionally as ``(..., ny, n)``) """
+
+    def __init__(self, ny, n=None):
+        self.ny = ny
+        self.n = n
+
+    def __call__(self, yout):
+        trailing = np.asarray(yout)[..., self.ny:]
+        if self.n is None:
+            return trailing
+        return np.swapaxes(trailing.reshape(trailing.shape[:-1] + (self.n, -1)), -1, -2)
+
+
+class _SensitivityPreProcessor(object):
+    """ Appends (zero) initial values of the sensitivities (or extents) """
+
+    def __init__(self, ns, nsens):
+        self.ns = ns
+        self.nsens = nsens
+
+    def __call__(self, x, y, p):
+        if y.shape[-1] == self.ns:
+            y = np.concatenate((y, np.zeros(y.shape[:-1] + (self.nsens,))), axis=-1)
+        return x, y, p
+
+
+class _SubstitutionPlan(object):
+    """ Ordered evaluation of the substitutions of :func:`get_odesys`
+
+    The active substitutions (instances of :class:`Expr`) are dedimensionalised
+    once (when a unit registry is given), and evaluated in order after the
+    dependent variables, parameters & time have been assigned, followed by
+    the passive (constant) substitutions. The variables are returned as an
+    :class:`EvaluationContext`, i.e. the substitutions are evaluated once per
+    evaluation (not once per reaction) and shared parameter expressions are memoized.
+    """
+
+    def __init__(self, active, passive, unit_registry=None):
+        self.active = []
+        for k, act in active.items():
+            if unit_registry is not None and act.args:
+                _, act = act.dedimensionalisation(unit_registry)
+            self.active.append((k, act))
+        self.passive = OrderedDict(passive)
+
+    def as_dict(self):
+        """ OrderedDict of the (passive followed by the active) substitutions """
+        result = OrderedDict(self.passive)
+        result.update(self.active)
+        return result
+
+    def variables(self, t, y, p, backend=math):
+        variables = EvaluationContext(y)
+        variables.update(p)
+        if 'time' in variables:
+            raise ValueError("Key 'time' is reserved.")
+        variables['time'] = t
+        for k, act in self.active:
+            variables[k] = act(variables, backend=backend)
+        variables.update(self.passive)
+        return variables
+
+
+class _EquilibriumPreProcessor(object):
+    """ Equilibrates the initial concentrations (see :meth:`EquilibriumRHS.equilibrate`) """
+
+    def __init__(self, rhs):
+        self.rhs = rhs
+
+    def __call__(self, x, y, p):
+        y = np.array(y, dtype=np.float64)
+        x0, p = np.asarray(x)[..., 0], np.asarray(p)
+        for idx in np.ndindex(y.shape[:-1]):
+            t = x0[idx] if x0.ndim else x0
+            y[idx] = self.rhs.equilibrate(t, y[idx], p[idx] if p.ndim > 1 else p)
+        return x, y, p
+
+
+def _symbolic_sensitivity_sys(odesys, keys, SymbolicSys, **kwargs):
+    """ Creates a SymbolicSys augmented with the forward sensitivity equations of ``odesys`` """
+    be = odesys.be
+    f = be.Matrix(odesys.exprs)
+    J = f.jacobian(be.Matrix(odesys.dep))
+    dfdp = f.jacobian(be.Matrix([odesys.params[odesys.param_names.index(k)] for k in keys]))
+    dep_exprs = list(zip(odesys.dep, odesys.exprs))
+    for j in range(len(keys)):
+        S = be.Matrix([be.Symbol('s_%d_%d' % (j, i)) for i in range(odesys.ny)])
+        dep_exprs.extend(zip(S, J*S + dfdp[:, j]))
+    return SymbolicSys(dep_exprs, odesys.indep, odesys.params, **kwargs)
+
+
+def _symbolic_extent_sys(odesys, ratexs, SymbolicSys, **kwargs):
+    """ Creates a SymbolicSys augmented with the extents (integrated rates ``ratexs``) """
+    dep_exprs = list(zip(odesys.dep, odesys.exprs))
+    dep_exprs.extend((odesys.be.Symbol('xi_%d' % i), ratex) for i, ratex in enumerate(ratexs))
+    return SymbolicSys(dep_exprs, odesys.indep, odesys.params, **kwargs)
+
+
+def _schedule_breakpoints(exprs, unit_registry=None):
+    """ Sorted switching times of the :class:`TimeSchedule` instances in ``exprs`` (also nested), or None """
+    from .rates import TimeSchedule
+    found = set()
+
+    def _visit(expr):
+        if isinstance(expr, TimeSchedule):
+            if unit_registry is not None:
+                _, expr = expr.dedimensionalisation(unit_registry)
+            found.update(map(float, expr.breakpoints()))
+        elif isinstance(expr, Expr):
+            for arg in expr.args or ():
+                _visit(arg)
+
+    for expr in exprs:
+        _visit(expr)
+    return tuple(sorted(found)) or None
+
+
+class _ScheduleRoots(object):
+    """ Root callback (``roots_cb``) changing sign at the switching times of time schedules """
+
+    def __init__(self, breakpoints):
+        self.breakpoints = breakpoints
+
+    def __call__(self, x, y, p=(), backend=math):
+        from .rates import switching_function
+        if not hasattr(backend, 'Piecewise') and np.ndim(x) > 0:
+            backend = np
+        return [switching_function(x, self.breakpoints, backend)]
+
+
+_RUNTIME_ONLY_KWARGS = ('pre_processors', 'post_processors', 'to_arrays_callbacks')
+
+
+def _plain_repr(obj):
+    """ ``repr`` of (nested containers of) simple values, ``None`` for other objects """
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return repr(obj)
+    if isinstance(obj, (tuple, list)):
+        items = [_plain_repr(elem) for elem in obj]
+        return None if None in items else '(%s)' % ', '.join(items)
+    if isinstance(obj, dict):
+        items = [(_plain_repr(k), _plain_repr(v)) for k, v in sorted(obj.items(), key=lambda kv: str(kv[0]))]
+        return None if any(None in kv for kv in items) else '{%s}' % ', '.join(map(': '.join, items))
+    return None
+
+
+def _structural_repr(obj):
+    """ Description of (nested) expressions determining their behaviour, ``None`` if not describable
+
+    Unlike ``repr`` this includes what dynamically created classes are parameterized with (e.g.
+    ``reciprocal`` & ``shift`` of :func:`chempy.util._expr.create_Poly`), the class attributes
+    ``parameter_keys`` & ``argument_names`` and the complete instance state (e.g. ``unique_keys``).
+    """
+    if obj is None or isinstance(obj, (bool, int, float, complex, str)):
+        return repr(obj)
+    if isinstance(obj, (tuple, list)):
+        items = [_structural_repr(elem) for elem in obj]
+        return None if None in items else '(%s)' % ', '.join(items)
+    if isinstance(obj, dict):
+        items = [(_structural_repr(k), _structural_repr(v)) for k, v in sorted(obj.items(), key=lambda kv: str(kv[0]))]
+        return None if any(None in kv for kv in items) else '{%s}' % ', '.join(map(': '.join, items))
+    if isinstance(obj, Expr):
+        return _structural_repr((type(obj), type(obj).parameter_keys, type(obj).argument_names, vars(obj)))
+    if isinstance(obj, type) or callable(obj) and hasattr(obj, '__qualname__'):
+        recipe = obj.__dict__.get('_factory') if isinstance(obj, type) else None
+        if recipe is not None:  # see chempy.util._expr._dynamic_class
+            return _structural_repr(recipe)
+        qualname = obj.__qualname__
+        if '<' in qualname or getattr(obj, '__closure__', None):  # e.g. lambdas, locally defined & closures
+            return None
+        return '%s.%s' % (obj.__module__, qualname)
+    if np is not None and isinstance(obj, (np.ndarray, np.generic)):  # including quantities
+        with np.printoptions(threshold=sys.maxsize, floatmode='unique'):
+            return '%s(%s)' % (type(obj).__name__, repr(obj))
+    return None
+
+
+def _get_odesys_cache_key(rsys, include_params, substitutions, unit_registry, cstr, constants, engine, kwargs):
+    """ Content hash used as key by the cache of :func:`get_odesys` (``None`` if not cacheable) """
+    import pyodesys
+    from .. import __version__
+    from ..util.diskcache import content_hash
+    kw_reprs = []
+    for k, v in sorted(kwargs.items()):
+        if k in _RUNTIME_ONLY_KWARGS:
+            continue
+        r = _plain_repr(v)
+        if r is None:
+            return None
+        kw_reprs.append((k, r))
+
+    def _sorted(d):
+        return sorted((str(k), repr(v)) for k, v in d.items())
+
+    rxn_reprs = [tuple(_sorted(getattr(rxn, attr) or {}) for attr in ('reac', 'prod', 'inact_reac', 'inact_prod')) +
+                 (_structural_repr(rxn.param),) for rxn in rsys.rxns]
+    subst_repr = _structural_repr(dict(substitutions or {}))
+    unit_repr = None if unit_registry is None else _structural_repr(dict(unit_registry))
+    if any(r[-1] is None for r in rxn_reprs) or subst_repr is None or unit_repr is None and unit_registry is not None:
+        return None  # e.g. rate expressions from callbacks which are lambdas
+    subst_reprs = [(k, s.name, s.latex_name, _sorted(s.composition or {})) for k, s in rsys.substances.items()]
+    return content_hash(
+        __version__, pyodesys.__version__, engine, include_params, rxn_reprs, subst_reprs, subst_repr, unit_repr,
+        repr(cstr), None if constants is None else getattr(constants, '__name__', repr(constants)), kw_reprs)
+
+
+def _cache_put(cache, key, obj):
+    """ Stores ``obj`` in ``cache``, failing to do so (e.g. read-only directory) only warns """
+    try:
+        cache.put(key, obj)
+    except Exception as exc:  # e.g. IOError, pickle.PicklingError, TypeError & AttributeError (unpicklable)
+        warnings.warn("Could not store entry in cache: %s" % exc)
+
+
+def integrate_ensemble(rsys_or_odesys, c0_table, param_table, tout, workers=None, chunksize=None,
+                       odesys_kwargs=None, mp_context=None, **kwargs):
+    """ Integrates an ODE-system for a table of initial concentrations & parameters
+
+    The cases are split into shards which are distributed over a process pool,
+    each worker process integrates its shards using one (and the same) ODE-system.
+
+    Parameters
+    ----------
+    rsys_or_odesys : ReactionSystem or pyodesys.ODESys instance
+        When a :class:`ReactionSystem` is passed, every worker process calls
+        :func:`get_odesys` (with ``odesys_kwargs``) once.
+    c0_table : 2D array_like or dict
+        Initial concentrations, one row per case. A dict maps substance keys to
+        arrays of length n_cases (or to scalars, shared by all cases).
+    param_table : 2D array_like or dict
+        Parameters, one row per case (see ``c0_table``).
+    tout : array_like
+        Output time points (shared by all cases, at least 3).
+    workers : int, optional
+        Number of worker processes, default: in-process (serial) integration.
+    chunksize : int, optional
+        Number of cases per shard, default: ``n_cases`` split in 4 shards per worker.
+    odesys_kwargs : dict, optional
+        Keyword arguments passed to :func:`get_odesys`.
+    mp_context : multiprocessing context, optional
+        Passed to :class:`concurrent.futures.ProcessPoolExecutor`. By default the 'fork'
+        start method is used (when available) if an ODE-system instance is passed (since
+        those in general cannot be pickled, systems from ``get_odesys(..., engine='numeric')``
+        can however be sent to workers using any start method).
+    \\*\\*kwargs :
+        Keyword arguments passed on to :meth:`pyodesys.ODESys.integrate`.
+
+    Returns
+    -------
+    EnsembleResult
+
+    Examples
+    --------
+    >>> from chempy import ReactionSystem
+    >>> rsys = ReactionSystem.from_string("2 H2O2 -> O2 + 2 H2O; 5")
+    >>> res = integrate_ensemble(rsys, {'H2O2': [1, 2], 'O2': 0, 'H2O': 0}, [[], []], [0, .1, 1],
+    ...                          integrator='scipy')
+    >>> res.yout.shape
+    (2, 3, 3)
+    >>> res.success.tolist()
+    [True, True]
+
+    """
+    odesys_kwargs = odesys_kwargs or {}
+    if len(tout) < 3:
+        raise ValueError("Need at least 3 output time points")
+    n_cases = max(_n_rows(c0_table), _n_rows(param_table))
+    for name, table in [('c0_table', c0_table), ('param_table', param_table)]:
+        if not isinstance(table, dict):
+            if len(table) != n_cases:
+                raise ValueError("Mismatching number of rows in c0_table and param_table")
+            continue
+        for k, v in table.items():
+            if np.ndim(v) > 0 and len(v) != n_cases:
+                raise ValueError("Length of %s[%r] is %d (expected %d or a scalar)" % (name, k, len(v), n_cases))
+    if chunksize is None:
+        chunksize = max(1, int(math.ceil(n_cases/(4*(workers or 1)))))
+    shards = [slice(i, min(i + chunksize, n_cases)) for i in range(0, n_cases, chunksize)]
+
+    def _args(slc):
+        return slc, _table_rows(c0_table, slc), _table_rows(param_table, slc), tout, kwargs
+
+    if hasattr(rsys_or_odesys, 'integrate'):
+        names = rsys_or_odesys.names
+        ny = getattr(rsys_or_odesys, 'ny', None) or len(names)
+    else:
+        names = list(rsys_or_odesys.substances)
+        ny = rsys_or_odesys.ns
+    result = EnsembleResult(tout, n_cases, ny, names)
+
+    global _ensemble_odesys
+    if workers is None or workers == 1:
+        ori = _ensemble_odesys
+        _ensemble_init(rsys_or_odesys, odesys_kwargs)
+        try:
+            for slc in shards:
+                result._store(*_integrate_shard(*_args(slc)))
+        finally:
+            _ensemble_odesys = ori
+        return result
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    pool_kwargs = dict(max_workers=workers, initializer=_ensemble_init, initargs=(rsys_or_odesys, odesys_kwargs))
+    if mp_context is None and hasattr(rsys_or_odesys, 'integrate') and \
+       'fork' in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context('fork')
+        ori = _ensemble_odesys
+        _ensemble_odesys = rsys_or_odesys  # inherited by the forked workers
+        pool_kwargs['initializer'], pool_kwargs['initargs'] = None, ()
+    else:
+        ori = _ensemble_odesys
+    try:
+        with ProcessPoolExecutor(mp_context=mp_context, **pool_kwargs) as executor:
+            for shard_result in executor.map(_integrate_shard, *zip(*map(_args, shards))):
+                result._store(*shard_result)
+    finally:
+        _ensemble_odesys = ori
+    return result
+
+
+def integrate_chunks(odesys, tout, c0, params=(), chunk_size=1024, **kwargs):
+    """ Generator integrating an ODE-system in chunks of output time points
+
+    Each chunk is a separate call to :meth:`pyodesys.ODESys.integrate`, started from the last
+    row of ``yout`` of the previous chunk, so that only one chunk of the output is held in
+    memory at a time.
+
+    Parameters
+    ----------
+    odesys : :class:`pyodesys.ODESys` instance
+    tout : array_like
+        Output time points (at least 2), the first being the initial time.
+    c0 : dict or array_like
+        Initial concentrations.
+    params : dict or array_like
+    chunk_size : int
+        Number of output time points per chunk (the first chunk also includes the initial point).
+    \\*\\*kwargs :
+        Keyword arguments passed on to :meth:`pyodesys.ODESys.integrate`.
+
+    Yields
+    ------
+    Length 3 tuples: (xout, yout, info) of each chunk.
+
+    Notes
+    -----
+    The integrator is restarted at the start of every chunk, i.e. its step size and error
+    history are not carried over. The output therefore matches that of a single call to
+    ``integrate`` only to within the integration tolerances, and each restart costs a few
+    extra (small) steps: prefer chunks of many output points.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from chempy import ReactionSystem
+    >>> rsys = ReactionSystem.from_string("2 H2O2 -> O2 + 2 H2O; 5")
+    >>> odesys, extra = get_odesys(rsys)
+    >>> tout = np.linspace(0, 1, 11)
+    >>> chunks = integrate_chunks(odesys, tout, {'H2O2': 1, 'O2': 0, 'H2O': 0}, chunk_size=4, integrator='scipy')
+    >>> [len(xout) for xout, yout, info in chunks]
+    [5, 4, 2]
+
+    """
+    if len(tout) < 2:
+        raise ValueError("Need at least 2 output time points")
+    if chunk_size < 1:
+        raise ValueError("chunk_size needs to be positive")
+    y0 = c0
+    start = 0
+    while start < len(tout) - 1:
+        stop = min(start + chunk_size, len(tout) - 1)
+        res = odesys.integrate(tout[start:stop+1], y0, params, force_predefined=True, **kwargs)
+        if not res.info['success']:
+            raise RuntimeError("Integration failed at t=%s: %s" % (tout[start], res.info.get('message', '')))
+        first = 0 if start == 0 else 1  # the initial point is the last point of the previous chunk
+        yield res.xout[first:], res.yout[first:], res.info
+        y0 = res.yout[-1]
+        start = stop
+
+
+def integrate_to_store(odesys, path, tout, c0, params=(), chunk_size=1024, names=None, **kwargs):
+    """ Integrates an ODE-system and writes the output to a :class:`chempy.util.chunkstore.ChunkedStore`
+
+    Peak memory use is bounded by ``chunk_size`` (rather than by the length of ``tout``),
+    the store may then be read lazily (memory mapped), e.g. by
+    :func:`chempy.kinetics.analysis.plot_reaction_contributions`.
+
+    Parameters
+    ----------
+    odesys : :class:`pyodesys.ODESys` instance
+    path : str
+        Directory of the (new) store.
+    tout : array_like
+    c0 : dict or array_like
+    params : dict or array_like
+    chunk_size : int
+    names : iterable of str, optional
+        Names of the dependent variables (e.g. ``rsys.substances``). Default: ``odesys.names``.
+    \\*\\*kwargs :
+        Keyword arguments passed on to :func:`integrate_chunks`.
+
+    Returns
+    -------
+    store : ChunkedStore
+    info : dict
+        Summed solver information ('nfev', 'njev', 'n_steps', 'time_cpu', 'time_wall') and 'nchunks'.
+
+    """
+    from ..util.chunkstore import ChunkedStore, _unit_str
+    store = None
+    info = dict(nchunks=0, nfev=0, njev=0, n_steps=0, time_cpu=0.0, time_wall=0.0)
+    for xout, yout, chunk_info in integrate_chunks(odesys, tout, c0, params, chunk_size, **kwargs):
+        if store is None:
+            _, _, intern_p = odesys.to_arrays(xout, yout, params, reshape=False)
+            store = ChunkedStore.create(path, odesys.names if names is None else names,
+                                        time_unit=_unit_str(xout), conc_unit=_unit_str(yout),
+                                        params=np.atleast_1d(intern_p))
+        store.append(xout, yout)
+        info['nchunks'] += 1
+        for k in info:
+            if k in chunk_info:
+                info[k] += chunk_info[k]
+    return store, info
+
 
 @deprecated(last_supported_version='0.5.3', will_be_missing_in='0.8.0',
             use_instead='pyodesys.chained_parameter_variation')
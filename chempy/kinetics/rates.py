@@ -8,20 +8,38 @@ units library of ChemPy (``quantities``). Consider the API to be provisional.
 
 from __future__ import (absolute_import, division, print_function)
 
+from bisect import bisect_right
 from collections import OrderedDict
 from functools import reduce
 import math
 from operator import add
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from ..units import get_derived_unit, default_units, energy, concentration
 from ..util._dimensionality import dimension_codes, base_registry
 from ..util.pyutil import memoize, deprecated
-from ..util._expr import Expr, UnaryWrapper, Symbol
+from ..util._expr import Expr, UnaryWrapper, Symbol, EvaluationContext
 
 
 _molar = getattr(default_units, 'molar', 1)  # makes module importable.
 
 
+def _exp_neg_over_T(c, T, variables, backend):
+    """ ``backend.exp(-c/T)``, shared between reactions evaluated in the same :class:`EvaluationContext` """
+    if not isinstance(variables, EvaluationContext):
+        return backend.exp(-c/T)
+    try:
+        key = ('exp_neg_over_T', c, id(T), id(backend))
+        hash(key)
+    except TypeError:  # e.g. quantities
+        return backend.exp(-c/T)
+    return variables.memoize(key, lambda: backend.exp(-c/T))
+
+
 class RateExpr(Expr):
     """ Baseclass for rate expressions, see source code of e.g. MassAction & Radiolytic. """
 
@@ -92,6 +110,7 @@ def mk_Radiolytic(*doserate_names):
     in variables.
 
     """
+    factory_args = doserate_names
     if len(doserate_names) == 0:
         doserate_names = ('',)
 
@@ -119,6 +138,7 @@ def mk_Radiolytic(*doserate_names):
                 self.parameter_keys[1:], self.all_args(variables, backend=backend, **kwargs))])
 
     _Radiolytic.__name__ = 'Radiolytic' if doserate_names == ('',) else ('Radiolytic_' + '_'.join(doserate_names))
+    _Radiolytic._factory = (mk_Radiolytic, factory_args, {})  # see Expr.__reduce_ex__
     return _Radiolytic
 
 
@@ -223,6 +243,7 @@ class Arrhenius(Expr):
     """
     argument_names = ('A', 'Ea_over_R')
     parameter_keys = ('temperature',)
+    reaction_dependent = False
 
     def args_dimensionality(self, reaction):
         order = reaction.order()
@@ -238,7 +259,7 @@ class Arrhenius(Expr):
             Ea_over_R = Ea_over_R.simplified
         except AttributeError:
             pass
-        return A*backend.exp(-Ea_over_R/variables['temperature'])
+        return A*_exp_neg_over_T(Ea_over_R, variables['temperature'], variables, backend)
 
 
 class Eyring(Expr):
@@ -263,7 +284,7 @@ class Eyring(Expr):
     def __call__(self, variables, backend=math, **kwargs):
         c0, c1, conc0 = self.all_args(variables, backend=backend, **kwargs)
         T = variables['temperature']
-        return c0*T*backend.exp(-c1/T)*conc0**(1-kwargs['reaction'].order())
+        return c0*T*_exp_neg_over_T(c1, T, variables, backend)*conc0**(1-kwargs['reaction'].order())
 
 
 class EyringHS(Expr):
@@ -289,6 +310,7 @@ class RampedTemp(Expr):
     """ Ramped temperature, pass as substitution to e.g. ``get_odesys`` """
     argument_names = ('T0', 'dTdt')
     parameter_keys = ('time',)  # consider e.g. a parameter such as 'init_time'
+    reaction_dependent = False
 
     def args_dimensionality(self, **kwargs):
         return ({'temperature': 1}, {'temperature': 1, 'time': -1})
@@ -301,6 +323,7 @@ class RampedTemp(Expr):
 class SinTemp(Expr):
     argument_names = ('Tbase', 'Tamp', 'angvel', 'phase')
     parameter_keys = ('time',)
+    reaction_dependent = False
 
     def args_dimensionality(self, **kwargs):
         return ({'temperature': 1}, {'temperature': 1}, {'time': -1}, {})
@@ -308,3 +331,116 @@ class SinTemp(Expr):
     def __call__(self, variables, backend=math, **kwargs):
         Tbase, Tamp, angvel, phase = self.all_args(variables, backend=backend, **kwargs)
         return Tbase + Tamp*backend.sin(angvel*variables['time'] + phase)
+
+
+class TimeSchedule(Expr):
+    """ Baseclass of piecewise defined functions of time (e.g. a pulsed dose rate)
+
+    Pass as substitution to e.g. ``get_odesys``. The arguments are the flattened table
+    ``(t0, v0, t1, v1, ..., tn, vn)`` of (increasing) switching times and values, outside
+    of ``[t0, tn]`` the schedule is constant. The times where the schedule is not smooth
+    are given by :meth:`breakpoints`.
+    """
+    argument_names = ('t0', 'v0', Ellipsis)
+    parameter_keys = ('time',)
+    nargs = -1
+    reaction_dependent = False
+
+    @classmethod
+    def from_table(cls, times, values, unique_keys=None):
+        """ Creates an instance from (equally long) sequences of times and values """
+        if len(times) != len(values):
+            raise ValueError("Mismatching length of times and values")
+        return cls([elem for tv in zip(times, values) for elem in tv], unique_keys)
+
+    def _table(self, variables, backend, **kwargs):
+        args = self.all_args(variables, backend=backend, **kwargs)
+        if len(args) < 2 or len(args) % 2 != 0:
+            raise ValueError("Need an even number of arguments: (t0, v0, t1, v1, ...)")
+        return args[0::2], args[1::2]
+
+    def breakpoints(self, variables=None):
+        """ Times at which the schedule (or its derivative) is discontinuous """
+        raise NotImplementedError("Subclass and implement breakpoints")
+
+
+class StepSchedule(TimeSchedule):
+    """ Piecewise constant function of time: ``v_i`` for ``t_i <= time < t_{i+1}``
+
+    Examples
+    --------
+    >>> doserate = StepSchedule.from_table([0, 1, 2, 3], [5, 0, 5, 0])  # two pulses
+    >>> [doserate({'time': t}) for t in (0.5, 1.5, 2.0, 7)]
+    [5, 0, 5, 0]
+    >>> doserate.breakpoints()
+    [1, 2, 3]
+
+    """
+
+    def breakpoints(self, variables=None):
+        times, _ = self._table(variables or {}, math)
+        return times[1:]
+
+    def __call__(self, variables, backend=math, **kwargs):
+        times, values = self._table(variables, backend, **kwargs)
+        t = variables['time']
+        if hasattr(backend, 'Piecewise'):
+            return backend.Piecewise(*([(v, t < t1) for v, t1 in zip(values, times[1:])] + [(values[-1], True)]))
+        elif np is not None and np.ndim(t) > 0:
+            return np.asarray(values)[np.clip(np.searchsorted(times, t, side='right') - 1, 0, len(times) - 1)]
+        else:
+            return values[max(bisect_right(times, t) - 1, 0)]
+
+
+class LinearSchedule(TimeSchedule):
+    """ Piecewise linear function of time (linear interpolation in the table)
+
+    Examples
+    --------
+    >>> temperature = LinearSchedule.from_table([0, 10, 20], [300, 350, 350])
+    >>> [temperature({'time': t}) for t in (-1, 5, 15, 30)]
+    [300, 325.0, 350.0, 350]
+
+    """
+
+    def breakpoints(self, variables=None):
+        times, _ = self._table(variables or {}, math)
+        return times
+
+    def __call__(self, variables, backend=math, **kwargs):
+        times, values = self._table(variables, backend, **kwargs)
+        t = variables['time']
+        segments = [v0 + (v1 - v0)*(t - t0)/(t1 - t0) for t0, v0, t1, v1 in zip(
+            times[:-1], values[:-1], times[1:], values[1:])]
+        if hasattr(backend, 'Piecewise'):
+            return backend.Piecewise(*([(values[0], t < times[0])] + list(zip(segments, [
+                t < t1 for t1 in times[1:]])) + [(values[-1], True)]))
+        elif np is not None and np.ndim(t) > 0:
+            return np.interp(t, times, values)
+        else:
+            i = bisect_right(times, t)
+            return values[0] if i == 0 else (values[-1] if i == len(times) else segments[i - 1])
+
+
+def switching_function(t, breakpoints, backend=math):
+    """ Continuous function of time changing sign at each of the (sorted) ``breakpoints``
+
+    A triangle wave suitable as root function, letting integrators with root finding
+    (e.g. CVODE) stop at the discontinuities of a :class:`TimeSchedule`.
+
+    Examples
+    --------
+    >>> [switching_function(t, [1, 2, 4]) for t in (0, 1.5, 1.75, 3, 5)]
+    [-1, 0.5, 0.25, -1, 1]
+
+    """
+    mids = [(b0 + b1)/2 for b0, b1 in zip(breakpoints[:-1], breakpoints[1:])]
+    if hasattr(backend, 'Piecewise'):
+        return backend.Piecewise(*([((-1)**i*(t - b), t < m) for i, (b, m) in enumerate(zip(breakpoints, mids))] +
+                                   [((-1)**len(mids)*(t - breakpoints[-1]), True)]))
+    elif np is not None and np.ndim(t) > 0:
+        i = np.searchsorted(mids, t, side='right')
+        return np.where(i % 2 == 0, 1, -1)*(t - np.asarray(breakpoints)[i])
+    else:
+        i = bisect_right(mids, t)
+        return (-1)**i*(t - breakpoints[i])
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+Tools for reducing kinetic models, e.g. by the quasi-steady-state approximation (QSSA)
+for short lived intermediates (radicals), or by pruning the mechanism using a directed
+relation graph (DRG) against target species.
+"""
+from __future__ import (absolute_import, division, print_function)
+
+from collections import OrderedDict
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _samples(odesys, result):
+    """ (xout, yout, params) of ``result`` in the internal representation of ``odesys`` """
+    if odesys.pre_processors or odesys.post_processors:  # e.g. units or scaling
+        return tuple(np.asarray(result.info['internal_' + k]) for k in ('xout', 'yout', 'params'))
+    return np.asarray(result.xout), np.asarray(result.yout), np.asarray(result.params)
+
+
+def species_timescales(odesys, xout, yout, params=()):
+    """ Characteristic (relaxation) timescales of the dependent variables.
+
+    The timescale of species ``i`` is estimated as ``1/|J_ii|`` (the reciprocal of
+    the diagonal element of the Jacobian), i.e. the lifetime of the species with
+    respect to its own consumption.
+
+    Parameters
+    ----------
+    odesys : pyodesys.ODESys
+    xout : array_like
+        (Internal) values of the independent variable, shape ``(n_samples,)``.
+    yout : array_like
+        (Internal) sampled states, shape ``(n_samples, ny)``.
+    params : array_like
+        (Internal) parameters.
+
+    Returns
+    -------
+    ndarray of shape ``(n_samples, ny)`` (``inf`` for species not consumed).
+
+    """
+    taus = np.empty(np.shape(yout))
+    for i, (x, y) in enumerate(zip(xout, yout)):
+        J = odesys.j_cb(x, y, params)
+        if hasattr(J, 'toarray'):
+            J = J.toarray()
+        diag = np.abs(np.diagonal(np.asarray(J, dtype=np.float64)))
+        with np.errstate(divide='ignore'):
+            taus[i, :] = np.where(diag > 0, 1/diag, np.inf)
+    return taus
+
+
+def propose_qssa(odesys, xout, yout, params=(), ratio=1e-3, max_fraction=1e-2, exclude=()):
+    """ Ranks species by timescale and proposes a set for the quasi-steady-state approximation.
+
+    A species is proposed when its timescale (see :func:`species_timescales`) at
+    every sampled state (except the initial one) is at most ``ratio`` times the
+    sampled time span, and its concentration never exceeds ``max_fraction`` of the
+    largest concentration (QSSA is only applicable to scarce intermediates).
+
+    Parameters
+    ----------
+    odesys : pyodesys.ODESys
+    xout, yout, params : array_like
+        See :func:`species_timescales`.
+    ratio : float
+    max_fraction : float
+    exclude : iterable of str
+        Names of species never to be proposed (e.g. observables).
+
+    Returns
+    -------
+    qss_keys : list of str
+        Proposed species (fastest first).
+    timescales : OrderedDict
+        Mapping name to the largest sampled timescale, for all species (fastest first).
+
+    """
+    taus = species_timescales(odesys, xout, yout, params)
+    if len(xout) > 2:
+        taus = taus[1:]
+    tau_max = np.max(taus, axis=0)
+    horizon = xout[-1] - xout[0]
+    peak = np.max(np.abs(yout), axis=0)
+    order = np.argsort(tau_max, kind='stable')
+    timescales = OrderedDict((odesys.names[i], tau_max[i]) for i in order)
+    qss_keys = [odesys.names[i] for i in order if (
+        tau_max[i] <= ratio*horizon and peak[i] <= max_fraction*np.max(peak) and
+        odesys.names[i] not in exclude)]
+    return qss_keys, timescales
+
+
+def _select_root(solutions, syms, reference):
+    best, best_dist = None, None
+    for sol in solutions:
+        vals = []
+        for s in syms:
+            val = complex(sol[s].subs(reference).evalf())
+            if abs(val.imag) > 1e-12*max(1, abs(val.real)):
+                break
+            vals.append(val.real)
+        else:
+            if any(v < 0 for v in vals):
+                continue
+            dist = sum(abs(v - float(reference.get(s, 0))) for v, s in zip(vals, syms))
+            if best is None or dist < best_dist:
+                best, best_dist = sol, dist
+    return best
+
+
+def qssa_system(odesys, qss_keys, reference=None, **kwargs):
+    """ Creates a reduced system where ``qss_keys`` are algebraic variables (dC/dt = 0).
+
+    The algebraic equations are solved symbolically (in terms of the remaining
+    dependent variables), and the resulting expressions are used to create an
+    instance of :class:`pyodesys.symbolic.PartiallySolvedSystem` (which evaluates
+    the QSSA species as post-processing).
+
+    Parameters
+    ----------
+    odesys : pyodesys.symbolic.SymbolicSys
+        E.g. from :func:`chempy.kinetics.ode.get_odesys` (symbolic engine).
+    qss_keys : iterable of str
+        Names of the QSSA species.
+    reference : dict, optional
+        Mapping symbols (dependent variables & parameters of ``odesys``) to values, used
+        to select among multiple roots of nonlinear equations (a real, non-negative root
+        closest to the values of the QSSA species in ``reference``).
+    \\*\\*kwargs :
+        Keyword arguments passed onto :class:`pyodesys.symbolic.PartiallySolvedSystem`.
+
+    Returns
+    -------
+    pyodesys.symbolic.PartiallySolvedSystem
+
+    """
+    from pyodesys.symbolic import PartiallySolvedSystem
+    if not hasattr(odesys, 'exprs'):
+        raise ValueError("QSSA reduction requires a symbolic system (e.g. engine='symbolic')")
+    qss_keys = list(qss_keys)
+    for k in qss_keys:
+        if k not in odesys.names:
+            raise ValueError("Unknown substance key: %s" % k)
+
+    def analytic_solver(x0, y0, p0, be):
+        syms = [odesys[k] for k in qss_keys]
+        eqs = [odesys.exprs[odesys.names.index(k)] for k in qss_keys]
+        try:
+            A, b = be.linear_eq_to_matrix(eqs, syms)
+        except ValueError:  # nonlinear (sympy.solvers.solveset.NonlinearError)
+            solutions = be.solve(eqs, syms, dict=True)
+            if len(solutions) > 1:
+                if reference is None:
+                    raise ValueError("Multiple roots of the QSSA equations, pass reference")
+                sol = _select_root(solutions, syms, reference)
+            else:
+                sol = solutions[0] if solutions else None
+            if sol is None or any(s not in sol for s in syms):
+                raise ValueError("Failed to solve the QSSA equations for: %s" % ', '.join(qss_keys))
+            exprs = [sol[s] for s in syms]
+        else:
+            exprs = list(A.LUsolve(b))
+        return OrderedDict((s, be.simplify(e)) for s, e in zip(syms, exprs))
+
+    return PartiallySolvedSystem(odesys, analytic_solver, **kwargs)
+
+
+def _timed_integrate(odesys, *args, **kwargs):
+    t0 = time.time()
+    res = odesys.integrate(*args, **kwargs)
+    return res, time.time() - t0
+
+
+def reduce_qssa(odesys, tout, c0, params=(), qss_keys=None, ratio=1e-3, max_fraction=1e-2, exclude=(),
+                **kwargs):
+    """ Quasi-steady-state reduction of a (stiff) kinetic model.
+
+    The full model is integrated, the species are ranked by their timescales
+    at the sampled states (see :func:`propose_qssa`) and a reduced system is
+    created (see :func:`qssa_system`), which is then integrated for comparison.
+
+    Parameters
+    ----------
+    odesys : pyodesys.symbolic.SymbolicSys
+    tout : array_like
+        Passed to ``odesys.integrate`` (for both the full and reduced system).
+    c0 : dict
+        Initial concentrations.
+    params : dict
+        Parameters.
+    qss_keys : iterable of str, optional
+        QSSA species, default: proposed by :func:`propose_qssa`.
+    ratio, max_fraction, exclude :
+        See :func:`propose_qssa`.
+    \\*\\*kwargs :
+        Keyword arguments passed to ``integrate`` (e.g. ``integrator``, ``atol``, ``rtol``).
+
+    Returns
+    -------
+    reduced : pyodesys.symbolic.PartiallySolvedSystem
+    report : dict
+        - qss_keys : list of str
+        - timescales : OrderedDict mapping name to the largest sampled timescale
+        - stiffness_reduction : ratio of the fastest timescale among the remaining species
+          to that of the full system (estimated speedup of implicit integration)
+        - speedup : measured ratio of wall times of integrating the full and reduced system
+        - nfev : pair of number of function evaluations (full, reduced)
+        - max_abs_err : OrderedDict mapping name to largest absolute deviation from the full model
+        - max_rel_err : largest deviation of the remaining (non-QSSA) species relative to their
+          respective peak values (the QSSA species deviate in the initial transient)
+        - full, reduced : the :class:`pyodesys.results.Result` instances
+
+    Examples
+    --------
+    >>> from chempy import Reaction, ReactionSystem
+    >>> from chempy.kinetics.ode import get_odesys
+    >>> rsys = ReactionSystem([
+    ...     Reaction({'A': 1}, {'R': 1}, 1.0), Reaction({'R': 1}, {'B': 1}, 1e5),
+    ...     Reaction({'R': 1, 'B': 1}, {'C': 1}, 1e3)], 'A R B C')
+    >>> odesys, extra = get_odesys(rsys)
+    >>> tout = [0, 1, 2, 5, 10]
+    >>> reduced, report = reduce_qssa(odesys, tout, {'A': 1, 'R': 0, 'B': 0, 'C': 0},
+    ...                               integrator='scipy', atol=1e-10, rtol=1e-8)
+    >>> report['qss_keys'], reduced.free_names
+    (['R'], ['A', 'B', 'C'])
+    >>> report['max_rel_err'] < 1e-3
+    True
+
+    """
+    full, t_full = _timed_integrate(odesys, tout, c0, params, **kwargs)
+    xout, yout, p = _samples(odesys, full)
+    p = np.asarray(p)[:len(odesys.params)]
+    if qss_keys is None:
+        qss_keys, timescales = propose_qssa(odesys, xout, yout, p, ratio, max_fraction, exclude)
+    else:
+        qss_keys = list(qss_keys)
+        timescales = propose_qssa(odesys, xout, yout, p, ratio, max_fraction, exclude)[1]
+    if not qss_keys:
+        raise ValueError("No species suitable for QSSA")
+    mid = len(xout)//2
+    reference = dict(zip(odesys.dep, yout[mid]))
+    reference.update(zip(odesys.params, p))
+    reduced = qssa_system(odesys, qss_keys, reference=reference)
+    red, t_red = _timed_integrate(reduced, tout, c0, params, **kwargs)
+
+    fastest = [tau for k, tau in timescales.items() if k not in qss_keys]
+    stiffness_reduction = (min(fastest) if fastest else np.inf)/min(timescales.values())
+    yred = np.asarray(red.yout)
+    if yred.shape != np.asarray(full.yout).shape:
+        from scipy.interpolate import interp1d
+        yred = interp1d(red.xout, red.yout, axis=0)(full.xout)
+    abs_err = np.max(np.abs(yred - full.yout), axis=0)
+    peak = np.max(np.abs(full.yout), axis=0)
+    rel_err = np.where(peak > 0, abs_err/np.where(peak > 0, peak, 1), abs_err)
+    remaining = [i for i, k in enumerate(odesys.names) if k not in qss_keys]
+    return reduced, {
+        'qss_keys': qss_keys,
+        'timescales': timescales,
+        'stiffness_reduction': float(stiffness_reduction),
+        'speedup': t_full/t_red if t_red > 0 else np.inf,
+        'nfev': (full.info.get('nfev'), red.info.get('nfev')),
+        'max_abs_err': OrderedDict(zip(odesys.names, abs_err)),
+        'max_rel_err': float(np.max(rel_err[remaining], initial=0)),
+        'full': full,
+        'reduced': red,
+    }
+
+
+def drg_interaction_coefficients(rsys, rates):
+    r""" Direct relation graph (DRG) interaction coefficients.
+
+    The coefficient :math:`r_{AB}` measures the error induced in the production
+    rate of ``A`` by removing ``B`` (and hence all reactions involving ``B``):
+
+    .. math ::
+
+        r_{AB} = \frac{\sum_i |\nu_{A,i} \omega_i \delta_{B,i}|}{\sum_i |\nu_{A,i} \omega_i|}
+
+    where :math:`\delta_{B,i}` is one if ``B`` participates in reaction ``i``
+    (otherwise zero). The maximum over all samples is returned.
+
+    Parameters
+    ----------
+    rsys : ReactionSystem
+    rates : array_like
+        Per reaction rates at sampled states, shape ``(n_samples, nr)``, e.g.
+        from ``extra['rate_exprs_cb'](xout, yout, params)`` (see
+        :func:`chempy.kinetics.ode.get_odesys`).
+
+    Returns
+    -------
+    ndarray of shape ``(ns, ns)`` (rows: ``A``, columns: ``B``, ordered as ``rsys.substances``).
+
+    """
+    rates = np.atleast_2d(np.asarray(rates, dtype=np.float64))
+    if rates.shape[-1] != rsys.nr:
+        raise ValueError("Incorrect number of reaction rates: %d (expected %d)" % (rates.shape[-1], rsys.nr))
+    nu = np.asarray(rsys.net_stoichs(), dtype=np.float64).reshape((rsys.nr, rsys.ns))
+    delta = np.zeros((rsys.nr, rsys.ns))
+    for ri, rxn in enumerate(rsys.rxns):
+        for sk in rxn.keys():
+            delta[ri, rsys.as_substance_index(sk)] = 1
+    result = np.zeros((rsys.ns, rsys.ns))
+    for sample in rates:
+        contrib = np.abs(nu*sample[:, None])  # (nr, ns): reaction effects on each substance
+        denom = np.sum(contrib, axis=0)
+        numer = contrib.T.dot(delta)
+        result = np.maximum(result, numer/np.where(denom > 0, denom, 1)[:, None])
+    return result
+
+
+def reduce_drg(rsys, targets, samples, eps=1e-2):
+    """ Directed relation graph (DRG) reduction of a mechanism against target species.
+
+    Starting from ``targets``, the species reachable through edges with
+    interaction coefficients (see :func:`drg_interaction_coefficients`) of at least
+    ``eps`` are retained, reactions involving any other species are dropped.
+
+    Parameters
+    ----------
+    rsys : ReactionSystem
+    targets : iterable of str
+        Substance keys of the observables.
+    samples : array_like
+        Per reaction rates at sampled states, shape ``(n_samples, nr)``.
+    eps : float
+        Threshold of the interaction coefficients.
+
+    Returns
+    -------
+    reduced : ReactionSystem
+        Created by :meth:`ReactionSystem.subset`.
+    report : dict
+        - species : list of retained substance keys
+        - dropped_species : list of substance keys
+        - dropped_reactions : list of (index, Reaction) pairs
+        - coefficients : interaction coefficients (ndarray)
+
+    Examples
+    --------
+    >>> from chempy import Reaction, ReactionSystem
+    >>> rsys = ReactionSystem([Reaction({'A': 1}, {'B': 1}, 1.0), Reaction({'B': 1}, {'C': 1}, 1.0),
+    ...                        Reaction({'A': 1}, {'D': 1}, 1e-6)], 'A B C D')
+    >>> reduced, report = reduce_drg(rsys, ['C'], [[1.0, 0.5, 1e-6]], eps=1e-3)
+    >>> report['species'], report['dropped_species']
+    (['A', 'B', 'C'], ['D'])
+    >>> reduced.nr
+    2
+
+    """
+    keys = list(rsys.substances)
+    for k in targets:
+        if k not in rsys.substances:
+            raise ValueError("Unknown substance key: %s" % k)
+    coeffs = drg_interaction_coefficients(rsys, samples)
+    retained = set(rsys.as_substance_index(k) for k in targets)
+    queue = list(retained)
+    while queue:
+        a = queue.pop()
+        for b in np.flatnonzero(coeffs[a] >= eps):
+            if b not in retained:
+                retained.add(b)
+                queue.append(b)
+    species = [k for i, k in enumerate(keys) if i in retained]
+    kept, dropped = rsys.subset(lambda rxn: all(k in species for k in rxn.keys()))
+    dropped_ids = [id(rxn) for rxn in dropped.rxns]
+    return kept, {
+        'species': species,
+        'dropped_species': [k for k in keys if k not in species],
+        'dropped_reactions': [(ri, rxn) for ri, rxn in enumerate(rsys.rxns) if id(rxn) in dropped_ids],
+        'coefficients': coeffs,
+    }
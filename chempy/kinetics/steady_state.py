@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Direct calculation of steady states of kinetic reaction systems.
+
+Instead of integrating the ODE-system to long times, dC/dt = 0 is solved using
+Newton's method (or pseudo-transient continuation), where the rows of the
+(singular) Jacobian which are linearly dependent due to conservation laws are
+replaced by the conservation constraints.
+"""
+from __future__ import (absolute_import, division, print_function)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def conservation_matrix(rsys, net_stoichs=None, tol=1e-10):
+    """ Basis of the conservation laws (invariants) of a reaction system.
+
+    The rows of :meth:`ReactionSystem.composition_balance_vectors` which are
+    conserved by all reactions are used primarily, when those do not span the
+    left null space of the net stoichiometry matrix, the basis is complemented
+    with vectors of the null space (from a singular value decomposition).
+
+    Parameters
+    ----------
+    rsys : ReactionSystem
+    net_stoichs : array_like, optional
+        Net stoichiometry matrix, shape ``(nr, ns)``. Default: ``rsys.net_stoichs()``.
+    tol : float
+        Relative tolerance used in the rank decisions.
+
+    Returns
+    -------
+    ndarray of shape ``(n_conserved, ns)``
+
+    Examples
+    --------
+    >>> from chempy import ReactionSystem
+    >>> rsys = ReactionSystem.from_string("H2O2 -> H2O + O; 1", 'H2O2 H2O O')
+    >>> conservation_matrix(rsys).tolist()
+    [[2.0, 2.0, 0.0], [2.0, 1.0, 1.0]]
+
+    """
+    if net_stoichs is None:
+        net_stoichs = rsys.net_stoichs()
+    S = np.asarray(net_stoichs, dtype=np.float64).reshape((rsys.nr, rsys.ns))
+    if rsys.nr == 0:
+        return np.eye(rsys.ns)
+    _, sv, vt = np.linalg.svd(S)
+    rank = int(np.sum(sv > tol*sv[0])) if sv.size and sv[0] > 0 else 0
+    null = vt[rank:]
+    n_conserved = rsys.ns - rank
+    try:
+        comp = np.asarray(rsys.composition_balance_vectors()[0], dtype=np.float64).reshape((-1, rsys.ns))
+    except AttributeError:  # substances lacking composition
+        comp = np.zeros((0, rsys.ns))
+    scale = np.max(np.abs(S))
+    comp = comp[np.all(np.abs(comp.dot(S.T)) <= tol*scale*np.max(np.abs(comp), axis=1, initial=1)[:, None], axis=1)]
+    rows = []
+    for candidate in np.concatenate((comp, null)):
+        if len(rows) == n_conserved:
+            break
+        if np.linalg.matrix_rank(np.array(rows + [candidate]), tol=tol*np.max(np.abs(candidate))) > len(rows):
+            rows.append(candidate)
+    return np.array(rows).reshape((n_conserved, rsys.ns))
+
+
+def _pivots(C):
+    """ Substance indices of well conditioned (column pivoted QR) square submatrix of ``C`` """
+    if C.shape[0] == 0:
+        return np.zeros(0, dtype=int)
+    from scipy.linalg import qr
+    _, _, piv = qr(C, pivoting=True, mode='economic')
+    return np.sort(piv[:C.shape[0]])
+
+
+def _params_array(rhs, params):
+    if params is None:
+        params = {}
+    if isinstance(params, dict):
+        missing = [k for k in rhs.param_keys if k not in params]
+        if missing:
+            raise KeyError("Missing parameters: %s" % ', '.join(missing))
+        arrs = [np.asarray(params[k], dtype=np.float64) for k in rhs.param_keys]
+        if not arrs:
+            return np.zeros(0)
+        return np.stack(np.broadcast_arrays(*arrs), axis=-1)
+    return np.asarray(params, dtype=np.float64)
+
+
+def _solve(M, b):
+    try:
+        return np.linalg.solve(M, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        out = np.empty_like(b)
+        for idx in np.ndindex(b.shape[:-1]):
+            out[idx] = np.linalg.lstsq(M[idx], b[idx], rcond=None)[0]
+        return out
+
+
+def steady_state(rsys, c0, params=None, method='ptc', atol=1e-12, rtol=1e-9, maxiter=200,
+                 dt0=None, rhs=None, tau=0.99):
+    """ Solves for the steady state of a kinetic reaction system.
+
+    The equations for the substances chosen as pivots of the conservation
+    matrix (see :func:`conservation_matrix`) are replaced by the conservation
+    constraints (relative to ``c0``) which makes the (analytic) Jacobian non-singular.
+
+    Parameters
+    ----------
+    rsys : ReactionSystem
+    c0 : dict or array_like
+        Initial concentrations (defining the conserved quantities), a dict
+        (values may be arrays) or an array of shape ``(..., ns)``.
+    params : dict or array_like, optional
+        Parameters (see :attr:`NumericRHS.param_keys`), a dict (values may be
+        arrays) or an array of shape ``(..., len(param_keys))``.
+    method : str
+        'newton' (damped Newton's method) or 'ptc' (pseudo-transient continuation,
+        i.e. implicit Euler steps with a growing step size, turning into Newton's method).
+    atol : float
+        Absolute tolerance of the concentrations.
+    rtol : float
+        Relative tolerance of the concentrations.
+    maxiter : int
+        Maximum number of iterations.
+    dt0 : float, optional
+        Initial (pseudo) time step of 'ptc'. Default: reciprocal of the largest
+        diagonal element of the Jacobian at ``c0``.
+    rhs : NumericRHS, optional
+        Default: ``rsys.compile_rhs()``, pass an instance when solving many times.
+    tau : float
+        Maximum fraction of the distance to zero taken by steps decreasing a concentration.
+
+    Returns
+    -------
+    conc : ndarray of shape ``(..., ns)``
+        The steady state concentrations (batch shape from ``c0`` & ``params``).
+    info : dict
+        With keys 'success' (bool array), 'niter', 'nfev', 'njev' and 'residual'
+        (the largest absolute rate of change at ``conc``).
+
+    Examples
+    --------
+    >>> from chempy import ReactionSystem, Substance
+    >>> rsys = ReactionSystem.from_string("A -> B; 3\\nB -> A; 'kb'", substance_factory=Substance)
+    >>> conc, info = steady_state(rsys, {'A': 1, 'B': 0}, {'kb': [1, 2]})
+    >>> conc.round(6).tolist(), info['success'].tolist()
+    ([[0.25, 0.75], [0.4, 0.6]], [True, True])
+
+    """
+    if method not in ('newton', 'ptc'):
+        raise ValueError("Unknown method: %s" % method)
+    if rhs is None:
+        rhs = rsys.compile_rhs()
+    if rhs.cstr_fr_fc:
+        raise NotImplementedError("Conservation laws do not hold in a CSTR")
+    if isinstance(c0, dict):
+        c0 = rsys.as_per_substance_array(c0)
+    c0 = np.asarray(c0, dtype=np.float64)
+    p = _params_array(rhs, params)
+    batch = np.broadcast_shapes(c0.shape[:-1], p.shape[:-1])
+    y0 = np.broadcast_to(c0, batch + (rhs.ns,))
+    p = np.broadcast_to(p, batch + p.shape[-1:])
+
+    C = conservation_matrix(rsys, rhs._scatter(np.eye(rhs.nr)))
+    piv = _pivots(C)
+    dyn = np.ones(rhs.ns, dtype=bool)
+    dyn[piv] = False
+    target = np.einsum('ij,...j->...i', C, y0)
+
+    def residual(y):
+        fout = rhs.f(0, y, p)
+        fout[..., piv] = np.einsum('ij,...j->...i', C, y) - target
+        return fout
+
+    def jacobian(y):
+        J = rhs.jac(0, y, p)
+        J[..., piv, :] = C
+        return J
+
+    y = np.array(y0)
+    G = residual(y)
+    J = jacobian(y)
+    nfev, njev = 1, 1
+    if method == 'newton':
+        inv_dt = np.zeros(batch)
+    else:
+        if dt0 is None:
+            diag = np.max(np.abs(np.diagonal(J, axis1=-2, axis2=-1)[..., dyn]), axis=-1, initial=0)
+            dt0 = np.where(diag > 0, 1/np.where(diag > 0, diag, 1), 1)
+        inv_dt = np.broadcast_to(1/np.asarray(dt0, dtype=np.float64), batch).copy()
+    norm = np.max(np.abs(G[..., dyn]), axis=-1, initial=0)
+    success = np.zeros(batch, dtype=bool)
+    niter = 0
+    while niter < maxiter and not success.all():
+        niter += 1
+        M = inv_dt[..., None, None]*np.diag(dyn.astype(np.float64)) - J
+        dy = _solve(M, G)
+        weights = atol + rtol*np.abs(y)
+        converged = np.max(np.abs(dy)/weights, axis=-1) <= 1
+        if method == 'ptc' and converged.any():  # small pseudo-time step, check the Newton step
+            dy_newton = _solve(-J, G)
+            converged = np.max(np.abs(dy_newton)/weights, axis=-1) <= 1
+        else:
+            dy_newton = dy
+        decreasing = (dy < 0) & (y > 0)
+        alpha = np.min(np.where(decreasing, -tau*y/np.where(decreasing, dy, -1), 1), axis=-1)
+        alpha = np.where(success, 0, np.minimum(alpha, 1))
+        if method == 'ptc':
+            step = np.where(converged[..., None], dy_newton, alpha[..., None]*dy)
+        else:
+            step = alpha[..., None]*dy
+        y = np.where(success[..., None], y, np.maximum(y + step, 0))
+        success = success | converged
+        G = residual(y)
+        J = jacobian(y)
+        nfev += 1
+        njev += 1
+        new_norm = np.max(np.abs(G[..., dyn]), axis=-1, initial=0)
+        if method == 'ptc':  # switched evolution relaxation
+            inv_dt = inv_dt*np.where(norm > 0, new_norm/np.where(norm > 0, norm, 1), 0)
+        norm = new_norm
+    info = dict(success=success, niter=niter, nfev=nfev, njev=njev,
+                residual=np.max(np.abs(rhs.f(0, y, p)), axis=-1, initial=0))
+    return y, info
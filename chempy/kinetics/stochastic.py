@@ -0,0 +1,607 @@
+# -*- coding: utf-8 -*-
+"""
+Stochastic simulation (chemical master equation) of reaction systems with mass action kinetics.
+
+Trajectories of copy numbers are sampled exactly using the next reaction method
+of Gibson & Bruck (2000) (an indexed priority queue of putative reaction times
+together with a reaction dependency graph makes each event cost O(log R)) or
+approximately using adaptive (explicit) tau-leaping (Cao, Gillespie & Petzold, 2006)
+or a hybrid scheme integrating the fast reactions as ODEs (Haseltine & Rawlings, 2002).
+"""
+from __future__ import (absolute_import, division, print_function)
+
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ..units import is_quantity, to_unitless, default_constants, default_units
+
+AVOGADRO = 6.02214076e23  # 1/mol, used when the volume lacks units
+
+
+def _NA_V(volume):
+    """ Number of molecules per unit (molar) concentration """
+    if is_quantity(volume):
+        return to_unitless(volume*default_constants.Avogadro_constant, 1/default_units.molar)
+    return AVOGADRO*volume
+
+
+def propensity_constants(rsys, volume, variables=None):
+    """ Stochastic rate constants of the reactions (in units of 1/s when ``volume`` has units)
+
+    The propensity of a reaction is ``c*h(x)`` where ``h(x)`` is the number of distinct
+    combinations of reactant molecules, e.g. ``x_A*(x_A - 1)/2`` for ``2 A -> ...``,
+    and ``c = k*(N_A*V)**(1 - order)*prod(n_i!)``.
+
+    Parameters
+    ----------
+    rsys : ReactionSystem
+        With (only) :class:`MassAction` rate expressions.
+    volume : float or quantity
+        Reaction volume, in litres (when unitless).
+    variables : dict, optional
+        Passed to the rate expressions (e.g. temperature or values of unique keys).
+
+    Returns
+    -------
+    ndarray of length ``rsys.nr``
+
+    Examples
+    --------
+    >>> from chempy import ReactionSystem, Substance
+    >>> rsys = ReactionSystem.from_string("2 A -> B; 1e9\\nB -> 2 A; 3", 'A B', substance_factory=Substance)
+    >>> c = propensity_constants(rsys, 1e-15)
+    >>> c.round(3).tolist()
+    [3.321, 3.0]
+
+    """
+    from .rates import MassAction
+    variables = variables or {}
+    NA_V = _NA_V(volume)
+    result = np.empty(rsys.nr)
+    for ri, rxn in enumerate(rsys.rxns):
+        ratex = rxn.rate_expr()
+        if not isinstance(ratex, MassAction):
+            raise NotImplementedError("Only mass action kinetics is supported (reaction %d)" % ri)
+        k = ratex.rate_coeff(variables, reaction=rxn)
+        if is_quantity(k):
+            order = rxn.order()
+            k = to_unitless(k, default_units.molar**(1 - order)/default_units.second)
+        factor = 1
+        for n in rxn.reac.values():
+            factor *= math.factorial(n)
+        result[ri] = k*NA_V**(1 - rxn.order())*factor
+    return result
+
+
+def dependency_graph(rsys):
+    """ Indices of the reactions whose propensities change when a reaction fires
+
+    A reaction depends on another one when it has a reactant whose amount is changed
+    by (the net stoichiometry of) the other reaction, a reaction always depends on itself.
+
+    Returns
+    -------
+    List (of length ``rsys.nr``) of sorted lists of reaction indices.
+
+    Examples
+    --------
+    >>> from chempy import ReactionSystem, Substance
+    >>> rsys = ReactionSystem.from_string("A -> B; 1\\nB -> C; 1\\nC -> A; 1", 'A B C', substance_factory=Substance)
+    >>> dependency_graph(rsys)
+    [[0, 1], [1, 2], [0, 2]]
+
+    """
+    consumers = {}
+    for ri, rxn in enumerate(rsys.rxns):
+        for sk in rxn.reac:
+            consumers.setdefault(sk, set()).add(ri)
+    graph = []
+    for ri, rxn in enumerate(rsys.rxns):
+        changed = [sk for sk in set(rxn.keys()) if rxn.net_stoich([sk])[0] != 0]
+        deps = {ri}
+        for sk in changed:
+            deps |= consumers.get(sk, set())
+        graph.append(sorted(deps))
+    return graph
+
+
+class IndexedPriorityQueue(object):
+    """ Binary min-heap of (key, value) pairs with keys ``0..n-1`` supporting updates in O(log n)
+
+    Parameters
+    ----------
+    values : iterable of floats
+        Initial value for each key.
+
+    Examples
+    --------
+    >>> ipq = IndexedPriorityQueue([3.0, 1.0, 2.0])
+    >>> ipq.top()
+    (1, 1.0)
+    >>> ipq.update(1, 5.0)
+    >>> ipq.top()
+    (2, 2.0)
+
+    """
+
+    def __init__(self, values):
+        self.values = [float(v) for v in values]
+        self.heap = sorted(range(len(self.values)), key=self.values.__getitem__)
+        self.pos = [0]*len(self.heap)
+        for i, key in enumerate(self.heap):
+            self.pos[key] = i
+
+    def __len__(self):
+        return len(self.heap)
+
+    def top(self):
+        """ Returns the (key, value) pair with the smallest value """
+        key = self.heap[0]
+        return key, self.values[key]
+
+    def _swap(self, i, j):
+        heap, pos = self.heap, self.pos
+        heap[i], heap[j] = heap[j], heap[i]
+        pos[heap[i]], pos[heap[j]] = i, j
+
+    def update(self, key, value):
+        """ Sets the value of ``key`` and restores the heap property """
+        self.values[key] = value
+        i = self.pos[key]
+        heap, values = self.heap, self.values
+        while i > 0 and values[heap[(i - 1)//2]] > value:  # sift up
+            self._swap(i, (i - 1)//2)
+            i = (i - 1)//2
+        n = len(heap)
+        while True:  # sift down
+            left = 2*i + 1
+            smallest = i
+            if left < n and values[heap[left]] < values[heap[smallest]]:
+                smallest = left
+            if left + 1 < n and values[heap[left + 1]] < values[heap[smallest]]:
+                smallest = left + 1
+            if smallest == i:
+                break
+            self._swap(i, smallest)
+            i = smallest
+
+
+class StochasticSystem(object):
+    """ Stochastic (copy number) representation of a reaction system with mass action kinetics
+
+    Parameters
+    ----------
+    rsys : ReactionSystem
+    volume : float or quantity
+        Reaction volume (in litres when unitless).
+    variables : dict, optional
+        Passed to the rate expressions, see :func:`propensity_constants`.
+
+    Attributes
+    ----------
+    c : ndarray
+        Propensity constants (see :func:`propensity_constants`).
+    net_stoichs : ndarray of ints, shape ``(nr, ns)``
+    dependencies : list of lists
+        See :func:`dependency_graph`.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from chempy import ReactionSystem, Substance
+    >>> rsys = ReactionSystem.from_string("A -> B; 0.5", 'A B', substance_factory=Substance)
+    >>> ssys = StochasticSystem(rsys, volume=1e-15)
+    >>> x = ssys.next_reaction([100, 0], [0, 1, 100], rng=np.random.default_rng(42))
+    >>> x[0].tolist(), x[-1].tolist(), bool(x[1, 0] < 100)
+    ([100, 0], [0, 100], True)
+
+    """
+
+    def __init__(self, rsys, volume, variables=None):
+        self.rsys = rsys
+        self.volume = volume
+        self.NA_V = _NA_V(volume)
+        self.c = propensity_constants(rsys, volume, variables)
+        self.net_stoichs = np.asarray(rsys.net_stoichs(), dtype=np.int64).reshape((rsys.nr, rsys.ns))
+        substance_keys = list(rsys.substances)
+        self.reactants = [[(substance_keys.index(sk), n) for sk, n in rxn.reac.items()] for rxn in rsys.rxns]
+        self.changes = [[(si, int(v)) for si, v in enumerate(row) if v != 0] for row in self.net_stoichs]
+        self.dependencies = dependency_graph(rsys)
+        self.reac_exp = np.zeros((rsys.nr, rsys.ns), dtype=np.int64)
+        for ri, reactants in enumerate(self.reactants):
+            for si, n in reactants:
+                self.reac_exp[ri, si] = n
+        self._fast_systems = {}  # fast subsystems (ODE) per partition, see :meth:`hybrid`
+
+    def counts(self, c0):
+        """ Copy numbers (rounded) from concentrations (molar when unitless), dict or array_like """
+        if isinstance(c0, dict):
+            c0 = self.rsys.as_per_substance_array(c0)
+        if is_quantity(c0):
+            c0 = to_unitless(c0, default_units.molar)
+        return np.rint(np.asarray(c0, dtype=np.float64)*self.NA_V).astype(np.int64)
+
+    def _x0(self, x0):
+        if isinstance(x0, dict):
+            x0 = [x0.get(sk, 0) for sk in self.rsys.substances]
+        x0 = np.array(x0, dtype=np.int64)
+        if np.any(x0 < 0):
+            raise ValueError("Negative copy numbers")
+        return x0
+
+    def propensity(self, ri, x):
+        """ Propensity of reaction ``ri`` given copy numbers ``x`` (sequence of ints) """
+        a = self.c[ri]
+        for si, n in self.reactants[ri]:
+            xi = x[si]
+            for k in range(n):
+                a *= (xi - k)
+            a /= math.factorial(n)
+        return max(a, 0.0)
+
+    def propensities(self, x):
+        """ Propensities of all reactions (vectorized over leading dimensions of ``x``) """
+        x = np.asarray(x, dtype=np.float64)
+        h = np.ones(x.shape[:-1] + (self.rsys.nr,))
+        for ri, reactants in enumerate(self.reactants):
+            for si, n in reactants:
+                for k in range(n):
+                    h[..., ri] *= np.maximum(x[..., si] - k, 0)
+                h[..., ri] /= math.factorial(n)
+        return self.c*h
+
+    def next_reaction(self, x0, tout, rng=None):
+        """ Samples a trajectory using the next reaction method (exact)
+
+        Parameters
+        ----------
+        x0 : dict or array_like of ints
+            Initial copy numbers.
+        tout : array_like
+            Increasing output times (the first one being the initial time).
+        rng : numpy.random.Generator, optional
+
+        Returns
+        -------
+        ndarray of ints with shape ``(len(tout), ns)``
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        tout = np.asarray(tout, dtype=np.float64)
+        x = [int(v) for v in self._x0(x0)]
+        out = np.empty((tout.size, len(x)), dtype=np.int64)
+        t = tout[0]
+        a = [self.propensity(ri, x) for ri in range(self.rsys.nr)]
+        inf = float('inf')
+        ipq = IndexedPriorityQueue([t + rng.exponential()/aj if aj > 0 else inf for aj in a])
+        idx_out = 0
+        while idx_out < tout.size:
+            mu, t_next = ipq.top() if len(ipq) else (None, inf)
+            while idx_out < tout.size and tout[idx_out] < t_next:
+                out[idx_out] = x
+                idx_out += 1
+            if t_next == inf or idx_out == tout.size:
+                break
+            t = t_next
+            for si, v in self.changes[mu]:
+                x[si] += v
+            for ri in self.dependencies[mu]:
+                a_old, a_new = a[ri], self.propensity(ri, x)
+                a[ri] = a_new
+                if a_new == 0:
+                    tau = inf
+                elif ri != mu and a_old > 0:
+                    tau = t + a_old/a_new*(ipq.values[ri] - t)  # reuse the random number
+                else:
+                    tau = t + rng.exponential()/a_new
+                ipq.update(ri, tau)
+        return out
+
+    def _critical(self, x, n_critical):
+        with np.errstate(divide='ignore'):
+            n_firings = np.where(self.net_stoichs < 0, x/np.where(self.net_stoichs < 0, -self.net_stoichs, 1), np.inf)
+        return np.min(n_firings, axis=1) < n_critical
+
+    def _highest_order(self):
+        """ Per species: highest order (HOR) of the reactions consuming it, and its multiplicity in those """
+        order = np.where(self.reac_exp > 0, self.reac_exp.sum(axis=1)[:, None], 0)
+        hor = np.max(order, axis=0)
+        n = np.max(np.where((order == hor) & (hor > 0), self.reac_exp, 0), axis=0)
+        return hor, n
+
+    def _g(self, x):
+        """ The factors :math:`g_i` of Cao et al. 2006 (from the highest order of reaction, HOR, of each species) """
+        hor, n = self._highest_order()
+        g = np.where(hor <= 1, 1.0, hor.astype(np.float64))
+        for si in range(x.size):
+            if x[si] < n[si]:
+                continue  # the reaction cannot fire, avoid the singularities below
+            xi = float(x[si])
+            if (hor[si], n[si]) == (2, 2):
+                g[si] = 2 + 1/(xi - 1)
+            elif (hor[si], n[si]) == (3, 2):
+                g[si] = 3 + 3/(2*(xi - 1))
+            elif (hor[si], n[si]) == (3, 3):
+                g[si] = 3 + 1/(xi - 1) + 2/(xi - 2)
+        return g
+
+    def _tau_noncritical(self, x, a, critical, eps):
+        """ Largest leap bounding the relative change of propensities (Cao et al. 2006, eq. 33) """
+        nc = np.where(critical, 0, a)
+        mu = self.net_stoichs.T.dot(nc)
+        sigma2 = (self.net_stoichs.T**2).dot(nc)
+        hor = self._highest_order()[0]
+        bound = np.maximum(eps*x/self._g(x), 1)
+        reactant = hor > 0
+        with np.errstate(divide='ignore'):
+            tau = np.where(reactant, np.minimum(bound/np.abs(mu), bound**2/sigma2), np.inf)
+        return np.min(tau, initial=np.inf)
+
+    def tau_leaping(self, x0, tout, rng=None, eps=0.03, n_critical=10, ssa_factor=10, n_ssa=100):
+        """ Samples a trajectory using adaptive (explicit) tau-leaping
+
+        Reactions within ``n_critical`` firings of exhausting a reactant are
+        treated as critical (at most one of them fires per leap). When the leap
+        would be shorter than ``ssa_factor`` times the expected time to the next
+        reaction, ``n_ssa`` exact (direct method) steps are taken instead.
+
+        Parameters
+        ----------
+        x0 : dict or array_like of ints
+        tout : array_like
+        rng : numpy.random.Generator, optional
+        eps : float
+            Bound on the relative change of the propensities in a leap.
+        n_critical : int
+        ssa_factor : float
+        n_ssa : int
+
+        Returns
+        -------
+        ndarray of ints with shape ``(len(tout), ns)``
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        tout = np.asarray(tout, dtype=np.float64)
+        x = self._x0(x0)
+        out = np.empty((tout.size, x.size), dtype=np.int64)
+        out[0] = x
+        t = tout[0]
+        idx_out = 1
+        n_direct = 0
+        while idx_out < tout.size:
+            a = self.propensities(x)
+            a0 = a.sum()
+            if a0 <= 0:
+                out[idx_out:] = x
+                break
+            t_limit = tout[idx_out]
+            if n_direct > 0:  # direct method step
+                tau = rng.exponential()/a0
+                if t + tau > t_limit:
+                    t = t_limit
+                else:
+                    t += tau
+                    x += self.net_stoichs[rng.choice(a.size, p=a/a0)]
+                    n_direct -= 1
+            else:
+                critical = self._critical(x, n_critical) & (a > 0)
+                tau1 = self._tau_noncritical(x, a, critical, eps)
+                if tau1 < ssa_factor/a0:
+                    n_direct = n_ssa
+                    continue
+                a0c = a[critical].sum()
+                while True:
+                    tau2 = rng.exponential()/a0c if a0c > 0 else np.inf
+                    tau = min(tau1, tau2, t_limit - t)
+                    k = np.where(critical, 0, rng.poisson(np.where(critical, 0, a)*tau))
+                    if tau2 <= tau1 and tau2 <= t_limit - t:
+                        k[rng.choice(a.size, p=np.where(critical, a, 0)/a0c)] += 1
+                    x_new = x + k.dot(self.net_stoichs)
+                    if np.all(x_new >= 0):
+                        break
+                    tau1 /= 2
+                x = x_new
+                t += tau
+            while idx_out < tout.size and tout[idx_out] <= t:
+                out[idx_out] = x
+                idx_out += 1
+        return out
+
+    def _fast_odesys(self, fast):
+        key = tuple(np.flatnonzero(fast))
+        if key not in self._fast_systems:
+            from ..chemistry import Reaction
+            from ..reactionsystem import ReactionSystem
+            from .ode import get_odesys
+            rxns = []
+            for ri in key:
+                rxn = self.rsys.rxns[ri]
+                k = self.c[ri]*self.NA_V**(rxn.order() - 1)
+                for n in rxn.reac.values():
+                    k /= math.factorial(n)
+                rxns.append(Reaction(rxn.reac, rxn.prod, k, rxn.inact_reac, rxn.inact_prod, checks=()))
+            fast_rsys = ReactionSystem(rxns, self.rsys.substances, checks=())
+            self._fast_systems[key] = get_odesys(fast_rsys, engine='numeric')[0]
+        return self._fast_systems[key]
+
+    def partition(self, x, threshold=100.0, n_min=100):
+        """ Mask of the reactions which are fast (treated deterministically) given copy numbers ``x``
+
+        A reaction is fast when its propensity is at least ``threshold`` and the copy
+        numbers of all substances it changes are at least ``n_min``.
+        """
+        x = np.asarray(x)
+        abundant = np.all((self.net_stoichs == 0) | (x >= n_min), axis=1)
+        return (self.propensities(x) >= threshold) & abundant
+
+    def hybrid(self, x0, tout, rng=None, threshold=100.0, n_min=100, n_sub=16, integrate_kwargs=None):
+        """ Samples a trajectory partitioning the reactions into a deterministic & a stochastic set
+
+        The reactions are partitioned (see :meth:`partition`) before each step. The
+        fast reactions are integrated as ODEs (using :func:`chempy.kinetics.ode.get_odesys`
+        with ``engine='numeric'``, one system per partition is generated and cached)
+        while the slow reactions fire stochastically: a slow reaction fires when the
+        integral of the total slow propensity along the (deterministic) trajectory
+        reaches an exponentially distributed threshold (Haseltine & Rawlings, 2002).
+        When all reactions are slow this reduces to the (exact) direct method.
+
+        Copy numbers of substances only changed by fast reactions are continuous,
+        these are rounded (stochastically) once no fast reaction changes them.
+
+        Parameters
+        ----------
+        x0 : dict or array_like of ints
+        tout : array_like
+        rng : numpy.random.Generator, optional
+        threshold : float
+            Minimum propensity (1/s) of fast reactions.
+        n_min : int
+            Minimum copy number of substances changed by fast reactions.
+        n_sub : int
+            Number of points per step at which the slow propensities are evaluated.
+        integrate_kwargs : dict, optional
+            Keyword arguments passed on to ``integrate`` of the fast ODE system
+            (default: ``integrator='solve_ivp'`` and ``atol`` corresponding to 1e-3 molecules).
+
+        Returns
+        -------
+        ndarray of floats with shape ``(len(tout), ns)``
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        integrate_kwargs = dict(dict(integrator='solve_ivp', atol=1e-3/self.NA_V, rtol=1e-8),
+                                **(integrate_kwargs or {}))
+        tout = np.asarray(tout, dtype=np.float64)
+        x = self._x0(x0).astype(np.float64)
+        out = np.empty((tout.size, x.size))
+        out[0] = x
+        t = tout[0]
+        idx_out = 1
+        changed = self.net_stoichs != 0
+        g, r = 0.0, rng.exponential()  # integrated slow propensity & its threshold
+        while idx_out < tout.size:
+            fast = self.partition(x, threshold, n_min)
+            discrete = ~np.any(changed[fast], axis=0) & (x != np.floor(x))
+            if np.any(discrete):
+                x[discrete] = np.floor(x[discrete] + rng.random(np.count_nonzero(discrete)))
+            a_slow = np.where(fast, 0, self.propensities(x))
+            a0 = a_slow.sum()
+            t_end = tout[idx_out]
+            if not np.any(fast):
+                if a0 > 0 and t + (r - g)/a0 <= t_end:
+                    t += (r - g)/a0
+                    x_fire = x
+                else:
+                    g += a0*(t_end - t)
+                    t, x_fire = t_end, None
+            else:
+                if a0 > 0:  # at most about one slow firing per step
+                    t_end = min(t_end, t + (r - g + 1)/a0)
+                tsub = np.linspace(t, t_end, n_sub)
+                res = self._fast_odesys(fast).integrate(tsub, x/self.NA_V, **integrate_kwargs)
+                xsub = np.clip(res.yout*self.NA_V, 0, None)
+                asub = np.where(fast, 0, self.propensities(xsub)).sum(axis=-1)
+                G = g + np.concatenate(([0], np.cumsum(np.diff(tsub)*(asub[1:] + asub[:-1])/2)))
+                if G[-1] >= r:
+                    k = np.argmax(G >= r)
+                    frac = (r - G[k-1])/(G[k] - G[k-1])
+                    t = tsub[k-1] + frac*(tsub[k] - tsub[k-1])
+                    x = xsub[k-1] + frac*(xsub[k] - xsub[k-1])
+                    x_fire = x
+                else:
+                    g = G[-1]
+                    t, x, x_fire = t_end, xsub[-1], None
+            if x_fire is not None:
+                a_fire = np.where(fast, 0, self.propensities(x_fire))
+                if a_fire.sum() > 0:
+                    x = x_fire + self.net_stoichs[rng.choice(a_fire.size, p=a_fire/a_fire.sum())]
+                g, r = 0.0, rng.exponential()
+            while idx_out < tout.size and tout[idx_out] <= t:
+                out[idx_out] = x
+                idx_out += 1
+        return out
+
+
+_stochastic_sys = None  # per process StochasticSystem used by _simulate_shard
+
+
+def _stochastic_init(rsys, volume, variables):
+    global _stochastic_sys
+    _stochastic_sys = StochasticSystem(rsys, volume, variables)
+
+
+def _simulate_shard(seeds, x0, tout, method, kwargs):
+    simulate = getattr(_stochastic_sys, method)
+    return np.array([simulate(x0, tout, rng=np.random.default_rng(seed), **kwargs) for seed in seeds])
+
+
+def simulate(rsys, x0, tout, n_trajectories=1, volume=1e-15, variables=None, method='next_reaction',
+             seed=None, workers=None, mp_context=None, **kwargs):
+    """ Samples stochastic trajectories of a reaction system
+
+    Each trajectory uses an independent random number stream (spawned from
+    ``numpy.random.SeedSequence(seed)``), the result is therefore independent of
+    the number of worker processes.
+
+    Parameters
+    ----------
+    rsys : ReactionSystem
+    x0 : dict or array_like of ints
+        Initial copy numbers (see :meth:`StochasticSystem.counts` for converting concentrations).
+    tout : array_like
+        Output times, the first one being the initial time.
+    n_trajectories : int
+    volume : float or quantity
+        Reaction volume (litres when unitless).
+    variables : dict, optional
+        Passed to the rate expressions.
+    method : str
+        'next_reaction' (exact), 'tau_leaping' (approximate) or 'hybrid' (see :meth:`StochasticSystem.hybrid`).
+    seed : int, optional
+    workers : int, optional
+        Number of worker processes, default: in-process (serial) simulation.
+    mp_context : multiprocessing context, optional
+        Passed to :class:`concurrent.futures.ProcessPoolExecutor`.
+    \\*\\*kwargs :
+        Keyword arguments passed on to the method of :class:`StochasticSystem`.
+
+    Returns
+    -------
+    ndarray with shape ``(n_trajectories, len(tout), ns)`` (of floats for ``method='hybrid'``)
+
+    Examples
+    --------
+    >>> from chempy import ReactionSystem, Substance
+    >>> rsys = ReactionSystem.from_string("A -> B; 1", 'A B', substance_factory=Substance)
+    >>> xout = simulate(rsys, {'A': 50}, [0, 1, 5], n_trajectories=3, seed=42)
+    >>> xout.shape, xout.sum(axis=-1).tolist()
+    ((3, 3, 2), [[50, 50, 50], [50, 50, 50], [50, 50, 50]])
+
+    """
+    if method not in ('next_reaction', 'tau_leaping', 'hybrid'):
+        raise ValueError("Unknown method: %s" % method)
+    seeds = np.random.SeedSequence(seed).spawn(n_trajectories)
+    if workers is None or workers == 1:
+        global _stochastic_sys
+        ori = _stochastic_sys
+        _stochastic_init(rsys, volume, variables)
+        try:
+            return _simulate_shard(seeds, x0, tout, method, kwargs)
+        finally:
+            _stochastic_sys = ori
+
+    from concurrent.futures import ProcessPoolExecutor
+    n_shards = min(n_trajectories, 4*workers)
+    shards = [seeds[i::n_shards] for i in range(n_shards)]  # interleaved for load balancing
+    out = np.empty((n_trajectories, len(tout), rsys.ns), dtype=np.float64 if method == 'hybrid' else np.int64)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=_stochastic_init,
+                             initargs=(rsys, volume, variables)) as executor:
+        futures = [executor.submit(_simulate_shard, shard, x0, tout, method, kwargs) for shard in shards]
+        for i, future in enumerate(futures):
+            out[i::n_shards] = future.result()
+    return out
@@ -4,6 +4,7 @@ from __future__ import (absolute_import, division, print_function)
 from collections import defaultdict
 from functools import reduce
 from operator import mul
+import os
 
 try:
     import numpy as np
@@ -227,3 +228,45 @@ def test_get_native__Radiolytic__named_parameter__units(scaling_density):
     ref_H2_uM = to_unitless(c0['H2'], u.micromolar) + to_unitless(c0['H'], u.micromolar)/2 + t_ul*p_ul/2 - ref_H_uM/2
     assert np.allclose(to_unitless(result.named_dep('H'), u.micromolar), ref_H_uM)
     assert np.allclose(to_unitless(result.named_dep('H2'), u.micromolar), ref_H2_uM)
+
+
+@pytest.mark.veryslow
+@requires('pygslodeiv2', 'pyodesys')
+def test_get_native__cache():
+    import shutil
+    import tempfile
+    rsys = ReactionSystem.from_string('\n'.join(['H2O -> H2O+ + e-(aq); 1e-8', 'e-(aq) + H2O+ -> H2O; 1e10']))
+    odesys, extra = get_odesys(rsys)
+    c0 = {'H2O': 0, 'H2O+': 2e-9, 'e-(aq)': 3e-9}
+    tempdir = tempfile.mkdtemp()
+    try:
+        native1 = get_native(rsys, odesys, 'gsl', cache=tempdir)
+        res1 = native1.integrate(1, c0, atol=1e-15, rtol=1e-15, integrator='gsl')
+        entries = [name for name in os.listdir(tempdir) if not name.endswith('.lock')]
+        assert len(entries) == 1
+        native2 = get_native(rsys, odesys, 'gsl', cache=tempdir)
+        assert native2._native.fingerprint() == native1._native.fingerprint() == entries[0]
+        res2 = native2.integrate(1, c0, atol=1e-15, rtol=1e-15, integrator='gsl')
+        assert np.allclose(res1.yout[-1], res2.yout[-1])
+        assert sorted(os.listdir(tempdir)) == entries
+    finally:
+        shutil.rmtree(tempdir)
+
+
+@pytest.mark.veryslow
+@requires('pycvodes', 'pyodesys')
+def test_get_native__integrate_batch():
+    rsys = ReactionSystem.from_string("2 O3 -> 3 O2; 'k2'")
+    odesys, extra = get_odesys(rsys, include_params=False)
+    native = get_native(rsys, odesys, 'cvode', conc_roots=['O2'])
+    tout = np.linspace(0, 10, 7)
+    c0 = {'O3': np.linspace(1e-3, 5e-3, 6), 'O2': 0}
+    params = np.logspace(-1, 1, 6).reshape((6, 1))
+    special_settings = np.array([[1e-3], [2e-3]]*3)
+    kw = dict(atol=1e-12, rtol=1e-12)
+    res = native.integrate_batch(tout, c0, params, special_settings=special_settings, **kw)
+    assert res.yout.shape == (6, 7, 2) and np.all(res.success) and np.all(res.nfev > 0)
+    for i in range(6):
+        ref = native.integrate(tout, {'O3': c0['O3'][i], 'O2': 0}, params[i],
+                               special_settings=list(special_settings[i]), **kw)
+        assert np.allclose(res.yout[i], ref.yout)
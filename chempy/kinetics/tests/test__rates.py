@@ -7,10 +7,40 @@ import pytest
 
 from chempy import Reaction
 from chempy.units import allclose, Backend, to_unitless, units_library, default_units as u
-from chempy.util._expr import Log10, Constant
+from chempy.util._expr import Log10, Constant, StackedPoly
 from chempy.util.testing import requires
 from ..rates import MassAction, Radiolytic
-from .._rates import TPoly, RTPoly, ShiftedTPoly, ShiftedRTPoly, ShiftedLog10TPoly, TPiecewise
+from .._rates import TPoly, RTPoly, ShiftedTPoly, ShiftedRTPoly, Log10TPoly, ShiftedLog10TPoly, TPiecewise
+
+
+@requires('numpy')
+def test_StackedPoly__TPoly():
+    import numpy as np
+    polys = [TPoly([10, 0.1]), ShiftedTPoly([273.15, 7, .2, .03, .004]), ShiftedTPoly([298.15, 1, 2])]
+    sp = StackedPoly(polys)
+    T = np.linspace(273.15, 373.15, 7)
+    res = sp(T)
+    assert res.shape == (7, 3)
+    for i, p in enumerate(polys):
+        assert np.allclose(res[:, i], p({'temperature': T}))
+
+
+@requires('numpy')
+def test_StackedPoly__Log10TPoly():
+    import numpy as np
+    T = np.linspace(273.15, 373.15, 7)
+    variables = {'temperature': T, 'Tref': 298.15, 'log10_temperature': Log10('temperature'),
+                 'log10_Tref': Log10('Tref')}
+    polys = [Log10TPoly([1, 2, 3]), ShiftedLog10TPoly([4, 5], unique_keys=('log10_Tref',))]
+    sp = StackedPoly(polys, variables)
+    res = sp.from_variables(variables)
+    assert res.shape == (7, 2)
+    for i, p in enumerate(polys):
+        assert np.allclose(res[:, i], p(variables, backend=np))
+    assert np.allclose(res, sp(np.log10(T)))
+    assert not np.allclose(res, sp(T))  # the argument of __call__ is log10(T)
+    with pytest.raises(KeyError, match="Log10"):
+        sp.from_variables({'temperature': T})
 
 
 def test_TPolyMassAction():
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+
+import pytest
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from chempy import Reaction, ReactionSystem
+from chempy.util.testing import requires
+from ..analysis import reaction_contributions, plot_reaction_contributions
+from ..numeric import NumericRHS
+
+
+def _rsys():
+    return ReactionSystem([
+        Reaction({'A': 1}, {'B': 1}, 3.0), Reaction({'B': 1}, {'A': 1}, 2.0),
+        Reaction({'B': 1}, {'C': 1}, 5.0), Reaction({'A': 2}, {'C': 1}, 0.5),
+        Reaction({'C': 1}, {'B': 2}, 0.1)], 'A B C')
+
+
+@requires('numpy', 'scipy')
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_reaction_contributions(chunk_size):
+    rsys = _rsys()
+    kernel = NumericRHS(rsys)
+    rng = np.random.default_rng(0)
+    yout = rng.random((20, 3))
+    xout = np.linspace(0, 1, 20)
+    ridx, contrib, total = reaction_contributions((xout, yout, []), rsys, kernel.rates, top_k=2,
+                                                  chunk_size=chunk_size)
+    assert ridx.shape == contrib.shape == (20, 3, 2)
+    assert np.allclose(total, kernel.f(xout, yout))
+    rates = kernel.rates(xout, yout)
+    for si, sk in enumerate(rsys.substances):
+        effects = rsys.per_reaction_effect_on_substance(sk)
+        for ti in range(20):
+            ref = sorted(((n*rates[ti, ri], ri) for ri, n in effects.items()), key=lambda a: -abs(a[0]))[:2]
+            assert ridx[ti, si].tolist() == [ri for _, ri in ref]
+            assert np.allclose(contrib[ti, si], [c for c, _ in ref])
+
+
+@requires('numpy', 'scipy')
+def test_reaction_contributions__padding():
+    rsys = _rsys()
+    ridx, contrib, total = reaction_contributions(([0.0], [[1.0, 2.0, 3.0]], []), rsys, NumericRHS(rsys).rates,
+                                                  ['A', 'C'], top_k=4)
+    assert ridx.shape == (1, 2, 4)
+    assert ridx[0, 1, 3] == -1 and contrib[0, 1, 3] == 0
+    assert sorted(ridx[0, 0, :3].tolist()) == [0, 1, 3]
+
+
+@requires('numpy', 'scipy', 'matplotlib', 'pyodesys')
+def test_plot_reaction_contributions__top_k():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    rsys = _rsys()
+    xout = np.linspace(1, 2, 5)
+    yout = np.array([[1.0, 0.1, 0.0]]*5)
+    _, axes = plt.subplots(1, 1, squeeze=False)
+    plot_reaction_contributions((xout, yout, np.empty((5, 0))), rsys, NumericRHS(rsys).rates, ['B'],
+                                axes=axes[0], top_k=1, yscale='linear')
+    lines = axes[0][0].get_lines()
+    assert len(lines) == 1
+    assert np.allclose(lines[0].get_ydata(), 3.0)
+    with pytest.raises(ValueError):
+        plot_reaction_contributions((xout, yout, np.empty((5, 0))), rsys, NumericRHS(rsys).rates, ['B'],
+                                    axes=axes[0], top_k=1, combine_equilibria=True)
+    plt.close('all')
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+
+import pytest
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from chempy import Reaction, ReactionSystem
+from chempy.units import SI_base_registry, units_library, default_units as u
+from chempy.util.testing import requires
+from ..fitting import fit_kinetic_params, _compiled_systems
+from ..rates import MassAction
+
+
+def _get_rsys():
+    r1 = Reaction({'A': 1}, {'B': 1}, MassAction(unique_keys=('k1',)))
+    r2 = Reaction({'B': 1}, {'C': 1}, MassAction(unique_keys=('k2',)))
+    return ReactionSystem([r1, r2], 'A B C')
+
+
+def _series(k1, k2, c0A, tout):
+    A = c0A*np.exp(-k1*tout)
+    B = c0A*k1/(k2 - k1)*(np.exp(-k1*tout) - np.exp(-k2*tout))
+    return dict(tout=tout, c0={'A': c0A}, observed={'A': A, 'B': B})
+
+
+_integrate_kw = dict(integrator='scipy', atol=1e-12, rtol=1e-10)
+
+
+@requires('numpy', 'scipy', 'pyodesys', 'sympy')
+@pytest.mark.parametrize('engine', ['symbolic', 'numeric'])
+def test_fit_kinetic_params(engine):
+    tout = np.linspace(0.1, 3, 12)
+    series = [_series(1.3, 0.4, 1.0, tout), _series(1.3, 0.4, 2.0, tout)]
+    series[1]['observed']['B'][3] = np.nan  # missing value
+    best, cov, info = fit_kinetic_params(_get_rsys(), series, ['k1', 'k2'], guess={'k1': 0.5, 'k2': 1.0},
+                                         odesys_kwargs=dict(include_params=False, engine=engine),
+                                         integrate_kwargs=_integrate_kw)
+    assert info['success']
+    assert abs(best['k1'] - 1.3) < 1e-6 and abs(best['k2'] - 0.4) < 1e-6
+    assert info['dof'] == 4*12 - 1 - 2
+    assert cov.shape == (2, 2) and np.all(np.abs(cov) < 1e-10)  # noise free
+
+    rng = np.random.default_rng(42)
+    for s in series:
+        for k in s['observed']:
+            s['observed'][k] = s['observed'][k] + rng.normal(0, 0.01, tout.size)
+    best, cov, info = fit_kinetic_params(_get_rsys(), series, ['k1', 'k2'], guess={'k1': 0.5, 'k2': 1.0},
+                                         odesys_kwargs=dict(include_params=False, engine=engine),
+                                         integrate_kwargs=_integrate_kw)
+    err = np.sqrt(np.diag(cov))
+    assert np.all(err > 0)
+    assert abs(best['k1'] - 1.3) < 4*err[0] and abs(best['k2'] - 0.4) < 4*err[1]
+
+
+@requires('numpy', 'scipy', 'pyodesys')
+def test_fit_kinetic_params__multistart():
+    tout = np.linspace(0.1, 3, 12)
+    series = [_series(1.3, 0.4, 1.0, tout)]
+    series[0]['observed'].pop('A')  # k1 & k2 interchangeable => two local minima
+    kw = dict(odesys_kwargs=dict(include_params=False, engine='numeric'), integrate_kwargs=_integrate_kw)
+    start_kw = dict(n_starts=6, seed=7, guess={'k1': 0.5, 'k2': 1.0}, bounds={'k1': (1.0, 10.0), 'k2': (1e-2, 10.0)})
+    _compiled_systems.clear()
+    best, cov, info = fit_kinetic_params(_get_rsys(), series, ['k1', 'k2'], workers=2, **dict(start_kw, **kw))
+    assert len(_compiled_systems) == 1  # created in the parent process only (workers have their own)
+    assert len(info['starts']) == 6
+    assert info['starts'][0]['cost'] <= info['starts'][-1]['cost']
+    assert abs(best['k1'] - 1.3) < 1e-5 and abs(best['k2'] - 0.4) < 1e-5
+    serial, _, serial_info = fit_kinetic_params(_get_rsys(), series, ['k1', 'k2'], **dict(start_kw, **kw))
+    assert np.allclose([o['cost'] for o in serial_info['starts']], [o['cost'] for o in info['starts']])
+
+    with pytest.raises(ValueError):
+        fit_kinetic_params(_get_rsys(), series, ['k1', 'k2'], guess={'k1': 0.5}, **kw)  # no guess for k2
+    with pytest.raises(ValueError):
+        fit_kinetic_params(_get_rsys(), series, ['k1'], guess={'k1': -1.0}, **kw)
+
+
+@requires('numpy', 'scipy', 'pyodesys', units_library)
+def test_fit_kinetic_params__units():
+    tout = np.linspace(0.1, 3, 12)
+    serie = _series(1.3, 0.4, 1.0, tout)
+    serie['tout'] = tout*1000*u.ms
+    serie['c0'] = {'A': 1e-3*u.molar}
+    serie['observed'] = {k: v*u.mM for k, v in serie['observed'].items()}
+    serie['sigma'] = 0.01*u.mM
+    best, cov, info = fit_kinetic_params(
+        _get_rsys(), [serie], ['k1', 'k2'], guess={'k1': 0.5/u.s, 'k2': 60/u.minute},
+        unit_registry=SI_base_registry, odesys_kwargs=dict(include_params=False, engine='numeric'),
+        integrate_kwargs=_integrate_kw)
+    assert info['success']
+    assert abs(best['k1'] - 1.3/u.s) < 1e-6/u.s
+    assert abs(best['k2'] - 24/u.minute) < 1e-4/u.minute
+    assert cov.shape == (2, 2)
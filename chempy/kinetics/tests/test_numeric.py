@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+
+import pytest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from chempy import Reaction, ReactionSystem
+from chempy.units import SI_base_registry, units_library, default_units as u
+from chempy.util.testing import requires
+from .test_rates import _get_SpecialFraction_rsys
+from ..numeric import NumericRHS, ExtentRHS, EquilibriumRHS
+from ..ode import get_odesys
+from ..rates import Arrhenius, MassAction, Radiolytic
+
+
+def _get_rsys(defaults=False):
+    r1 = Reaction({'A': 2}, {'B': 1}, 3.0)
+    r2 = Reaction({'B': 1}, {'A': 2}, MassAction([0.7] if defaults else None, unique_keys=('kB',)))
+    r3 = Reaction({'A': 1, 'B': 1}, {'C': 1}, MassAction(Arrhenius(
+        [1e3, 2000] if defaults else None, unique_keys=('A_C', 'Ea_R_C'))))
+    r4 = Reaction({'C': 1}, {'A': 1}, Radiolytic([1e-7]))
+    return ReactionSystem([r1, r2, r3, r4], 'A B C')
+
+
+@requires('numpy')
+def test_NumericRHS():
+    rsys = _get_rsys()
+    rhs = NumericRHS(rsys)
+    assert rhs.param_keys == ('A_C', 'Ea_R_C', 'density', 'doserate', 'kB', 'temperature')
+    assert rhs.reac_idx.shape == (4, 2)
+    c = [5, 7, 11]
+    p = [1e10, 4000, 998, 0.2, 11, 298.15]
+    variables = dict(zip(rsys.substances, c), **dict(zip(rhs.param_keys, p)))
+    ref = rsys.rates(variables)
+    fout = rhs.f(0, c, p)
+    for i, sk in enumerate(rsys.substances):
+        assert abs(fout[i] - ref[sk]) < 1e-12*abs(ref[sk])
+
+    rout = rhs.rates(0, c, p)
+    rref = [rxn.rate_expr()(variables, reaction=rxn) for rxn in rsys.rxns]
+    assert np.allclose(rout, rref, rtol=1e-14, atol=0)
+
+    with pytest.raises(ValueError):
+        rhs.f(0, c, p[:-1])
+
+
+@requires('numpy')
+def test_NumericRHS__batched():
+    rsys = _get_rsys()
+    rhs = NumericRHS(rsys)
+    c = np.array([[5, 7, 11], [1, 2, 3], [.1, .2, .3]])
+    p = np.array([1e10, 4000, 998, 0.2, 11, 298.15])
+    P = np.tile(p, (3, 1))
+    P[1, -1] = 310
+    fout = rhs.f(0, c, P)
+    assert fout.shape == (3, 3)
+    for i in range(3):
+        assert np.allclose(fout[i], rhs.f(0, c[i], P[i]), rtol=1e-14, atol=0)
+
+
+@requires('numpy')
+@pytest.mark.parametrize('compiled', [True, False])
+def test_NumericRHS__sequences(compiled):
+    from chempy.util._expr import Expr
+    Lin = Expr.from_callback(lambda args, t, backend=None, **kw: args[0]*t, parameter_keys=('time',), nargs=1)
+    rsys = ReactionSystem([Reaction({'A': 1}, {'B': 1}, MassAction(Lin([3]))),
+                           Reaction({'B': 1}, {'A': 1}, 'k')], 'A B')
+    rhs = NumericRHS(rsys)
+    if not compiled:
+        rhs._compiled_k_var_cache = None  # interpreted evaluation of the rate expressions
+    t, y, p = [0.5, 2.0], [[5, 7], [1, 2]], [[11], [13]]
+    for meth in ('f', 'jac', 'rates'):
+        ref = getattr(rhs, meth)(np.array(t), np.array(y), np.array(p))
+        assert np.allclose(getattr(rhs, meth)(t, y, p), ref)
+        assert np.allclose(getattr(rhs, meth)(tuple(t), y, p), ref)
+    assert np.allclose(rhs.f(t, y, p)[:, 1], [3*0.5*5 - 11*7, 3*2*1 - 13*2])
+
+
+@requires('numpy')
+def test_NumericRHS__Piecewise__out_of_bounds():
+    from chempy.util._expr import create_Piecewise, create_Poly
+    TPoly = create_Poly('temperature')
+    k = create_Piecewise('temperature')([250, TPoly([1, 0.01]), 350])
+    rsys = ReactionSystem([Reaction({'A': 1}, {'B': 1}, MassAction(k))], 'A B')
+    rhs = NumericRHS(rsys)
+    assert rhs._compiled_k_var() is not None
+    assert np.allclose(rhs.f(0, [2, 0], [300]), [-8, 8])
+    for T in ([400], [[300], [400]]):
+        with pytest.raises(ValueError):
+            rhs.f(0, [2, 0], T)
+
+
+@requires('numpy')
+def test_NumericRHS__SpecialFraction():
+    rsys = _get_SpecialFraction_rsys(11, 13)
+    rhs = rsys.compile_rhs()
+    assert rhs.param_keys == ()
+    conc = {'H2': 2, 'Br2': 3, 'HBr': 5}
+    ref = 11*2*3**1.5/(3 + 13*5)
+    assert np.allclose(rhs.f(0, [conc[k] for k in rsys.substances]), [-ref, -ref, 2*ref])
+
+
+@requires('numpy', 'pyodesys', 'sympy')
+@pytest.mark.parametrize('include_params', [True, False])
+def test_get_odesys__numeric(include_params):
+    rsys = _get_rsys(defaults=True)
+    substitutions = {'temperature': 298.15}
+    kw = dict(include_params=include_params, substitutions=substitutions)
+    symsys, sym_extra = get_odesys(rsys, **kw)
+    numsys, num_extra = get_odesys(rsys, engine='numeric', **kw)
+    assert numsys.param_names == symsys.param_names
+    assert numsys.ny == 3
+    assert num_extra['linear_dependencies'] is None
+    c0 = {'A': 1.0, 'B': 0.5, 'C': 0.1}
+    params = {'A_C': 1e3, 'Ea_R_C': 2000, 'density': 998, 'doserate': 0.2, 'kB': 0.7,
+              'rate_constant': 3.0, 'radiolytic_yield': 1e-7}
+    params = {k: v for k, v in params.items() if k in numsys.param_names}
+    x, y, p = numsys.to_arrays(0, c0, params)
+    assert np.allclose(numsys.f_cb(x[0], y, p), symsys.f_cb(x[0], y, p), rtol=1e-13, atol=0)
+    tout = np.linspace(0, 3, 17)
+    res_num = numsys.integrate(tout, c0, params, integrator='scipy', atol=1e-10, rtol=1e-10)
+    res_sym = symsys.integrate(tout, c0, params, integrator='scipy', atol=1e-10, rtol=1e-10)
+    assert np.allclose(res_num.yout, res_sym.yout, rtol=1e-7, atol=1e-9)
+    rnum = num_extra['rate_exprs_cb'](res_num.xout, res_num.yout, res_num.params)
+    rsym = sym_extra['rate_exprs_cb'](res_sym.xout, res_sym.yout, res_sym.params)
+    assert np.allclose(rnum, rsym, rtol=1e-6, atol=1e-9)
+
+
+@requires('numpy', 'pyodesys', 'scipy')
+def test_get_odesys__numeric__cstr():
+    from .test_ode import _check_cstr
+    rsys = ReactionSystem.from_string("2 H2O2 -> O2 + 2 H2O; 5")
+    odesys, extra = get_odesys(rsys, cstr=True, engine='numeric')
+    fr, fc = extra['cstr_fr_fc']
+    _check_cstr(odesys, fr, fc)
+
+
+@requires('numpy', 'pyodesys', units_library)
+def test_get_odesys__numeric__units():
+    rad = Radiolytic([2.4e-7*u.mol/u.joule])
+    rxn1 = Reaction({'A': 4, 'B': 1}, {'C': 3, 'D': 2}, rad)
+    rxn2 = Reaction({'C': 1}, {'D': 1}, 2/u.s)
+    rsys = ReactionSystem([rxn1, rxn2], 'A B C D')
+    odesys = get_odesys(rsys, unit_registry=SI_base_registry, engine='numeric')[0]
+    conc = {'A': 3*u.molar, 'B': 5*u.molar, 'C': 11*u.molar, 'D': 13*u.molar}
+    x, y, p = odesys.to_arrays(-37*u.second, conc, {
+        'doserate': 0.4*u.gray/u.second, 'density': 0.998*u.kg/u.dm3})
+    fout = odesys.f_cb(x, y, p)
+    r = 2.4e-7*0.4*998  # mol/m3/s
+    r2 = 2*11e3
+    ref = [-4*r, -r, 3*r - r2, 2*r + r2]
+    assert np.allclose(fout, ref, rtol=1e-14, atol=0)
+
+
+@requires('numpy', 'pyodesys')
+def test_get_odesys__numeric__unknown_engine():
+    with pytest.raises(ValueError):
+        get_odesys(_get_rsys(), engine='foobar')
+
+
+@requires('numpy')
+def test_NumericRHS__jac():
+    rsys = _get_rsys()
+    rsys += ReactionSystem(_get_SpecialFraction_rsys(11, 13).rxns, 'H2 Br2 HBr')
+    rhs = NumericRHS(rsys, cstr_fr_fc=('fr', {'A': 'fc_A', 'HBr': 'fc_HBr'}))
+    c = np.array([5, 7, 11, 2, 3, 0])
+    p = dict(A_C=1e10, Ea_R_C=4000, density=998, doserate=0.2, kB=11, temperature=298.15, fr=.3, fc_A=1, fc_HBr=2)
+    p = [p[k] for k in rhs.param_keys]
+    indptr, indices = rhs.jac_sparsity()
+    assert rhs.nnz == len(indices) == indptr[-1] < rhs.ns**2
+    J = rhs.jac(0, c, p)
+    Jref = np.empty_like(J)
+    for ci in range(rhs.ns):
+        h = 1e-6*max(c[ci], 1)
+        dc = np.zeros(rhs.ns)
+        dc[ci] = h
+        Jref[:, ci] = (rhs.f(0, c + dc, p) - rhs.f(0, c - dc, p))/(2*h)
+    assert np.allclose(J, Jref, rtol=1e-6, atol=1e-8)
+    assert np.all(rhs.jac_csr(0, c, p).toarray() == J)
+
+    Jbatch = rhs.jac(0, np.array([c, 2*c]), p)
+    assert np.allclose(Jbatch[0], J, rtol=1e-14, atol=0)
+    assert np.allclose(Jbatch[1], rhs.jac(0, 2*c, p), rtol=1e-14, atol=0)
+
+
+@requires('numpy', 'pyodesys', 'scipy')
+def test_get_odesys__numeric__sparse():
+    rsys = _get_rsys(defaults=True)
+    kw = dict(substitutions={'temperature': 298.15})
+    densesys, _ = get_odesys(rsys, engine='numeric', **kw)
+    sparsesys, _ = get_odesys(rsys, engine='numeric', sparse=True, **kw)
+    assert sparsesys.nnz == sparsesys.kernel.nnz
+    c0, params = {'A': 1.0, 'B': 0.5, 'C': 0.1}, {'density': 998, 'doserate': 0.2}
+    x, y, p = sparsesys.to_arrays(0, c0, params)
+    assert np.allclose(sparsesys.j_cb(x[0], y, p).toarray(), densesys.j_cb(x[0], y, p))
+    tout = np.linspace(0, 3, 17)
+    res1 = densesys.integrate(tout, c0, params, integrator='scipy', name='vode', method='bdf')
+    res2 = sparsesys.integrate(tout, c0, params, integrator='scipy', name='vode', method='bdf')
+    assert res2.info['njev'] > 0
+    assert np.allclose(res1.yout, res2.yout)
+
+
+@requires('numpy', 'pyodesys', 'scipy')
+@pytest.mark.parametrize('method', ['BDF', 'Radau', 'LSODA'])
+@pytest.mark.parametrize('sparse', [False, True])
+def test_NumericSys__solve_ivp(method, sparse):
+    rsys = _get_rsys(defaults=True)
+    kw = dict(substitutions={'temperature': 298.15})
+    refsys, _ = get_odesys(rsys, **kw)
+    numsys, _ = get_odesys(rsys, engine='numeric', sparse=sparse, **kw)
+    c0, params = {'A': 1.0, 'B': 0.5, 'C': 0.1}, {'density': 998, 'doserate': 0.2}
+    tout = np.linspace(0, 3, 17)
+    ref = refsys.integrate(tout, c0, params, integrator='scipy', atol=1e-10, rtol=1e-10)
+    for with_jacobian in (True, False):
+        res = numsys.integrate(tout, c0, params, integrator='solve_ivp', method=method,
+                               with_jacobian=with_jacobian, atol=1e-10, rtol=1e-10)
+        assert res.info['success'] and res.info['mode'] == 'predefined'
+        assert res.info['nfev'] > 0
+        assert np.allclose(res.xout, tout)
+        assert np.allclose(res.yout, ref.yout, rtol=1e-6, atol=1e-8)
+
+    res = numsys.integrate([0, 3], c0, params, integrator='solve_ivp', method=method)
+    assert res.info['mode'] == 'adaptive' and res.info['n_steps'] == len(res.xout) - 1 > 1
+    assert np.allclose(res.yout[-1], ref.yout[-1], rtol=1e-5, atol=1e-7)
+
+
+@requires('numpy', 'pyodesys', 'scipy', units_library)
+def test_NumericSys__solve_ivp__units():
+    rsys = ReactionSystem.from_string("2 H2O2 -> O2 + 2 H2O; 5/M/s")
+    odesys, _ = get_odesys(rsys, unit_registry=SI_base_registry, engine='numeric')
+    c0 = {'H2O2': 2*u.molar, 'O2': 0*u.molar, 'H2O': 55*u.molar}
+    res = odesys.integrate(7*u.s, c0, integrator='solve_ivp', atol=1e-8, rtol=1e-10)
+    ref = 1/(1/2 + 2*5*7)*u.molar
+    assert abs(res.named_dep('H2O2')[-1] - ref) < 1e-6*ref
+    with pytest.raises(ValueError):
+        odesys.integrate(7*u.s, c0, integrator='solve_ivp', method='RK45')
+
+
+@requires('numpy', 'sympy')
+def test_NumericRHS__dfdp():
+    rsys = _get_rsys()
+    rhs = NumericRHS(rsys, cstr_fr_fc=('fr', {'A': 'fc_A'}))
+    c = np.array([5, 7, 11])
+    p = dict(A_C=1e6, Ea_R_C=4000, density=998, doserate=0.2, kB=11, temperature=298.15, fr=.3, fc_A=1)
+    p = np.array([p[k] for k in rhs.param_keys], dtype=np.float64)
+    dfdp = rhs.dfdp(0, c, p)
+    assert dfdp.shape == (3, len(rhs.param_keys))
+    for j in range(len(p)):
+        h = 1e-4*p[j]
+        dp = np.zeros_like(p)
+        dp[j] = h
+        ref = (rhs.f(0, c, p + dp) - rhs.f(0, c, p - dp))/(2*h)
+        assert np.allclose(dfdp[:, j], ref, rtol=1e-6, atol=1e-12)
+    batched = rhs.dfdp(0, np.array([c, 2*c]), p, keys=('kB', 'fr'))
+    assert batched.shape == (2, 3, 2)
+    assert np.allclose(batched[1], rhs.dfdp(0, 2*c, p)[:, [rhs.param_keys.index('kB'), rhs.param_keys.index('fr')]])
+
+
+@requires('numpy')
+@pytest.mark.parametrize('ridx', [[0, 1, 2, 3], [2, 0]])
+def test_ExtentRHS(ridx):
+    rhs = NumericRHS(_get_rsys())
+    ext = ExtentRHS(rhs, ridx)
+    assert ext.ny == 3 + len(ridx)
+    p = np.array([1e10, 4000, 998, 0.2, 11, 298.15])
+    y = np.array([5, 7, 11] + [0.1]*len(ridx))
+    fout = ext.f(0, y, p)
+    assert np.allclose(fout[:3], rhs.f(0, y[:3], p))
+    assert np.allclose(fout[3:], rhs.rates(0, y[:3], p)[ridx])
+    J = ext.jac(0, y, p)
+    for j in range(ext.ny):
+        dy = np.zeros_like(y)
+        dy[j] = 1e-6*max(abs(y[j]), 1)
+        assert np.allclose(J[:, j], (ext.f(0, y + dy, p) - ext.f(0, y - dy, p))/(2*dy[j]), rtol=1e-6, atol=1e-8)
+    assert np.all(J[:, 3:] == 0)
+    assert ext.nnz == rhs.nnz + sum(len(rhs.rxns[ri].reac) for ri in ridx if ri != 3)
+    assert np.allclose(ext.jac_csr(0, y, p).toarray(), J)
+    assert ext.jac(0, np.array([y, 2*y]), p).shape == (2, ext.ny, ext.ny)
+    with pytest.raises(ValueError):
+        ExtentRHS(rhs, [4])
+
+
+@requires('numpy')
+def test_ExtentRHS__SpecialFraction():
+    rhs = _get_SpecialFraction_rsys(11, 13).compile_rhs()
+    ext = ExtentRHS(rhs, [0])
+    y = np.array([2.0, 3.0, 5.0, 0.0])
+    J = ext.jac(0, y)
+    for j in range(3):
+        dy = np.zeros_like(y)
+        dy[j] = 1e-6*y[j]
+        assert np.allclose(J[3, j], (ext.f(0, y + dy)[3] - ext.f(0, y - dy)[3])/(2*dy[j]), rtol=1e-5)
+
+
+def _get_acid_base_rsys():
+    return ReactionSystem([
+        Reaction({'HA': 1}, {'H+': 1, 'A-': 1}, 1e4), Reaction({'H+': 1, 'A-': 1}, {'HA': 1}, 1e10),
+        Reaction({'A-': 1, 'B': 1}, {'C': 1}, 1.0), Reaction({'C': 1}, {'B': 1, 'D': 1}, 0.3)], 'HA H+ A- B C D')
+
+
+@requires('numpy', 'scipy')
+def test_EquilibriumRHS():
+    from scipy.integrate import solve_ivp
+    rsys = _get_acid_base_rsys()
+    kernel = NumericRHS(rsys)
+    rhs = EquilibriumRHS(kernel, rsys.identify_equilibria())
+    y0 = np.array([1e-2, 1e-3, 0, 1e-2, 0, 0])
+    y_eq = rhs.equilibrate(0, y0)
+    assert abs(rhs.net_rates(0, y_eq)[0]) < 1e-10*kernel.rates(0, y_eq)[0]
+    assert np.allclose(y_eq[[0, 2]].sum(), 1e-2) and np.allclose(y_eq[1] - y_eq[2], 1e-3)
+    assert np.all(np.abs(np.linalg.eigvals(rhs.jac(0, y_eq))) < 1)  # fast mode removed
+    assert np.allclose(rhs.jac_csr(0, y_eq).toarray(), rhs.jac(0, y_eq))
+    assert rhs.f(0, np.array([y_eq, y_eq]), ()).shape == (2, 6)
+
+    kw = dict(method='BDF', atol=1e-14, rtol=1e-8)
+    full = solve_ivp(lambda t, y: kernel.f(t, y), (0, 100), y0, jac=lambda t, y: kernel.jac(t, y), **kw)
+    red = solve_ivp(lambda t, y: rhs.f(t, y), (0, 100), y_eq, jac=lambda t, y: rhs.jac(t, y), **kw)
+    assert red.nfev < full.nfev
+    assert np.allclose(red.y[:, -1], full.y[:, -1], rtol=1e-5, atol=1e-12)
+
+    with pytest.raises(ValueError):
+        EquilibriumRHS(kernel, [(0, 1), (1, 0)])
+    with pytest.raises(ValueError):
+        EquilibriumRHS(NumericRHS(_get_rsys()), [(2, 3)])  # Radiolytic
+
+
+@requires('numpy', 'pyodesys', 'scipy')
+def test_get_odesys__numeric__equilibria():
+    rsys = _get_acid_base_rsys()
+    c0 = {'HA': 1e-2, 'H+': 1e-3, 'A-': 0, 'B': 1e-2, 'C': 0, 'D': 0}
+    tout = np.linspace(0, 100, 11)
+    kw = dict(integrator='solve_ivp', atol=1e-14, rtol=1e-8)
+    full, _ = get_odesys(rsys, engine='numeric')
+    odesys, extra = get_odesys(rsys, engine='numeric', equilibria=True)
+    assert extra['equilibria'] == ((0, 1),)
+    ref = full.integrate(tout, c0, **kw)
+    res = odesys.integrate(tout, c0, **kw)
+    assert res.info['nfev'] < ref.info['nfev']
+    assert np.allclose(res.yout[1:], ref.yout[1:], rtol=1e-5, atol=1e-12)
+    with pytest.raises(ValueError):
+        get_odesys(rsys, engine='numeric', equilibria=[(2, 3)])
+    with pytest.raises(NotImplementedError):
+        get_odesys(rsys, equilibria=True)
+
+
+@requires('numpy', 'pyodesys', 'scipy', 'sympy')
+def test_get_odesys__numeric__sensitivities__solve_ivp():
+    rsys = _get_rsys(defaults=True)
+    kw = dict(include_params=False, substitutions={'temperature': 298.15}, sensitivities=['kB', 'A_C'])
+    params = {'A_C': 1e3, 'Ea_R_C': 2000, 'density': 998, 'doserate': 0.2, 'kB': 0.7}
+    c0 = {'A': 1.0, 'B': 0.5, 'C': 0.1}
+    tout = np.linspace(0, 3, 7)
+    symsys, symextra = get_odesys(rsys, **kw)
+    ref = symsys.integrate(tout, c0, params, integrator='scipy', atol=1e-12, rtol=1e-10)
+    for sparse in (False, True):
+        numsys, extra = get_odesys(rsys, engine='numeric', sparse=sparse, **kw)
+        assert numsys.ny == 9 and numsys.kernel.nnz == 3*numsys.kernel.kernel.nnz
+        res = numsys.integrate(tout, c0, params, integrator='solve_ivp', atol=1e-12, rtol=1e-10)
+        assert np.allclose(extra['sensitivities'](res.yout), symextra['sensitivities'](ref.yout),
+                           rtol=1e-6, atol=1e-9)
+
+
+@requires('numpy', 'sympy')
+def test_NumericRHS__pickle():
+    import pickle
+    rhs = NumericRHS(_get_rsys())
+    p = [1e3, 2000, 998, 0.2, 0.7, 298.15]
+    ref = rhs.dfdp(0, [5, 7, 11], p)  # populates a cache of lambdified (unpicklable) callbacks
+    rhs2 = pickle.loads(pickle.dumps(rhs))
+    assert np.allclose(rhs2.f(0, [5, 7, 11], p), rhs.f(0, [5, 7, 11], p))
+    assert np.allclose(rhs2.dfdp(0, [5, 7, 11], p), ref)
+
+
+@requires('numpy', 'pyodesys', 'scipy', 'sympy')
+def test_get_odesys__numeric__pickle():
+    import pickle
+    rsys = _get_rsys(defaults=True)
+    odesys, extra = get_odesys(rsys, engine='numeric', include_params=False, sensitivities=['kB'],
+                               substitutions={'temperature': 298.15})
+    params = {'A_C': 1e3, 'Ea_R_C': 2000, 'density': 998, 'doserate': 0.2, 'kB': 0.7}
+    c0 = {'A': 1.0, 'B': 0.5, 'C': 0.1}
+    tout = np.linspace(0, 3, 7)
+    odesys2, extra2 = pickle.loads(pickle.dumps((odesys, {k: extra[k] for k in (
+        'rate_exprs_cb', 'sensitivities', 'max_euler_step_cb')})))
+    kw = dict(integrator='solve_ivp', atol=1e-12, rtol=1e-10)
+    ref, res = odesys.integrate(tout, c0, params, **kw), odesys2.integrate(tout, c0, params, **kw)
+    assert np.allclose(res.yout, ref.yout)
+    assert np.allclose(extra2['sensitivities'](res.yout), extra['sensitivities'](ref.yout))
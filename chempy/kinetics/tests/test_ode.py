@@ -18,15 +18,15 @@ from chempy.units import (
     SI_base_registry, get_derived_unit, allclose, units_library, linspace,
     to_unitless, default_constants as const, default_units as u
 )
-from chempy.util._expr import Expr
+from chempy.util._expr import Expr, create_Poly
 from chempy.util.testing import requires
 from .test_rates import _get_SpecialFraction_rsys
 from ..arrhenius import ArrheniusParam
-from ..rates import Arrhenius, MassAction, Radiolytic, RampedTemp
+from ..rates import Arrhenius, MassAction, Radiolytic, RampedTemp, StepSchedule, LinearSchedule
 from .._rates import ShiftedTPoly
 from ..ode import (
-    get_odesys, chained_parameter_variation,
-    _mk_dedim, _create_odesys as create_odesys
+    get_odesys, chained_parameter_variation, integrate_ensemble, integrate_chunks, integrate_to_store,
+    _mk_dedim, _create_odesys as create_odesys, _SubstitutionPlan
 )
 from ..integrated import dimerization_irrev, binary_rev
 
@@ -1029,3 +1029,286 @@ def test_create_odesys__ShiftedTPoly():
     assert np.all(abs((fout - ref)/ref) < 1e-14)
 
     odesys.integrate(t, c, _p)
+
+
+@requires('numpy', 'pyodesys', 'scipy')
+@pytest.mark.parametrize('workers', [None, 2])
+def test_integrate_ensemble(workers):
+    rsys = ReactionSystem.from_string("2 H2O2 -> O2 + 2 H2O; 'k'")
+    odesys, extra = get_odesys(rsys, include_params=False)
+    c0_table = {'H2O2': np.linspace(1, 2, 7), 'O2': 0, 'H2O': np.zeros(7)}
+    param_table = np.linspace(3, 5, 7).reshape((7, 1))
+    tout = np.linspace(0, 1, 5)
+    kw = dict(integrator='scipy', atol=1e-10, rtol=1e-10)
+    for system in (rsys, odesys):
+        res = integrate_ensemble(system, c0_table, param_table, tout, workers=workers, chunksize=3,
+                                 odesys_kwargs=dict(include_params=False), **kw)
+        assert res.yout.shape == (7, 5, 3)
+        assert np.all(res.success) and np.all(res.nfev > 0)
+        for i in range(7):
+            ref = odesys.integrate(tout, {k: v[i] if np.ndim(v) else v for k, v in c0_table.items()},
+                                   param_table[i], **kw)
+            assert np.allclose(res.yout[i], ref.yout)
+        assert np.allclose(res.named_dep('H2O2')[:, 0], c0_table['H2O2'])
+
+    with pytest.raises(ValueError):
+        integrate_ensemble(odesys, c0_table, param_table[:-1], tout, **kw)
+    with pytest.raises(ValueError, match="'H2O'"):
+        integrate_ensemble(odesys, dict(c0_table, H2O=np.zeros(6)), param_table, tout, **kw)
+    with pytest.raises(ValueError, match="'k'"):
+        integrate_ensemble(odesys, c0_table, {'k': [3, 4]}, tout, **kw)
+
+
+@requires('numpy', 'pyodesys', 'scipy', 'sympy')
+@pytest.mark.parametrize('engine', ['symbolic', 'numeric'])
+def test_get_odesys__cache(engine):
+    import shutil
+    import tempfile
+    from chempy.util.diskcache import DiskCache
+    rsys = ReactionSystem.from_string("2 H2O2 -> O2 + 2 H2O; 5\nO2 -> 2 O; 'k'")
+    tempdir = tempfile.mkdtemp()
+    try:
+        cache = DiskCache(tempdir)
+        odesys1, extra1 = get_odesys(rsys, include_params=False, engine=engine, cache=cache)
+        assert len(cache.entries()) == 1
+        odesys2, extra2 = get_odesys(rsys, include_params=False, engine=engine, cache=tempdir)
+        assert len(cache.entries()) == 1
+        assert extra1['param_keys'] == extra2['param_keys'] and odesys1.param_names == odesys2.param_names
+        c0, params = {'H2O2': 1, 'O2': 0, 'H2O': 0, 'O': 0}, {'k': 2}
+        tout = np.linspace(0, 1, 5)
+        res1 = odesys1.integrate(tout, c0, params, integrator='scipy')
+        res2 = odesys2.integrate(tout, c0, params, integrator='scipy')
+        assert np.allclose(res1.yout, res2.yout)
+        assert np.allclose(extra1['rate_exprs_cb'](res1.xout, res1.yout, res1.params),
+                           extra2['rate_exprs_cb'](res2.xout, res2.yout, res2.params))
+
+        rsys.rxns[1].param = 3.0
+        get_odesys(rsys, include_params=False, engine=engine, cache=cache)
+        assert len(cache.entries()) == 2
+        get_odesys(rsys, include_params=False, engine=engine, cache=cache,
+                   roots_cb=lambda x, y, p, be: [y['O2'] - 0.1])
+        assert len(cache.entries()) == 2  # not cacheable
+    finally:
+        shutil.rmtree(tempdir)
+
+
+@requires('numpy', 'pyodesys', 'scipy', 'sympy')
+@pytest.mark.parametrize('engine', ['symbolic', 'numeric'])
+def test_get_odesys__cache__structural_key(engine):
+    import shutil
+    import tempfile
+    from chempy.util.diskcache import DiskCache
+    RTPoly, TPoly = create_Poly('temperature', reciprocal=True), create_Poly('temperature')
+    rsys1 = ReactionSystem([Reaction({'A': 1}, {'B': 1}, MassAction(RTPoly([1, 2])))], 'A B')
+    rsys2 = ReactionSystem([Reaction({'A': 1}, {'B': 1}, MassAction(TPoly([1, 2])))], 'A B')
+    assert repr(rsys1.rxns[0].param) == repr(rsys2.rxns[0].param)
+    tempdir = tempfile.mkdtemp()
+    try:
+        cache = DiskCache(tempdir)
+        odesys1, extra1 = get_odesys(rsys1, engine=engine, cache=cache)
+        odesys2, extra2 = get_odesys(rsys2, engine=engine, cache=cache)
+        assert len(cache.entries()) == 2
+        variables = {'A': 1.0, 'B': 0.0, 'temperature': 4.0}
+        r1 = extra1['rate_exprs_cb'](0, [1.0, 0.0], [4.0])
+        r2 = extra2['rate_exprs_cb'](0, [1.0, 0.0], [4.0])
+        assert np.allclose(r1, [1 + 2/4.0]) and np.allclose(r2, [1 + 2*4.0])
+        assert np.allclose(r1, rsys1.rates(variables)['B']) and np.allclose(r2, rsys2.rates(variables)['B'])
+
+        Lin = Expr.from_callback(lambda args, T, backend=None, **kw: args[0]*T,
+                                 parameter_keys=('temperature',), nargs=1)
+        rsys3 = ReactionSystem([Reaction({'A': 1}, {'B': 1}, MassAction(Lin([3])))], 'A B')
+        get_odesys(rsys3, engine=engine, cache=cache)
+        assert len(cache.entries()) == 2  # lambdas cannot be described
+
+        class FailingCache(object):
+            def get(self, key):
+                return None
+
+            def put(self, key, obj):
+                raise IOError("Read-only")
+
+        with pytest.warns(UserWarning):
+            odesys3, _ = get_odesys(rsys1, engine=engine, cache=FailingCache())
+        assert odesys3.ny == 2
+    finally:
+        shutil.rmtree(tempdir)
+
+
+@requires('numpy', 'pyodesys', 'scipy', 'sympy')
+@pytest.mark.parametrize('engine', ['symbolic', 'numeric'])
+def test_get_odesys__sensitivities(engine):
+    r1 = Reaction({'A': 1}, {'B': 1}, MassAction(unique_keys=('k1',)))
+    r2 = Reaction({'B': 1}, {'C': 1}, MassAction(Arrhenius(unique_keys=('A2', 'Ea_R2'))))
+    rsys = ReactionSystem([r1, r2], 'A B C')
+    odesys, extra = get_odesys(rsys, include_params=False, substitutions={'temperature': 300.0},
+                               engine=engine, sensitivities=['k1', 'A2'])
+    assert extra['sensitivity_keys'] == ('k1', 'A2')
+    assert odesys.ny == 9 and odesys.names[3] == 'd(A)/d(k1)'
+    c0 = {'A': 1.0, 'B': 0.0, 'C': 0.0}
+    params = {'k1': 2.0, 'A2': 3e5, 'Ea_R2': 3000.0}
+    tout = np.linspace(0, 1, 11)
+    res = odesys.integrate(tout, c0, params, integrator='scipy', atol=1e-12, rtol=1e-10)
+    S = extra['sensitivities'](res.yout)
+    assert S.shape == (11, 3, 2)
+    k1, k2 = 2.0, 3e5*math.exp(-3000/300.0)
+    ref_A = np.exp(-k1*tout)
+    assert np.allclose(res.named_dep('A'), ref_A)
+    assert np.allclose(S[:, 0, 0], -tout*ref_A, atol=1e-9)  # dA/dk1
+    assert np.allclose(S[:, 0, 1], 0)
+    B = k1/(k2 - k1)*(ref_A - np.exp(-k2*tout))
+    dB_dk2 = -B/(k2 - k1) + k1/(k2 - k1)*tout*np.exp(-k2*tout)
+    assert np.allclose(S[:, 1, 1], dB_dk2*k2/3e5, atol=1e-9)  # dB/dA2 = dB/dk2 * dk2/dA2
+    assert np.allclose(S.sum(axis=1), 0, atol=1e-9)  # mass conservation
+    rates = extra['rate_exprs_cb'](res.xout, res.yout, res.params)
+    assert np.allclose(np.asarray(rates)[:, 0], k1*ref_A)
+
+    with pytest.raises(ValueError):
+        get_odesys(rsys, include_params=False, engine=engine, sensitivities=['temperature'],
+                   substitutions={'temperature': 300.0})
+
+
+@requires('numpy', 'pyodesys', 'scipy', 'sympy')
+@pytest.mark.parametrize('engine', ['symbolic', 'numeric'])
+def test_get_odesys__extents(engine):
+    rsys = ReactionSystem([Reaction({'A': 1}, {'B': 1}, 2.0), Reaction({'B': 1}, {'A': 1}, 0.5),
+                           Reaction({'B': 1}, {'C': 1}, 0.1)], 'A B C')
+    odesys, extra = get_odesys(rsys, engine=engine, extents=[0, 2])
+    assert extra['extent_indices'] == (0, 2)
+    assert odesys.ny == 5 and list(odesys.names[3:]) == ['extent(0)', 'extent(2)']
+    c0 = {'A': 1.0, 'B': 0.0, 'C': 0.0}
+    tout = np.linspace(0, 2, 401)  # fine enough for the trapezoidal reference below
+    res = odesys.integrate(tout, c0, integrator='scipy', atol=1e-12, rtol=1e-10)
+    xi = extra['extents'](res.yout)
+    assert xi.shape == (401, 2) and np.all(xi[0] == 0)
+    assert np.allclose(xi[:, 1], res.named_dep('C'), atol=1e-9)
+    rates = np.asarray(extra['rate_exprs_cb'](res.xout, res.yout, res.params))
+    assert rates.shape == (401, 3)
+    ref = np.concatenate(([0], np.cumsum(np.diff(tout)*(rates[1:, 0] + rates[:-1, 0])/2)))
+    assert np.allclose(xi[:, 0], ref, rtol=1e-3, atol=1e-4)
+
+    _, extra_all = get_odesys(rsys, engine=engine, extents=True)
+    assert extra_all['extent_indices'] == (0, 1, 2)
+    with pytest.raises(ValueError):
+        get_odesys(rsys, engine=engine, extents=[3])
+    with pytest.raises(NotImplementedError):
+        get_odesys(rsys, engine=engine, extents=True, sensitivities=True)
+
+
+@requires('numpy', 'pyodesys', units_library)
+def test_get_odesys__sensitivities__units():
+    rsys = ReactionSystem([Reaction({'A': 1}, {'B': 1}, 2/u.s)], 'A B')
+    with pytest.raises(NotImplementedError):
+        get_odesys(rsys, unit_registry=SI_base_registry, sensitivities=True)
+
+
+@requires('numpy', 'pyodesys', 'scipy', 'sympy')
+@pytest.mark.parametrize('engine,integrator', [('symbolic', 'scipy'), ('numeric', 'scipy'), ('numeric', 'solve_ivp')])
+def test_integrate_chunks(engine, integrator):
+    rsys = ReactionSystem.from_string("2 H2O2 -> O2 + 2 H2O; 5\nO2 -> 2 O; 'k'")
+    odesys, extra = get_odesys(rsys, include_params=False, engine=engine)
+    c0, params = {'H2O2': 1, 'O2': 0, 'H2O': 0, 'O': 0}, {'k': 3}
+    tout = np.linspace(0, 2, 23)
+    kw = dict(integrator=integrator, atol=1e-12, rtol=1e-10)
+    ref = odesys.integrate(tout, c0, params, **kw)
+    chunks = list(integrate_chunks(odesys, tout, c0, params, chunk_size=5, **kw))
+    assert [len(x) for x, _, _ in chunks] == [6, 5, 5, 5, 2]
+    assert np.all(np.concatenate([x for x, _, _ in chunks]) == tout)
+    assert np.allclose(np.concatenate([y for _, y, _ in chunks]), ref.yout, rtol=1e-7, atol=1e-10)
+    assert all(info['success'] for _, _, info in chunks)
+    with pytest.raises(ValueError):
+        next(integrate_chunks(odesys, tout, c0, chunk_size=0))
+
+
+@requires('numpy', 'pyodesys', units_library)
+def test_integrate_to_store():
+    import shutil
+    import tempfile
+    from ..analysis import plot_reaction_contributions
+    rsys = ReactionSystem.from_string("2 H2O2 -> O2 + 2 H2O; 5/M/s")
+    odesys, extra = get_odesys(rsys, unit_registry=SI_base_registry)
+    c0 = {'H2O2': 1*u.molar, 'O2': 0*u.molar, 'H2O': 0*u.molar}
+    tout = np.linspace(0, 2, 23)*u.s
+    tempdir = tempfile.mkdtemp()
+    try:
+        store, info = integrate_to_store(odesys, tempdir, tout, c0, chunk_size=4, names=rsys.substances,
+                                         integrator='scipy', atol=1e-12, rtol=1e-10)
+        assert info['nchunks'] == 6 and info['nfev'] > 0
+        assert store.names == list(rsys.substances)
+        assert store.header['time_unit'] == 's' and store.header['conc_unit'] == 'mol/m**3'
+        ref = 1/(1 + 2*5*tout.magnitude)
+        assert np.allclose(store.named_dep('H2O2')/1e3, ref)
+        xyp = store.as_arrays(unit_registry=SI_base_registry)
+        rates = extra['rate_exprs_cb'](*xyp)
+        assert np.allclose(np.asarray(rates)[:, 0], 5e-3*(1e3*ref)**2)
+
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        _, axes = plt.subplots(1, 1, squeeze=False)
+        plot_reaction_contributions(store, rsys, extra['rate_exprs_cb'], ['H2O2'], axes=axes[0], yscale='linear',
+                                    xscale='linear', selection=slice(None, None, 2), unit_registry=SI_base_registry)
+        line = axes[0][0].get_lines()[0]
+        assert np.allclose(line.get_xdata(), tout.magnitude[::2])
+        assert np.allclose(line.get_ydata(), -2*5*ref[::2]**2)
+        plt.close('all')
+    finally:
+        shutil.rmtree(tempdir)
+
+
+@requires('numpy', 'pyodesys', 'scipy', 'sympy')
+@pytest.mark.parametrize('engine', ['symbolic', 'numeric'])
+def test_get_odesys__TimeSchedule(engine):
+    rsys = ReactionSystem([Reaction({'A': 1}, {'B': 1}, MassAction(unique_keys=('k',)))], 'A B')
+    pulses = StepSchedule.from_table([0, 1, 2, 3], [2.0, 0, 2.0, 0])
+    odesys, extra = get_odesys(rsys, substitutions={'k': pulses}, engine=engine)
+    assert extra['breakpoints'] == (1, 2, 3)
+    assert odesys.nroots == 1
+    tout = np.linspace(0, 4, 9)
+    if engine == 'numeric':  # restarts at the breakpoints
+        integrate_kw = dict(integrator='solve_ivp', atol=1e-12, rtol=1e-10)
+    else:  # scipy.integrate.ode lacks root finding, and would otherwise step over the second pulse
+        integrate_kw = dict(integrator='scipy', atol=1e-12, rtol=1e-10, max_step=0.1)
+    res = odesys.integrate(tout, {'A': 1, 'B': 0}, **integrate_kw)
+    ref = np.exp(-2*np.array([0, .5, 1, 1, 1, 1.5, 2, 2, 2]))
+    assert np.allclose(res.named_dep('A'), ref, rtol=1e-7)
+    if engine == 'numeric':
+        assert res.info['n_restarts'] == 3
+        res_ad = odesys.integrate([0, 4], {'A': 1, 'B': 0}, **integrate_kw)  # adaptive
+        assert abs(res_ad.named_dep('A')[-1] - np.exp(-4)) < 1e-8
+        assert np.all(np.diff(res_ad.xout) > 0)
+
+    ramp = LinearSchedule.from_table([0, 2], [0, 2.0])
+    odesys2, extra2 = get_odesys(rsys, substitutions={'k': ramp}, engine=engine, schedule_roots=False)
+    assert extra2['breakpoints'] == (0, 2) and odesys2.nroots == 0
+    res2 = odesys2.integrate(np.linspace(0, 3, 7), {'A': 1, 'B': 0}, **integrate_kw)
+    t = res2.xout
+    assert np.allclose(res2.named_dep('A'), np.where(t < 2, np.exp(-t**2/2), np.exp(-2 - 2*(t - 2))), rtol=1e-7)
+
+
+@requires('numpy', 'pyodesys', units_library)
+def test_get_odesys__TimeSchedule__units():
+    rsys = ReactionSystem([Reaction({'A': 1}, {'B': 1}, MassAction(unique_keys=('k',)))], 'A B')
+    pulses = StepSchedule.from_table([0, 1, 2]*u.minute, [2/u.minute, 0/u.minute, 2/u.minute])
+    odesys, extra = get_odesys(rsys, substitutions={'k': pulses}, unit_registry=SI_base_registry)
+    assert extra['breakpoints'] == (60, 120)
+    res = odesys.integrate(np.linspace(0, 3, 7)*u.minute, {'A': 1*u.molar, 'B': 0*u.molar},
+                           integrator='scipy', atol=1e-12, rtol=1e-10)
+    assert allclose(res.yout[-1, 0], np.exp(-4)*u.molar, rtol=1e-7)
+
+
+def test_SubstitutionPlan():
+    plan = _SubstitutionPlan(OrderedDict([('temperature', RampedTemp([300, 2], ('T0', 'dTdt')))]),
+                             {'density': 998.0})
+    variables = plan.variables(5.0, {'A': 1.0}, {'T0': 310, 'dTdt': 3})
+    assert variables == {'A': 1.0, 'T0': 310, 'dTdt': 3, 'time': 5.0, 'temperature': 325, 'density': 998.0}
+    assert list(plan.as_dict()) == ['density', 'temperature']
+    with pytest.raises(ValueError):
+        plan.variables(0, {'time': 1.0}, {})
+
+
+@requires(units_library)
+def test_SubstitutionPlan__units():
+    plan = _SubstitutionPlan(OrderedDict([('temperature', RampedTemp([300*u.K, 2*u.K/u.minute]))]), {},
+                             SI_base_registry)
+    assert np.allclose([float(arg) for arg in plan.active[0][1].args], [300, 2/60])  # dedimensionalised once
+    assert abs(plan.variables(60.0, {}, {})['temperature'] - 302) < 1e-12
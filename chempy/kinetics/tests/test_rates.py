@@ -297,6 +297,7 @@ def test_mk_Radiolytic():
     R1 = mk_Radiolytic()
     R2 = mk_Radiolytic()
     assert R1 is R2
+    assert R1 is Radiolytic
 
     RABG = mk_Radiolytic('alpha', 'beta', 'gamma')
     rxn = Reaction({}, {'H': 2}, RABG([3, 5, 7], 'ya yb yg'.split()))
@@ -358,3 +359,14 @@ def test_EyringMassAction():
     ref_rates = {'A': 2*(rb3 - rf3), 'B': 2*(rb3 - rf3), 'C': rf3 - rb3}
     for k, v in ref_rates.items():
         assert abs((rates[k] - v)/v) < 1e-14
+
+
+def test_Radiolytic__pickle():
+    import pickle
+    RAB = mk_Radiolytic('alpha', 'beta')
+    rxn = Reaction({}, {'H': 2}, RAB([3, 5]))
+    rxn2 = pickle.loads(pickle.dumps(rxn))
+    assert type(rxn2.param) is RAB
+    variables = {'doserate_alpha': 11, 'doserate_beta': 13, 'density': .7}
+    assert rxn2.rate(variables) == rxn.rate(variables)
+    assert type(pickle.loads(pickle.dumps(Radiolytic([1e-7])))) is Radiolytic
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+
+import pytest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from chempy import Reaction, ReactionSystem
+from chempy.util.testing import requires
+from ..ode import get_odesys
+from ..rates import Radiolytic
+from ..reduction import (drg_interaction_coefficients, propose_qssa, qssa_system, reduce_qssa,
+                         species_timescales)
+
+
+def _get_rsys():
+    # radiolytic production of a radical which is scavenged & recombines
+    return ReactionSystem([
+        Reaction({}, {'R': 1}, Radiolytic([1e-6])),
+        Reaction({'R': 1, 'S': 1}, {'P': 1}, 1e5),
+        Reaction({'R': 2}, {'R2': 1}, 1e8),
+        Reaction({'P': 1}, {'S': 1}, 0.1),
+    ], 'R S P R2')
+
+
+@requires('numpy', 'pyodesys', 'sympy', 'scipy')
+def test_propose_qssa():
+    rsys = _get_rsys()
+    odesys, _ = get_odesys(rsys)
+    c0 = {'R': 0, 'S': 1e-3, 'P': 0, 'R2': 0}
+    params = {'doserate': 1, 'density': 998}
+    res = odesys.integrate(np.linspace(0, 20, 41), c0, params, integrator='scipy', atol=1e-14, rtol=1e-10)
+    taus = species_timescales(odesys, res.xout, res.yout, [1, 998])
+    assert taus.shape == (41, 4)
+    assert np.all(taus[1:, 0] < 1e-2) and np.all(np.isinf(taus[:, 3]))
+    qss_keys, timescales = propose_qssa(odesys, res.xout, res.yout, [1, 998])
+    assert qss_keys == ['R']
+    assert list(timescales)[0] == 'R'
+    assert propose_qssa(odesys, res.xout, res.yout, [1, 998], exclude=('R',))[0] == []
+
+
+@requires('numpy', 'pyodesys', 'sympy', 'scipy')
+def test_reduce_qssa():
+    rsys = _get_rsys()
+    odesys, _ = get_odesys(rsys)
+    c0 = {'R': 0, 'S': 1e-3, 'P': 0, 'R2': 0}
+    params = {'doserate': 1, 'density': 998}
+    tout = np.linspace(0, 20, 41)
+    reduced, report = reduce_qssa(odesys, tout, c0, params, integrator='scipy', atol=1e-14, rtol=1e-10)
+    assert report['qss_keys'] == ['R']
+    assert reduced.free_names == ['S', 'P', 'R2']
+    assert report['stiffness_reduction'] > 10
+    assert report['max_rel_err'] < 1e-2
+    assert report['reduced'].yout.shape == report['full'].yout.shape
+    full = report['full']
+    assert report['timescales'] == propose_qssa(odesys, full.xout, full.yout, full.params)[1]
+    Rexpr = reduced.analytic_exprs[odesys['R']]
+    assert Rexpr.has(odesys['S'])  # quadratic equation (recombination): positive root selected
+    yR = report['reduced'].yout[1:, 0]
+    assert np.all(yR > 0)
+    assert np.allclose(yR, report['full'].yout[1:, 0], rtol=1e-2)
+
+
+@requires('numpy', 'pyodesys', 'sympy')
+def test_qssa_system__errors():
+    rsys = _get_rsys()
+    odesys, _ = get_odesys(rsys)
+    with pytest.raises(ValueError):
+        qssa_system(odesys, ['foo'])
+    numsys, _ = get_odesys(rsys, engine='numeric')
+    with pytest.raises(ValueError):
+        qssa_system(numsys, ['R'])
+
+
+@requires('numpy')
+def test_drg_interaction_coefficients():
+    rsys = ReactionSystem([Reaction({'A': 1}, {'B': 1}, 1.0), Reaction({'B': 1}, {'C': 1}, 1.0),
+                           Reaction({'A': 1}, {'D': 1}, 1.0)], 'A B C D')
+    coeffs = drg_interaction_coefficients(rsys, [[3.0, 2.0, 1.0], [1.0, 2.0, 3.0]])
+    assert coeffs.shape == (4, 4)
+    assert np.allclose(coeffs[0], [1, 0.75, 0, 0.75])  # max of 3/4 & 1/4 (B), 1/4 & 3/4 (D)
+    assert np.allclose(coeffs[2], [0, 1, 1, 0])
+    with pytest.raises(ValueError):
+        drg_interaction_coefficients(rsys, [[1.0, 2.0]])
+
+
+@requires('numpy', 'pyodesys', 'scipy')
+def test_reduce_drg():
+    rsys = ReactionSystem([
+        Reaction({'A': 1}, {'B': 1}, 1.0),
+        Reaction({'B': 1}, {'C': 1}, 2.0),
+        Reaction({'A': 1, 'E': 1}, {'F': 1}, 1e-4),  # slow side channel
+        Reaction({'F': 1}, {'G': 1}, 5.0),
+        Reaction({'C': 1, 'H': 1}, {'B': 1, 'H': 1}, 0.3),  # catalysed (H inactive)
+    ], 'A B C E F G H')
+    odesys, extra = get_odesys(rsys)
+    c0 = dict(A=1, B=0, C=0, E=1, F=0, G=0, H=0.1)
+    res = odesys.integrate(np.linspace(0, 5, 21), c0, integrator='scipy')
+    rates = extra['rate_exprs_cb'](res.xout, res.yout, res.params)
+    reduced, report = rsys.reduce_drg(['C'], rates, eps=1e-2)
+    assert report['species'] == ['A', 'B', 'C', 'H']
+    assert report['dropped_species'] == ['E', 'F', 'G']
+    assert [ri for ri, _ in report['dropped_reactions']] == [2, 3]
+    assert reduced.nr == 3 and list(reduced.substances) == ['A', 'B', 'C', 'H']
+
+    odesys2, _ = get_odesys(reduced)
+    res2 = odesys2.integrate(res.xout, {k: c0[k] for k in reduced.substances}, integrator='scipy')
+    assert np.allclose(res2.named_dep('C'), res.named_dep('C'), rtol=1e-3, atol=1e-6)
+
+    everything = rsys.reduce_drg(['C'], rates, eps=1e-9)[0]
+    assert everything.nr == rsys.nr
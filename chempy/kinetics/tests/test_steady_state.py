@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+
+import pytest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from chempy import Reaction, ReactionSystem, Substance
+from chempy.util.testing import requires
+from ..rates import MassAction
+from ..steady_state import conservation_matrix, steady_state
+
+
+def _get_rsys():
+    # dimerisation & a catalysed (Michaelis-Menten type) conversion
+    r1 = Reaction({'A': 2}, {'A2': 1}, MassAction(unique_keys=('kf',)))
+    r2 = Reaction({'A2': 1}, {'A': 2}, 0.5)
+    r3 = Reaction({'A': 1, 'E': 1}, {'AE': 1}, 40.0)
+    r4 = Reaction({'AE': 1}, {'A': 1, 'E': 1}, 2.0)
+    r5 = Reaction({'AE': 1}, {'B': 1, 'E': 1}, 3.0)
+    r6 = Reaction({'B': 1}, {'A': 1}, MassAction(unique_keys=('kb',)))
+    return ReactionSystem([r1, r2, r3, r4, r5, r6], 'A A2 E AE B')
+
+
+@requires('numpy')
+def test_conservation_matrix():
+    rsys = _get_rsys()
+    C = conservation_matrix(rsys)
+    assert C.shape == (2, 5)
+    S = rsys.compile_rhs()._scatter(np.eye(rsys.nr))
+    assert np.allclose(C.dot(S.T), 0)
+    assert np.linalg.matrix_rank(np.vstack((C, S))) == 5
+
+    rsys2 = ReactionSystem.from_string("2 H2O2 -> O2 + 2 H2O; 5")
+    C2 = conservation_matrix(rsys2)
+    assert C2.shape == (2, 3)
+    comp, _ = rsys2.composition_balance_vectors()
+    assert np.allclose(C2, comp)  # composition vectors are used when possible
+
+
+@requires('numpy', 'scipy')
+@pytest.mark.parametrize('method', ['ptc', 'newton'])
+def test_steady_state(method):
+    rsys = _get_rsys()
+    c0 = {'A': 1.0, 'A2': 0.5, 'E': 1e-3, 'AE': 0, 'B': 0.1}
+    params = {'kf': np.array([0.1, 1, 10]), 'kb': 0.7}
+    conc, info = steady_state(rsys, c0, params, method=method)
+    assert conc.shape == (3, 5)
+    assert np.all(info['success'])
+    assert np.all(info['residual'] < 1e-10)
+    rhs = rsys.compile_rhs()
+    C = conservation_matrix(rsys)
+    y0 = rsys.as_per_substance_array(c0)
+    for i, kf in enumerate(params['kf']):
+        p = [0.7, kf]  # param_keys: ('kb', 'kf')
+        assert np.allclose(rhs.f(0, conc[i], p), 0, atol=1e-10)
+        assert np.allclose(C.dot(conc[i]), C.dot(y0), rtol=1e-12, atol=1e-14)
+        assert np.all(conc[i] >= 0)
+        single, nfo = rsys.steady_state(c0, p, method=method)
+        assert nfo['success'] and np.allclose(single, conc[i], rtol=1e-8, atol=1e-12)
+
+
+@requires('numpy', 'scipy', 'pyodesys')
+def test_steady_state__vs_integration():
+    from ..ode import get_odesys
+    rsys = _get_rsys()
+    odesys, _ = get_odesys(rsys, include_params=False, engine='numeric')
+    c0 = {'A': 0.3, 'A2': 0, 'E': 0.2, 'AE': 0, 'B': 0}
+    params = {'kf': 3.0, 'kb': 0.05}
+    res = odesys.integrate(1e4, c0, params, integrator='solve_ivp', atol=1e-12, rtol=1e-10)
+    conc, info = rsys.steady_state(c0, params)
+    assert info['success']
+    assert np.allclose(conc, res.yout[-1], rtol=1e-6, atol=1e-10)
+
+
+@requires('numpy', 'scipy')
+def test_steady_state__depletion():
+    rsys = ReactionSystem.from_string("A + B -> C; 7\nC -> D; 0.5", substance_factory=Substance)
+    conc, info = rsys.steady_state({'A': 1, 'B': 3, 'C': 0, 'D': 0})
+    assert info['success']
+    assert np.allclose(conc, rsys.as_per_substance_array({'A': 0, 'B': 2, 'C': 0, 'D': 1}), atol=1e-9)
+    with pytest.raises(ValueError):
+        rsys.steady_state({'A': 1, 'B': 3, 'C': 0, 'D': 0}, method='foobar')
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+
+import math
+
+import pytest
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from chempy import Reaction, ReactionSystem
+from chempy.units import units_library, default_units as u
+from chempy.util.testing import requires
+from ..rates import MassAction, Arrhenius
+from ..stochastic import (
+    propensity_constants, dependency_graph, IndexedPriorityQueue, StochasticSystem, simulate, AVOGADRO
+)
+
+
+def _birth_death(k0=20.0, k1=0.5):
+    return ReactionSystem([Reaction({}, {'A': 1}, k0), Reaction({'A': 1}, {}, k1)], 'A')
+
+
+def test_IndexedPriorityQueue():
+    values = [5.0, 3.0, 8.0, 1.0, 9.0, 2.0]
+    ipq = IndexedPriorityQueue(values)
+    assert ipq.top() == (3, 1.0)
+    ipq.update(3, 10.0)
+    assert ipq.top() == (5, 2.0)
+    ipq.update(4, 0.5)
+    assert ipq.top() == (4, 0.5)
+    ipq.update(4, float('inf'))
+    for key in range(len(ipq)):
+        assert ipq.values[ipq.heap[ipq.pos[key]]] == ipq.values[key]
+    order = []
+    for _ in range(len(ipq)):
+        key, val = ipq.top()
+        order.append(val)
+        ipq.update(key, float('inf'))
+    assert order == sorted([5.0, 3.0, 8.0, 10.0, float('inf'), 2.0])
+
+
+def test_dependency_graph():
+    rxns = [Reaction({'A': 1, 'B': 1}, {'C': 1}, 1.0), Reaction({'C': 1}, {'A': 1, 'B': 1}, 1.0),
+            Reaction({'B': 1}, {'D': 1}, 1.0), Reaction({'D': 1}, {'D': 2}, 1.0)]
+    rsys = ReactionSystem(rxns, 'A B C D')
+    assert dependency_graph(rsys) == [[0, 1, 2], [0, 1, 2], [0, 2, 3], [3]]
+
+
+@requires('numpy')
+def test_propensity_constants():
+    V = 1e-15
+    rsys = ReactionSystem([Reaction({'A': 1, 'B': 1}, {'C': 1}, 3.0), Reaction({'A': 2}, {'B': 1}, 5.0),
+                           Reaction({'C': 1}, {'A': 1}, 7.0), Reaction({}, {'A': 1}, 11.0)], 'A B C')
+    c = propensity_constants(rsys, V)
+    assert np.allclose(c, [3/(AVOGADRO*V), 2*5/(AVOGADRO*V), 7, 11*AVOGADRO*V])
+
+    with pytest.raises(NotImplementedError):
+        propensity_constants(ReactionSystem([Reaction({'A': 1}, {'B': 1}, Arrhenius([1e10, 40e3]))], 'A B'), V)
+
+
+@requires(units_library)
+def test_propensity_constants__units():
+    rsys = ReactionSystem([Reaction({'A': 1, 'B': 1}, {'C': 1}, 3.0/u.molar/u.s),
+                           Reaction({'C': 1}, {'A': 1}, 7.0/u.minute)], 'A B C')
+    c = propensity_constants(rsys, 1e-15*u.dm3)
+    assert np.allclose(c, [3/(AVOGADRO*1e-15), 7/60.0])
+
+
+@requires('numpy')
+def test_StochasticSystem__propensities():
+    rsys = ReactionSystem([Reaction({'A': 2}, {'B': 1}, 1.0), Reaction({'A': 1, 'B': 1}, {}, 1.0)], 'A B')
+    ssys = StochasticSystem(rsys, 1/AVOGADRO)
+    a = ssys.propensities([[5, 3], [1, 2]])
+    assert np.allclose(a, [[2*5*4/2, 5*3], [0, 2]])
+    assert [ssys.propensity(ri, [5, 3]) for ri in range(2)] == a[0].tolist()
+    assert ssys.counts({'A': 2/AVOGADRO*1e-3, 'B': 0}).tolist() == [0, 0]
+    assert ssys.counts([3, 7]).tolist() == [3, 7]
+
+
+@requires('numpy')
+def test_StochasticSystem__g():
+    # g_i of Cao, Gillespie & Petzold (2006), J. Chem. Phys. 124, 044109
+    rsys = ReactionSystem([
+        Reaction({'A': 2}, {'P': 1}, 1.0), Reaction({'B': 2, 'E': 1}, {'P': 1}, 1.0),
+        Reaction({'C': 3}, {'P': 1}, 1.0), Reaction({'D': 1}, {'P': 1}, 1.0),
+        Reaction({'F': 2}, {'P': 1}, 1.0), Reaction({'F': 1, 'G': 1, 'H': 1}, {'P': 1}, 1.0)
+    ], 'A B C D E F G H P')
+    ssys = StochasticSystem(rsys, 1/AVOGADRO)
+    x = np.array([5, 5, 5, 5, 5, 5, 5, 5, 0])
+    ref = [2 + 1/4, 3 + 3/(2*4), 3 + 1/4 + 2/3, 1, 3, 3, 3, 3, 1]
+    assert np.allclose(ssys._g(x), ref, rtol=1e-15, atol=0)
+    assert np.allclose(ssys._g(np.array([1, 1, 2, 0, 0, 0, 0, 0, 0]))[:3], [2, 3, 3])  # cannot fire
+
+
+@requires('numpy')
+@pytest.mark.parametrize('method', ['next_reaction', 'tau_leaping'])
+def test_simulate__decay(method):
+    rsys = ReactionSystem([Reaction({'A': 1}, {'B': 1}, 1.0)], 'A B')
+    xout = simulate(rsys, {'A': 1000}, [0, 1], n_trajectories=200, method=method, seed=42)
+    assert np.all(xout.sum(axis=-1) == 1000)
+    mean = xout[:, 1, 0].mean()
+    std = math.sqrt(1000*math.exp(-1)*(1 - math.exp(-1)))
+    assert abs(mean - 1000*math.exp(-1)) < 5*std/math.sqrt(200)
+
+
+@requires('numpy')
+@pytest.mark.parametrize('method', ['next_reaction', 'tau_leaping'])
+def test_simulate__birth_death(method):
+    # stationary distribution is Poisson(k0/k1)
+    k0, k1 = 20.0, 0.5
+    tout = np.linspace(0, 60, 61)
+    xout = simulate(_birth_death(k0, k1), [0], tout, volume=1/AVOGADRO, method=method, seed=7)[0, 20:, 0]
+    assert abs(xout.mean() - k0/k1) < 6
+    assert 0.5 < xout.var()/(k0/k1) < 2
+
+
+@requires('numpy')
+def test_StochasticSystem__partition():
+    rsys = ReactionSystem([Reaction({'A': 1}, {'B': 1}, 10.0), Reaction({'B': 1}, {'A': 1}, 10.0),
+                           Reaction({'A': 1}, {'C': 1}, 1e-3)], 'A B C')
+    ssys = StochasticSystem(rsys, 1/AVOGADRO)
+    assert ssys.partition([1000, 1000, 0]).tolist() == [True, True, False]
+    assert ssys.partition([1000, 5, 0]).tolist() == [False, False, False]
+    assert ssys.partition([1000, 1000, 0], threshold=1e5).tolist() == [False, False, False]
+
+
+@requires('numpy')
+def test_simulate__hybrid__all_slow():
+    # no reaction is fast: the hybrid method reduces to the direct method
+    k0, k1 = 20.0, 0.5
+    tout = np.linspace(0, 30, 31)
+    xout = simulate(_birth_death(k0, k1), [0], tout, n_trajectories=20, volume=1/AVOGADRO, method='hybrid',
+                    seed=7)[:, 10:, 0]
+    assert np.all(xout == np.rint(xout))
+    assert abs(xout.mean() - k0/k1) < 3
+    assert 0.7 < xout.var()/(k0/k1) < 1.4
+
+
+@requires('numpy', 'pyodesys', 'scipy')
+def test_simulate__hybrid():
+    # fast isomerization A <-> B, rare (slow) A -> C
+    rsys = ReactionSystem([Reaction({'A': 1}, {'B': 1}, 10.0), Reaction({'B': 1}, {'A': 1}, 10.0),
+                           Reaction({'A': 1}, {'C': 1}, 1e-3)], 'A B C')
+    tout = [0, 1, 5]
+    xout = simulate(rsys, {'A': 10000}, tout, n_trajectories=20, volume=1/AVOGADRO, method='hybrid', seed=1)
+    assert np.allclose(xout.sum(axis=-1), 10000)
+    assert np.all(xout[:, :, 2] == np.rint(xout[:, :, 2]))
+    assert np.allclose(xout[:, -1, 0], xout[:, -1, 1], rtol=0.02)
+    nC = xout[:, -1, 2].mean()  # ~ 1e-3*5000*5
+    assert abs(nC - 25) < 5*math.sqrt(25/20)
+
+
+@requires('numpy')
+def test_simulate__workers():
+    rsys = _birth_death()
+    tout = [0, 1, 2, 3]
+    ref = simulate(rsys, [10], tout, n_trajectories=7, volume=1/AVOGADRO, seed=3)
+    par = simulate(rsys, [10], tout, n_trajectories=7, volume=1/AVOGADRO, seed=3, workers=2)
+    assert np.all(ref == par)
+    assert not np.all(ref[0] == ref[1])
@@ -9,6 +9,7 @@ from itertools import chain
 from .chemistry import Reaction, Substance
 from .units import to_unitless
 from .util.pyutil import deprecated
+from .util._expr import EvaluationContext
 
 
 class ReactionSystem(object):
@@ -614,6 +615,12 @@ class ReactionSystem(object):
         dict
             per substance_key time derivatives of concentrations.
 
+        Notes
+        -----
+        The rates are evaluated in an :class:`chempy.util._expr.EvaluationContext` (unless
+        ``variables`` already is one), i.e. shared (parameter) expressions are evaluated once
+        (once per reaction for expressions with ``reaction_dependent = True``).
+
         Examples
         --------
         >>> r = Reaction({'R': 2}, {'P': 1}, 42.0)
@@ -626,6 +633,9 @@ class ReactionSystem(object):
         result = {}
         if ratexs is None:
             ratexs = [None]*self.nr
+        if not isinstance(variables, EvaluationContext):
+            # expression valued variables (e.g. a temperature schedule) are evaluated once
+            variables = EvaluationContext(variables or {}, backend)
         for rxn, ratex in zip(self.rxns, ratexs):
             for k, v in rxn.rate(variables, backend, substance_keys, ratex=ratex).items():
                 if k not in result:
@@ -638,6 +648,93 @@ class ReactionSystem(object):
                 result[sk] += variables[fr_key]*(variables[fck] - variables[sk])
         return result
 
+    def compile_rhs(self, **kwargs):
+        """ Numerical (SymPy free) representation of :meth:`rates`.
+
+        Parameters
+        ----------
+        \\*\\*kwargs :
+            Keyword arguments passed on to :class:`chempy.kinetics.numeric.NumericRHS`.
+
+        Returns
+        -------
+        NumericRHS instance, with methods ``f(t, y, p)`` and ``rates(t, y, p)``
+        operating on arrays (ordered as :attr:`substances`).
+
+        Examples
+        --------
+        >>> r = Reaction({'R': 2}, {'P': 1}, 42.0)
+        >>> rsys = ReactionSystem([r], 'R P')
+        >>> rhs = rsys.compile_rhs()
+        >>> rhs.f(0, [3, 5]).tolist() == [-2*42*3**2, 42*3**2]
+        True
+
+        """
+        from .kinetics.numeric import NumericRHS
+        return NumericRHS(self, **kwargs)
+
+    def steady_state(self, c0, params=None, **kwargs):
+        """ Solves for the steady state concentrations (dC/dt = 0) directly.
+
+        Parameters
+        ----------
+        c0 : dict or array_like
+            Initial concentrations (defining the conserved quantities).
+        params : dict or array_like, optional
+            Parameters of the rate expressions (values may be arrays for batched solving).
+        \\*\\*kwargs :
+            Keyword arguments passed on to :func:`chempy.kinetics.steady_state.steady_state`.
+
+        Returns
+        -------
+        conc : ndarray of steady state concentrations (ordered as :attr:`substances`)
+        info : dict
+
+        Examples
+        --------
+        >>> r1 = Reaction({'R': 2}, {'P': 1}, 3.0)
+        >>> r2 = Reaction({'P': 1}, {'R': 2}, 6.0)
+        >>> rsys = ReactionSystem([r1, r2], 'R P')
+        >>> conc, info = rsys.steady_state({'R': 2, 'P': 0})
+        >>> conc.round(12).tolist()
+        [1.0, 0.5]
+
+        """
+        from .kinetics.steady_state import steady_state
+        return steady_state(self, c0, params, **kwargs)
+
+    def reduce_drg(self, targets, samples, eps=1e-2):
+        """ Prunes the mechanism using a directed relation graph (DRG) against target species.
+
+        Parameters
+        ----------
+        targets : iterable of str
+            Substance keys of the observables.
+        samples : array_like
+            Per reaction rates at sampled states, shape ``(n_samples, nr)`` (e.g. from
+            ``rate_exprs_cb`` of :func:`chempy.kinetics.ode.get_odesys`).
+        eps : float
+            Threshold of the interaction coefficients.
+
+        Returns
+        -------
+        reduced : ReactionSystem
+        report : dict
+            See :func:`chempy.kinetics.reduction.reduce_drg`.
+
+        Examples
+        --------
+        >>> r1 = Reaction({'A': 1}, {'B': 1}, 2.0)
+        >>> r2 = Reaction({'A': 1}, {'C': 1}, 1e-9)
+        >>> rsys = ReactionSystem([r1, r2], 'A B C')
+        >>> reduced, report = rsys.reduce_drg(['B'], [[2.0, 1e-9]])
+        >>> reduced.nr, [ri for ri, rxn in report['dropped_reactions']]
+        (1, [1])
+
+        """
+        from .kinetics.reduction import reduce_drg
+        return reduce_drg(self, targets, samples, eps)
+
     def _stoichs(self, attr, keys=None):
         import numpy as np
         if keys is None:
@@ -82,6 +82,42 @@ def test_ReactionSystem__rates():
     assert rs.rates({'H2O': 3, 'H+': 5, 'OH-': 7}) == {'H2O': -11*3, 'H+': 11*3, 'OH-': 11*3}
 
 
+def test_ReactionSystem__rates__EvaluationContext():
+    import math
+    from ..kinetics.rates import MassAction, Arrhenius, RampedTemp
+
+    class CountingRampedTemp(RampedTemp):
+        calls = 0
+
+        def __call__(self, *args, **kwargs):
+            CountingRampedTemp.calls += 1
+            return super(CountingRampedTemp, self).__call__(*args, **kwargs)
+
+    arr = Arrhenius([1e10, 4e3])
+    rs = ReactionSystem([Reaction({'A': 1}, {'B': 1}, MassAction(arr)),
+                         Reaction({'B': 1}, {'A': 1}, MassAction(Arrhenius([2e10, 4e3]))),
+                         Reaction({'B': 1}, {'C': 1}, MassAction(arr))])
+    rates = rs.rates({'A': 3, 'B': 5, 'C': 0, 'time': 10, 'temperature': CountingRampedTemp([290, 1])})
+    assert CountingRampedTemp.calls == 1
+    k = math.exp(-4e3/300)*1e10
+    assert abs(rates['C'] - 5*k)/rates['C'] < 1e-14
+    assert abs(rates['A'] - (-3*k + 2*5*k))/abs(rates['A']) < 1e-14
+
+
+def test_ReactionSystem__rates__reaction_dependent_variable():
+    from ..kinetics.rates import MassAction
+    from ..util._expr import Expr
+
+    class PerRxn(Expr):
+        nargs = 0
+
+        def __call__(self, variables, backend=None, reaction=None):
+            return 2*sum(reaction.reac.values())
+
+    rs = ReactionSystem([Reaction({'A': 1}, {'B': 1}, MassAction(['kk']))])
+    assert rs.rates({'A': 3, 'B': 5, 'kk': PerRxn()}) == {'A': -6, 'B': 6}
+
+
 def test_ReactionSystem__rates__cstr():
     k = 11
     rs = ReactionSystem([Reaction({'H2O2': 2}, {'O2': 1, 'H2O': 2}, k)])
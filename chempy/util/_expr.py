@@ -13,6 +13,7 @@ separately.
 """
 from __future__ import (absolute_import, division, print_function)
 
+from bisect import bisect_left
 import math
 from itertools import chain
 from operator import add, mul, truediv, sub, pow
@@ -24,6 +25,53 @@ except ImportError:
     sympy = None
 
 
+_dynamic_classes = {}
+
+
+def _dynamic_class(factory, args=(), kwargs=None):
+    """ Memoized ``factory(*args, **kwargs)`` (creating a subclass of :class:`Expr`)
+
+    The arguments are recorded on the class as ``_factory``, allowing its instances to be pickled.
+    """
+    kwargs = kwargs or {}
+    try:
+        key = (factory, tuple(args), tuple(sorted(kwargs.items())))
+        hash(key)
+    except TypeError:
+        key = None
+    if key is not None and key in _dynamic_classes:
+        return _dynamic_classes[key]
+    cls = factory(*args, **kwargs)
+    cls._factory = (factory, tuple(args), kwargs)
+    if key is not None:
+        _dynamic_classes[key] = cls
+    return cls
+
+
+def _rebuild_expr(factory, args, kwargs, state):
+    cls = _dynamic_class(factory, args, kwargs)
+    obj = cls.__new__(cls)
+    obj.__dict__.update(state)
+    return obj
+
+
+def _callback_class(cls, callback, attr='__call__', **kwargs):
+    """ See :meth:`Expr.from_callback` """
+    def body(self, variables, backend=math, **kw):
+        args = self.all_args(variables, backend=backend)
+        params = self.all_params(variables, backend=backend)
+        return callback(args, *params, backend=backend, **kw)
+
+    class Wrapper(cls):
+        pass
+
+    setattr(Wrapper, attr, body)
+    Wrapper.__name__ = callback.__name__
+    for k, v in kwargs.items():
+        setattr(Wrapper, k, v)
+    return Wrapper
+
+
 def _implicit_conversion(obj):
     if isinstance(obj, (int, float)):
         return Constant(obj)
@@ -107,12 +155,16 @@ class Expr(object):
     parameter_keys : tuple of strings
     nargs : int
         number of arguments (`None` signifies unset, -1 signifies any number)
+    reaction_dependent : bool
+        Whether the value may depend on the ``reaction`` keyword argument (results of
+        reaction independent expressions are shared between reactions by :class:`EvaluationContext`).
     '''
 
     argument_names = None
     argument_defaults = None
     parameter_keys = ()
     nargs = None
+    reaction_dependent = True
 
     def __init__(self, args=None, unique_keys=None):
         if isinstance(args, str):
@@ -186,20 +238,14 @@ class Expr(object):
         >>> q({'x': 7, 'x0_q': 0}) == 3 + 2*7 + 5*7**2
         True
 
-        """
-        def body(self, variables, backend=math, **kw):
-            args = self.all_args(variables, backend=backend)
-            params = self.all_params(variables, backend=backend)
-            return callback(args, *params, backend=backend, **kw)
-
-        class Wrapper(cls):
-            pass
+        Notes
+        -----
+        Instances can be pickled if ``callback`` can (e.g. a module level function).
+        The created class is memoized (when ``kwargs`` are hashable), hence unpickled
+        instances are of the very same class.
 
-        setattr(Wrapper, attr, body)
-        Wrapper.__name__ = callback.__name__
-        for k, v in kwargs.items():
-            setattr(Wrapper, k, v)
-        return Wrapper
+        """
+        return _dynamic_class(_callback_class, (cls, callback, attr), kwargs)
 
     def __call__(self, variables, backend=math, **kwargs):
         raise NotImplementedError("Subclass and implement __call__")
@@ -207,6 +253,40 @@ class Expr(object):
     def __float__(self):
         return float(self({}))
 
+    def __reduce_ex__(self, protocol):
+        recipe = type(self).__dict__.get('_factory')  # set on dynamically created classes
+        if recipe is None:
+            return super(Expr, self).__reduce_ex__(protocol)
+        return _rebuild_expr, recipe + (self.__dict__,)
+
+    def compile(self, variable_order=None, backend='numpy', constants=None):
+        """ Compiles the expression into a (vectorized) function
+
+        See :func:`chempy.util._expr_compile.compile_exprs` (which also compiles
+        several expressions into one function, sharing common subexpressions).
+
+        Parameters
+        ----------
+        variable_order : iterable of str, optional
+            Order of the arguments of the compiled function.
+        backend : str
+            ``'numpy'`` or ``'numba'``.
+        constants : dict, optional
+            Values of variables known at compile time.
+
+        Examples
+        --------
+        >>> Poly = create_Poly('x')
+        >>> cb = Poly([3, 4, 5]).compile()
+        >>> cb.variable_order
+        ('x',)
+        >>> cb([0, 1, 2]).tolist()
+        [3, 12, 31]
+
+        """
+        from ._expr_compile import compile_exprs
+        return compile_exprs([self], variable_order, backend, squeeze=True, constants=constants)
+
     def _all_keys(self, attr):
         _keys = getattr(self, attr)
         _all = set() if _keys is None else set(_keys)
@@ -283,7 +363,7 @@ class Expr(object):
         #     res = variables[res.unique_keys[0]]
 
         if isinstance(res, Expr) and evaluate:
-            return res(variables, backend=backend, **kwargs)
+            return _evaluate(res, variables, backend, **kwargs)
         else:
             return res
 
@@ -295,7 +375,7 @@ class Expr(object):
         return [self.arg(variables, i, backend, evaluate, **kwargs) for i in range(nargs)]
 
     def all_params(self, variables, backend=math):
-        return [v(variables, backend=backend) if isinstance(v, Expr) else v for v
+        return [_evaluate(v, variables, backend) if isinstance(v, Expr) else v for v
                 in [variables[k] for k in self.parameter_keys]]
 
     def args_dimensionality(self, **kwargs):
@@ -504,6 +584,88 @@ class UnaryWrapper(Expr):
         return lambda *args, **kw: cls(Wrapper(*args, **kw))
 
 
+def _evaluate(expr, variables, backend, **kwargs):
+    if isinstance(variables, EvaluationContext):
+        return variables.evaluate(expr, backend, **kwargs)
+    return expr(variables, backend=backend, **kwargs)
+
+
+class EvaluationContext(dict):
+    """ Variables of one evaluation, memoizing the values of expressions
+
+    Expressions passed as arguments (e.g. :class:`chempy.kinetics.rates.Arrhenius`
+    of :class:`chempy.kinetics.rates.MassAction`) and expression valued variables
+    (e.g. a temperature schedule) are evaluated once per context, keyed on the identity
+    of the expression (and of the reaction when ``expr.reaction_dependent``).
+    Assigning to the context clears the memoized values.
+
+    Parameters
+    ----------
+    variables : dict
+    backend : module, optional
+        When given: expression valued variables not depending on the reaction (i.e. with
+        ``reaction_dependent = False``) are evaluated (in order) upon construction, the
+        others are evaluated (memoized per reaction) when looked up by an expression.
+
+    Examples
+    --------
+    >>> class Counting(Expr):
+    ...     parameter_keys = ('x',)
+    ...     reaction_dependent = False
+    ...     calls = 0
+    ...     def __call__(self, variables, backend=math, **kwargs):
+    ...         Counting.calls += 1
+    ...         return 2*variables['x']
+    ...
+    >>> shared = Counting()
+    >>> Poly = create_Poly('x')
+    >>> ctx = EvaluationContext({'x': 3})
+    >>> [(Poly([0, shared])*shared)(ctx) for _ in range(3)], Counting.calls
+    ([108, 108, 108], 1)
+
+    """
+
+    def __init__(self, variables=(), backend=None):
+        super(EvaluationContext, self).__init__(variables)
+        self._memo = {}
+        if backend is not None:
+            for k, v in list(self.items()):
+                if isinstance(v, Expr) and not v.reaction_dependent:  # others: lazily, per reaction
+                    try:
+                        value = self.evaluate(v, backend)
+                    except KeyError:
+                        continue  # raised again if needed by another expression
+                    dict.__setitem__(self, k, value)
+
+    def __setitem__(self, key, value):
+        self._memo.clear()
+        super(EvaluationContext, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._memo.clear()
+        super(EvaluationContext, self).__delitem__(key)
+
+    def update(self, *args, **kwargs):
+        self._memo.clear()
+        super(EvaluationContext, self).update(*args, **kwargs)
+
+    def memoize(self, key, cb):
+        """ Returns ``cb()``, memoized under ``key`` (which should be hashable) """
+        if key not in self._memo:
+            self._memo[key] = cb()
+        return self._memo[key]
+
+    def evaluate(self, expr, backend=math, **kwargs):
+        """ Memoized ``expr(self, backend=backend, **kwargs)`` """
+        if set(kwargs) - {'reaction'}:
+            return expr(self, backend=backend, **kwargs)
+        rxn_key = kwargs.get('reaction') if expr.reaction_dependent else None
+        key = ('expr', id(expr), id(backend), id(rxn_key))
+        if key not in self._memo:  # referents are kept alive (ids may not be reused):
+            self._memo[key] = (expr, rxn_key, expr(self, backend=backend, **kwargs))
+        return self._memo[key][-1]
+
+
 class _NegExpr(Expr):
 
     def _str(self, *args, **kwargs):
@@ -617,6 +779,114 @@ class Exp(UnaryFunction):
     _func_name = 'exp'
 
 
+def _masked_variables(variables, mask):
+    """ ``variables`` with arrays (shaped as ``mask``) indexed by ``mask``, ``None`` if not broadcastable """
+    result = {}
+    for k, v in variables.items():
+        shape = getattr(v, 'shape', ())
+        if shape == ():
+            result[k] = v
+        elif shape == mask.shape:
+            result[k] = v[mask]
+        else:
+            return None
+    return result
+
+
+class _Piecewise(Expr):
+    """ Piecewise defined expression, see :func:`create_Piecewise`
+
+    The arguments are ``(b0, e0, b1, e1, ..., bn)``, ``e_i`` applies for ``b_i <= x <= b_(i+1)``
+    (the first matching interval takes precedence). The bounds are validated once (and kept when
+    they are not looked up in the variables), the interval is found by binary search and only the
+    active sub-expressions are evaluated (per element for arrays). Backends providing ``Piecewise``
+    (e.g. SymPy) get a ``Piecewise`` instance with one condition per interval.
+    """
+
+    nan_fallback = False
+
+    def __init__(self, args=None, unique_keys=None):
+        super(_Piecewise, self).__init__(args, unique_keys)
+        if self.args is not None:
+            if len(self.args) < 3:
+                raise ValueError("Need at least 3 args")
+            if len(self.args) % 2 != 1:
+                raise ValueError("Need an odd number of bounds/exprs")
+        self._bounds_cache = None
+
+    def _bounds(self, variables, backend):
+        """ Returns the bounds and whether they are non-decreasing """
+        if self._bounds_cache is not None:
+            return self._bounds_cache
+        bounds = [self.arg(variables, i, backend=backend) for i in range(0, len(self.args), 2)]
+        result = bounds, all(lo <= up for lo, up in zip(bounds[:-1], bounds[1:]))
+        if self.unique_keys is None and not any(isinstance(b, (Expr, str)) for b in self.args[::2]):
+            self._bounds_cache = result
+        return result
+
+    def _interval(self, bounds, ordered, x):
+        if ordered:
+            i = max(bisect_left(bounds, x), 1) - 1
+            if i < len(bounds) - 1 and bounds[i] <= x <= bounds[i+1]:
+                return i
+        else:
+            for i, (lo, up) in enumerate(zip(bounds[:-1], bounds[1:])):
+                if lo <= x <= up:
+                    return i
+        raise ValueError("not within any bounds: %s" % x)
+
+    def _intervals(self, bounds, ordered, x):
+        import numpy as np
+        n = len(bounds) - 1
+        if ordered:
+            idx = np.maximum(np.searchsorted(bounds, x), 1) - 1
+            clipped = np.minimum(idx, n - 1)
+            valid = (idx < n) & (np.take(bounds, clipped) <= x) & (x <= np.take(bounds, clipped + 1))
+        else:
+            idx = np.full(x.shape, n)
+            for i in range(n - 1, -1, -1):
+                idx[(bounds[i] <= x) & (x <= bounds[i+1])] = i
+            valid = idx < n
+        if not np.all(valid):
+            raise ValueError("not within any bounds: %s" % x[~valid].flat[0])
+        return idx
+
+    def _batch(self, variables, backend, x, bounds, ordered):
+        import numpy as np
+        idx = self._intervals(bounds, ordered, x)
+        active = np.unique(idx)
+        variables = dict(variables, **{self.parameter_keys[0]: x})
+        if _masked_variables(variables, np.ones(x.shape, dtype=bool)) is None:
+            # other variables broadcast against x: evaluate the active sub-expressions everywhere
+            values = [self.arg(variables, 2*i + 1, backend=backend) for i in active]
+            shape = np.broadcast_shapes(x.shape, *map(np.shape, values))
+            idx = np.broadcast_to(idx, shape)
+            values = [np.broadcast_to(value, shape)[idx == i] for i, value in zip(active, values)]
+        else:
+            shape = x.shape
+            values = [self.arg(_masked_variables(variables, idx == i), 2*i + 1, backend=backend) for i in active]
+        out = np.empty(shape, dtype=np.result_type(np.float64, *values))
+        for i, value in zip(active, values):
+            out[idx == i] = value
+        return out
+
+    def __call__(self, variables, backend=math, **kwargs):
+        x, = self.all_params(variables, backend=backend)
+        try:
+            pw = backend.Piecewise
+        except AttributeError:
+            pass
+        else:
+            args = self.all_args(variables, backend=backend)
+            _NAN = backend.Symbol('NAN')
+            return pw(*([(ex, backend.And(lo <= x, x <= up)) for lo, ex, up in zip(
+                args[:-1:2], args[1::2], args[2::2])] + ([(_NAN, True)] if self.nan_fallback else [])))
+        bounds, ordered = self._bounds(variables, backend)
+        if getattr(x, 'ndim', 0) > 0:
+            return self._batch(variables, backend, x, bounds, ordered)
+        return self.arg(variables, 2*self._interval(bounds, ordered, x) + 1, backend=backend)
+
+
 def create_Piecewise(parameter_name, nan_fallback=False):
     """
     Examples
@@ -631,32 +901,17 @@ def create_Piecewise(parameter_name, nan_fallback=False):
     True
     >>> pw({'x': 2}) == 8
     True
+    >>> import numpy as np
+    >>> pw({'x': np.array([-5., 1, 2])}, backend=np).tolist()
+    [5.0, 1.0, 8.0]
 
     """
-    def _pw(bounds_exprs, x, backend=math, **kwargs):
-        if len(bounds_exprs) < 3:
-            raise ValueError("Need at least 3 args")
-        if len(bounds_exprs) % 2 != 1:
-            raise ValueError("Need an odd number of bounds/exprs")
-        n_exprs = (len(bounds_exprs) - 1) // 2
-        lower = [bounds_exprs[2*(i+0)] for i in range(n_exprs)]
-        upper = [bounds_exprs[2*(i+1)] for i in range(n_exprs)]
-        exprs = [bounds_exprs[2*i + 1] for i in range(n_exprs)]
+    return _dynamic_class(_create_Piecewise, (parameter_name, nan_fallback))
 
-        try:
-            pw = backend.Piecewise
-        except AttributeError:
-            for lo, up, ex in zip(lower, upper, exprs):
-                if lo <= x <= up:
-                    return ex
-            else:
-                raise ValueError("not within any bounds: %s" % x)
-        else:
-            _NAN = backend.Symbol('NAN')
-            return pw(*([(ex, backend.And(lo <= x, x <= up)) for lo, up, ex in zip(lower, upper, exprs)] +
-                        ([(_NAN, True)] if nan_fallback else [])))
 
-    return Expr.from_callback(_pw, parameter_keys=(parameter_name,))
+def _create_Piecewise(parameter_name, nan_fallback):
+    return type(str('Piecewise'), (_Piecewise,), dict(
+        parameter_keys=(parameter_name,), nan_fallback=nan_fallback))
 
 
 def create_Poly(parameter_name, reciprocal=False, shift=None, name=None):
@@ -679,6 +934,10 @@ def create_Poly(parameter_name, reciprocal=False, shift=None, name=None):
     True
 
     """
+    return _dynamic_class(_create_Poly, (parameter_name, reciprocal, shift, name))
+
+
+def _create_Poly(parameter_name, reciprocal, shift, name):
     if shift is True:
         shift = 'shift'
 
@@ -712,7 +971,96 @@ def create_Poly(parameter_name, reciprocal=False, shift=None, name=None):
         argument_names = (shift, Ellipsis)
     if name is not None:
         _poly.__name__ = name
-    return Expr.from_callback(_poly, parameter_keys=(parameter_name,), argument_names=argument_names)
+    return Expr.from_callback(_poly, parameter_keys=(parameter_name,), argument_names=argument_names,
+                              reciprocal=reciprocal, shift=shift)
+
+
+class StackedPoly(object):
+    """ Polynomials (instances of classes from :func:`create_Poly`) evaluated together
+
+    The coefficients are stacked into a zero padded matrix once. With a common shift the
+    polynomials are evaluated as one matrix product (powers times coefficients), otherwise by
+    Horner's scheme vectorized over the polynomials.
+
+    Parameters
+    ----------
+    polys : iterable of Expr instances
+        Of classes created by :func:`create_Poly` with the same parameter and ``reciprocal``.
+    variables : dict, optional
+        Used to look up arguments given as ``unique_keys``.
+
+    Examples
+    --------
+    >>> TPoly = create_Poly('T')
+    >>> sp = StackedPoly([TPoly([1, 2]), TPoly([3, 0, 1]), TPoly([5])])
+    >>> sp.coeffs.shape
+    (3, 3)
+    >>> sp([1, 2]).tolist()
+    [[3.0, 4.0, 5.0], [5.0, 7.0, 5.0]]
+
+    """
+
+    def __init__(self, polys, variables=None):
+        import numpy as np
+        polys = list(polys)
+        if len(polys) == 0:
+            raise ValueError("Need at least one polynomial")
+        for poly in polys:
+            if not hasattr(poly, 'reciprocal'):
+                raise ValueError("Not created by create_Poly: %s" % poly)
+        self.parameter_key, = polys[0].parameter_keys
+        self.reciprocal = polys[0].reciprocal
+        for poly in polys[1:]:
+            if poly.parameter_keys != (self.parameter_key,) or poly.reciprocal != self.reciprocal:
+                raise ValueError("Incompatible polynomial: %s" % poly)
+        all_args = [poly.all_args(variables or {}) for poly in polys]
+        coeffs = [args if poly.shift is None else args[1:] for poly, args in zip(polys, all_args)]
+        self.shifts = np.array([0 if poly.shift is None else args[0] for poly, args in zip(polys, all_args)],
+                               dtype=np.float64)
+        self.coeffs = np.zeros((len(polys), max(map(len, coeffs))))
+        for i, c in enumerate(coeffs):
+            self.coeffs[i, :len(c)] = c
+
+    def __len__(self):
+        return self.coeffs.shape[0]
+
+    def __call__(self, x):
+        """ Values of the polynomials at ``x``, shape ``np.shape(x) + (len(self),)``
+
+        ``x`` is the value of the polynomial variable (e.g. the base 10 logarithm of the
+        temperature for ``Log10TPoly``), see :meth:`from_variables` for transformed variables.
+        """
+        import numpy as np
+        x = np.asarray(x, dtype=np.float64)
+        if np.all(self.shifts == self.shifts[0]):
+            z = x - self.shifts[0]
+            if self.reciprocal:
+                z = 1/z
+            powers = z[..., None]**np.arange(self.coeffs.shape[1])
+            return powers @ self.coeffs.T
+        z = x[..., None] - self.shifts
+        if self.reciprocal:
+            z = 1/z
+        result = np.broadcast_to(self.coeffs[:, -1], z.shape)
+        for c in self.coeffs[:, -2::-1].T:
+            result = result*z + c
+        return np.array(result)
+
+    def from_variables(self, variables):
+        """ Evaluates at ``variables[self.parameter_key]``
+
+        As for the polynomials themselves, an :class:`Expr` value is evaluated first, e.g.
+        ``{'log10_temperature': Log10('temperature')}`` for ``Log10TPoly`` of ``chempy.kinetics._rates``.
+        """
+        import numpy as np
+        if self.parameter_key not in variables:
+            raise KeyError("Missing %s in variables%s" % (self.parameter_key, (
+                ", e.g. {'%s': Log10('%s')}" % (self.parameter_key, self.parameter_key[6:])
+                if self.parameter_key.startswith('log10_') else '')))
+        x = variables[self.parameter_key]
+        if isinstance(x, Expr):
+            x = _evaluate(x, variables, np)
+        return self(x)
 
 from ._expr_deprecated import _mk_PiecewisePoly, _mk_Poly  # noqa
 
@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""
+Compilation of (lists of) :class:`chempy.util._expr.Expr` instances into a single
+vectorized function.
+
+The expressions are traced by evaluating them with placeholder variables and a
+backend recording the operations. Subtrees not depending on any variable are
+evaluated during tracing (constant folding), identical operations are recorded
+once (common subexpression elimination, also across expressions) and the
+resulting operations are emitted as the source of one Python function (using
+NumPy, optionally jit-compiled by Numba).
+"""
+from __future__ import (absolute_import, division, print_function)
+
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class _Node(object):
+    """ An operation (or variable) recorded during tracing """
+
+    __slots__ = ('graph', 'idx', 'op', 'args')
+
+    def __init__(self, graph, idx, op, args):
+        self.graph = graph
+        self.idx = idx
+        self.op = op
+        self.args = args
+
+    def _binary(self, op, other, reflected=False):
+        return self.graph.node(op, (other, self) if reflected else (self, other))
+
+    def __add__(self, other):
+        return self._binary('add', other)
+
+    def __radd__(self, other):
+        return self._binary('add', other, True)
+
+    def __sub__(self, other):
+        return self._binary('sub', other)
+
+    def __rsub__(self, other):
+        return self._binary('sub', other, True)
+
+    def __mul__(self, other):
+        return self._binary('mul', other)
+
+    def __rmul__(self, other):
+        return self._binary('mul', other, True)
+
+    def __truediv__(self, other):
+        return self._binary('div', other)
+
+    def __rtruediv__(self, other):
+        return self._binary('div', other, True)
+
+    __div__, __rdiv__ = __truediv__, __rtruediv__
+
+    def __pow__(self, other):
+        return self._binary('pow', other)
+
+    def __rpow__(self, other):
+        return self._binary('pow', other, True)
+
+    def __neg__(self):
+        return self.graph.node('neg', (self,))
+
+    def __pos__(self):
+        return self
+
+    def __lt__(self, other):
+        return self._binary('lt', other)
+
+    def __le__(self, other):
+        return self._binary('le', other)
+
+    def __gt__(self, other):
+        return self._binary('gt', other)
+
+    def __ge__(self, other):
+        return self._binary('ge', other)
+
+    def __bool__(self):
+        raise TypeError("Value dependent branching cannot be compiled")
+
+    __nonzero__ = __bool__
+
+    def __float__(self):
+        raise TypeError("Cannot convert a traced value to float")
+
+    def __hash__(self):
+        return id(self)
+
+
+def _is_node(obj):
+    return isinstance(obj, _Node)
+
+
+def _const_key(obj):
+    return ('const', type(obj).__name__, repr(obj))
+
+
+class _Graph(object):
+    """ Records (hash-consed) operations """
+
+    _commutative = ('add', 'mul')
+
+    def __init__(self):
+        self.nodes = []
+        self._table = {}
+        self.variables = []
+
+    def variable(self, key):
+        node = _Node(self, len(self.nodes), 'var', (key,))
+        self.nodes.append(node)
+        self.variables.append(key)
+        return node
+
+    def node(self, op, args):
+        args = tuple(args)
+        simplified = self._simplify(op, args)
+        if simplified is not None:
+            return simplified
+        keys = tuple(('node', a.idx) if _is_node(a) else _const_key(a) for a in args)
+        if op in self._commutative:
+            keys = tuple(sorted(keys))
+        key = (op, keys)
+        if key not in self._table:
+            self._table[key] = _Node(self, len(self.nodes), op, args)
+            self.nodes.append(self._table[key])
+        return self._table[key]
+
+    @staticmethod
+    def _simplify(op, args):
+        if len(args) != 2:
+            return None
+        a, b = args
+        if op == 'add':
+            if not _is_node(a) and a == 0:
+                return b
+            if not _is_node(b) and b == 0:
+                return a
+        elif op == 'sub' and not _is_node(b) and b == 0:
+            return a
+        elif op == 'mul':
+            if not _is_node(a) and a == 1:
+                return b
+            if not _is_node(b) and b == 1:
+                return a
+        elif op in ('div', 'pow') and not _is_node(b) and b == 1:
+            return a
+        return None
+
+    def call(self, name, args):
+        if not any(map(_is_node, args)):
+            return getattr(np, name)(*args)  # constant folding
+        return self.node('call:' + name, args)
+
+
+class _TracerBackend(object):
+    """ Backend (module-like) recording the calls of NumPy functions """
+
+    __name__ = 'chempy_tracer'
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        attr = getattr(np, name)  # raises AttributeError for unknown names
+        if callable(attr):
+            return lambda *args: self._graph.call(name, args)
+        return attr
+
+    def Piecewise(self, *pairs):
+        args = []
+        for value, cond in pairs:
+            args.extend([value, cond])
+        if not any(map(_is_node, args)):
+            for value, cond in pairs:
+                if cond:
+                    return value
+            raise ValueError("not within any bounds")
+        return self._graph.node('piecewise', args)
+
+    def And(self, *conds):
+        if not any(map(_is_node, conds)):
+            return all(conds)
+        return self._graph.node('and', conds)
+
+    def Symbol(self, name):
+        if name == 'NAN':
+            return float('nan')
+        raise NotImplementedError("Symbols cannot be compiled: %s" % name)
+
+    def Float(self, value):
+        return float(value)
+
+
+class _TracerVariables(dict):
+    """ Creates a variable node for each key looked up (in order of first access) """
+
+    def __init__(self, graph, variable_order=None, constants=None):
+        super(_TracerVariables, self).__init__(constants or {})
+        self._graph = graph
+        self._fixed = variable_order is not None
+        for key in variable_order or ():
+            dict.__setitem__(self, key, graph.variable(key))
+
+    def __missing__(self, key):
+        if self._fixed:
+            raise KeyError("Not in variable_order: %s" % key)
+        value = self._graph.variable(key)
+        dict.__setitem__(self, key, value)
+        return value
+
+    def __contains__(self, key):
+        return self._fixed is False or dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+_OP_FMT = {
+    'add': '({0} + {1})', 'sub': '({0} - {1})', 'mul': '({0}*{1})', 'div': '({0}/{1})',
+    'pow': '({0}**{1})', 'neg': '(-{0})', 'lt': '({0} < {1})', 'le': '({0} <= {1})',
+    'gt': '({0} > {1})', 'ge': '({0} >= {1})',
+}
+
+
+def _const_str(obj):
+    if isinstance(obj, bool):
+        return repr(obj)
+    if isinstance(obj, int):
+        return repr(obj)
+    value = float(obj)
+    if math.isnan(value):
+        return 'nan'
+    if math.isinf(value):
+        return 'inf' if value > 0 else '(-inf)'
+    return repr(value)
+
+
+def _emit(graph, outputs, scalar):
+    """ Source lines computing the nodes needed by ``outputs`` (in topological order) and their number """
+    var_pos = {key: i for i, key in enumerate(graph.variables)}
+    needed = set()
+    stack = [o for o in outputs if _is_node(o)]
+    while stack:
+        node = stack.pop()
+        if node.idx in needed:
+            continue
+        needed.add(node.idx)
+        stack.extend(a for a in node.args if _is_node(a))
+
+    def ref(a):
+        if not _is_node(a):
+            return _const_str(a)
+        return 'v%d' % var_pos[a.args[0]] if a.op == 'var' else 't%d' % a.idx
+
+    lines, n_ops = [], 0
+    for node in graph.nodes:
+        if node.idx not in needed or node.op == 'var':
+            continue
+        n_ops += 1
+        args = [ref(a) for a in node.args]
+        if node.op == 'piecewise' and scalar:
+            for i, (value, cond) in enumerate(zip(args[0::2], args[1::2])):
+                lines += ['%s %s:' % ('elif' if i else 'if', cond), '    t%d = %s' % (node.idx, value)]
+            lines += ['else:', '    raise ValueError("not within any bounds")']
+            continue
+        if node.op in _OP_FMT:
+            rhs = _OP_FMT[node.op].format(*args)
+        elif node.op.startswith('call:'):
+            rhs = 'np.%s(%s)' % (node.op[5:], ', '.join(args))
+        elif node.op == 'and':
+            rhs = ' and '.join(args) if scalar else 'np.logical_and.reduce((%s,))' % ', '.join(args)
+        elif node.op == 'piecewise':
+            rhs = '_piecewise((%s,), (%s,))' % (', '.join(args[1::2]), ', '.join(args[0::2]))
+        else:
+            raise NotImplementedError("Unknown operation: %s" % node.op)
+        lines.append('t%d = %s' % (node.idx, rhs))
+    return lines, [ref(o) for o in outputs], n_ops
+
+
+def _broadcast_stack(*values):
+    return np.stack(np.broadcast_arrays(*values), axis=-1)
+
+
+def _piecewise(conds, values):
+    conds = np.broadcast_arrays(*conds)
+    if not np.all(np.logical_or.reduce(conds)):
+        raise ValueError("not within any bounds")  # as the interpreted _Piecewise
+    return np.select(conds, np.broadcast_arrays(*values))
+
+
+class CompiledExprs(object):
+    """ A function evaluating many expressions at once (see :func:`compile_exprs`)
+
+    Instances are called with one (array_like) argument per key in ``variable_order``
+    (broadcast against each other), or a dict (see :meth:`from_dict`).
+
+    Attributes
+    ----------
+    variable_order : tuple of str
+    source : str
+        Python source of the generated function.
+    n_ops : int
+        Number of operations (after constant folding & elimination of common subexpressions).
+
+    """
+
+    def __init__(self, variable_order, source, n_outputs, n_ops, backend='numpy', squeeze=False):
+        self.variable_order = tuple(variable_order)
+        self.source = source
+        self.n_outputs = n_outputs
+        self.n_ops = n_ops
+        self.backend = backend
+        self.squeeze = squeeze
+        self._build()
+
+    def _build(self):
+        namespace = {'np': np, 'nan': float('nan'), 'inf': float('inf'), '_broadcast_stack': _broadcast_stack,
+                     '_piecewise': _piecewise}
+        exec(self.source, namespace)
+        self._func = namespace['_compiled']
+        if self.backend == 'numba':
+            import numba
+            self._func = numba.njit(cache=False)(self._func)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_func']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build()
+
+    def __call__(self, *args):
+        if self.backend == 'numba':
+            arrays = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in args])
+            shape = arrays[0].shape if arrays else ()
+            X = np.stack([a.ravel() for a in arrays], axis=-1) if arrays else np.empty((1, 0))
+            out = np.empty((X.shape[0], self.n_outputs))
+            self._func(X, out)
+            out = out.reshape(shape + (self.n_outputs,))
+            return out[..., 0] if self.squeeze else out
+        return self._func(*[np.asarray(a) if isinstance(a, (list, tuple)) else a for a in args])
+
+    def from_dict(self, variables):
+        """ Evaluates using the values of ``variables`` (a dict) """
+        return self(*[variables[k] for k in self.variable_order])
+
+
+def compile_exprs(exprs, variable_order=None, backend='numpy', squeeze=False, constants=None):
+    """ Compiles expressions into one vectorized function
+
+    Parameters
+    ----------
+    exprs : iterable of Expr instances or callables
+        Callables have the signature ``(variables, backend) -> value`` (e.g. to pass
+        ``reaction`` to :meth:`MassAction.rate_coeff`).
+    variable_order : iterable of str, optional
+        Order of the arguments of the compiled function. Default: the variables looked up
+        by the expressions (in order of first access, note that this includes unique keys
+        which would otherwise fall back to the arguments of the expressions).
+    backend : str
+        ``'numpy'`` (vectorized) or ``'numba'`` (a jit-compiled loop over the broadcast inputs).
+    squeeze : bool
+        Return the value of the (only) expression instead of an array with a trailing
+        axis of length ``len(exprs)``.
+    constants : dict, optional
+        Values of variables known at compile time (folded into the generated code).
+
+    Notes
+    -----
+    Like their interpreted evaluation, Piecewise expressions raise ``ValueError`` outside
+    their bounds (unless created with ``nan_fallback=True``).
+
+    Returns
+    -------
+    CompiledExprs
+
+    Raises
+    ------
+    NotImplementedError
+        When an expression cannot be traced (e.g. branching on values of the variables).
+
+    Examples
+    --------
+    >>> from chempy.kinetics.rates import Arrhenius
+    >>> cb = compile_exprs([Arrhenius([1e10, 4e4]), Arrhenius([3e11, 4e4])], ['temperature'])
+    >>> k = cb([298.15, 310])
+    >>> k.shape
+    (2, 2)
+    >>> bool(abs(k[1, 0]/Arrhenius([1e10, 4e4])({'temperature': 310}) - 1) < 1e-12)
+    True
+    >>> cb.n_ops  # the activation energy term is shared
+    4
+
+    """
+    if backend not in ('numpy', 'numba'):
+        raise ValueError("Unknown backend: %s" % backend)
+    exprs = list(exprs)
+    if squeeze and len(exprs) != 1:
+        raise ValueError("squeeze requires exactly one expression")
+    graph = _Graph()
+    variables = _TracerVariables(graph, None if variable_order is None else list(variable_order), constants)
+    tracer = _TracerBackend(graph)
+    outputs = []
+    for expr in exprs:
+        try:
+            if hasattr(expr, 'all_args') or not callable(expr):
+                outputs.append(expr(variables, backend=tracer))
+            else:
+                outputs.append(expr(variables, tracer))
+        except (TypeError, AttributeError) as exc:
+            raise NotImplementedError("Cannot compile %r: %s" % (expr, exc))
+    order = list(graph.variables)
+    scalar = backend == 'numba'
+    lines, refs, n_ops = _emit(graph, outputs, scalar)
+    if scalar:
+        body = ['v%d = X[i, %d]' % (i, i) for i in range(len(order))]
+        src = ['def _compiled(X, out):', '    for i in range(X.shape[0]):']
+        src += ['        ' + line for line in body + lines]
+        src += ['        out[i, %d] = %s' % (j, r) for j, r in enumerate(refs)]
+    else:
+        src = ['def _compiled(%s):' % ', '.join('v%d' % i for i in range(len(order)))]
+        src += ['    ' + line for line in lines]
+        if squeeze:
+            src.append('    return %s' % refs[0])
+        else:
+            src.append('    return _broadcast_stack(%s)' % ''.join(r + ', ' for r in refs))
+    return CompiledExprs(order, '\n'.join(src) + '\n', len(exprs), n_ops, backend, squeeze)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only on-disk storage of (long) integration output, readable through memory mapping.
+
+A store is a directory holding ``xout.f8`` & ``yout.f8`` (raw little-endian float64,
+``yout`` in row-major order) and ``header.json`` (names of the dependent variables,
+units, parameters and number of rows). Used by :func:`chempy.kinetics.ode.integrate_to_store`.
+"""
+from __future__ import (absolute_import, division, print_function)
+
+import json
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+_FORMAT = 'chempy-chunkstore-1'
+_DTYPE = '<f8'
+
+
+def _unit_str(arr):
+    from ..units import is_quantity
+    return arr.dimensionality.string if is_quantity(arr) else None
+
+
+def _magnitude(arr, unit_str):
+    from ..units import is_quantity
+    if is_quantity(arr):
+        if unit_str is None:
+            raise ValueError("The store lacks units")
+        arr = arr.rescale(unit_str).magnitude
+    return np.ascontiguousarray(arr, dtype=_DTYPE)
+
+
+class ChunkedStore(object):
+    """ Reads (and appends to) a chunked store of integration output
+
+    Parameters
+    ----------
+    path : str
+        Directory of the store.
+
+    Attributes
+    ----------
+    header : dict
+    names : list of str
+        Names (e.g. substance keys) of the columns of ``yout``.
+    xout : numpy.memmap of shape ``(n,)``
+    yout : numpy.memmap of shape ``(n, ny)``
+    params : ndarray or None
+        Parameters (unitless, as given by ``odesys.to_arrays``).
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> store = ChunkedStore.create(tempfile.mkdtemp(), ['A', 'B'])
+    >>> store.append([0, 1], [[1, 0], [.5, .5]])
+    >>> store.append([2], [[.25, .75]])
+    >>> store.named_dep('B').tolist()
+    [0.0, 0.5, 0.75]
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'header.json'), 'rt') as ifh:
+            self.header = json.load(ifh)
+        if self.header.get('format') != _FORMAT:
+            raise ValueError("Not a chunked store: %s" % path)
+
+    @classmethod
+    def create(cls, path, names, time_unit=None, conc_unit=None, params=None, **metadata):
+        """ Creates an empty store (``path`` may exist but must not contain a store)
+
+        Parameters
+        ----------
+        path : str
+        names : iterable of str
+        time_unit : str, optional
+            Unit of ``xout`` (see ``quantities.Quantity.dimensionality.string``).
+        conc_unit : str, optional
+            Unit of ``yout``.
+        params : array_like, optional
+        \\*\\*metadata :
+            Stored under the key 'metadata' of the header (needs to be serializable as JSON).
+
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        if os.path.exists(os.path.join(path, 'header.json')):
+            raise IOError("Store already exists: %s" % path)
+        for fname in ('xout.f8', 'yout.f8'):
+            open(os.path.join(path, fname), 'wb').close()
+        header = dict(format=_FORMAT, names=list(names), n=0, time_unit=time_unit, conc_unit=conc_unit,
+                      params=None if params is None else np.asarray(params, dtype=np.float64).tolist(),
+                      metadata=metadata)
+        cls._write_header(path, header)
+        return cls(path)
+
+    @staticmethod
+    def _write_header(path, header):
+        tmp = os.path.join(path, 'header.json.tmp')
+        with open(tmp, 'wt') as ofh:
+            json.dump(header, ofh)
+        os.replace(tmp, os.path.join(path, 'header.json'))
+
+    @property
+    def names(self):
+        return self.header['names']
+
+    @property
+    def ny(self):
+        return len(self.names)
+
+    def __len__(self):
+        return self.header['n']
+
+    @property
+    def params(self):
+        return None if self.header['params'] is None else np.array(self.header['params'])
+
+    def _units(self, key):
+        if self.header[key] is None:
+            return None
+        import quantities as pq
+        return pq.Quantity(1.0, self.header[key])
+
+    @property
+    def time_unit(self):
+        """ Unit (quantity) of ``xout`` or None """
+        return self._units('time_unit')
+
+    @property
+    def conc_unit(self):
+        """ Unit (quantity) of ``yout`` or None """
+        return self._units('conc_unit')
+
+    def append(self, xout, yout):
+        """ Appends rows (``yout`` may carry units, which are converted to those of the store) """
+        x = _magnitude(xout, self.header['time_unit']).reshape(-1)
+        y = _magnitude(yout, self.header['conc_unit']).reshape((-1, self.ny))
+        if x.size != y.shape[0]:
+            raise ValueError("Mismatching number of rows in xout and yout")
+        for fname, arr in (('xout.f8', x), ('yout.f8', y)):
+            with open(os.path.join(self.path, fname), 'r+b') as ofh:
+                ofh.seek(len(self)*arr.itemsize*(1 if arr.ndim == 1 else self.ny))
+                ofh.truncate()  # discards rows of an interrupted append
+                arr.tofile(ofh)
+        self.header['n'] += x.size
+        self._write_header(self.path, self.header)
+
+    def _memmap(self, fname, shape):
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=_DTYPE)
+        return np.memmap(os.path.join(self.path, fname), dtype=_DTYPE, mode='r', shape=shape)
+
+    @property
+    def xout(self):
+        return self._memmap('xout.f8', (len(self),))
+
+    @property
+    def yout(self):
+        return self._memmap('yout.f8', (len(self), self.ny))
+
+    def named_dep(self, key):
+        """ Returns the column of ``yout`` named ``key`` (a view of the memory map) """
+        return self.yout[:, self.names.index(key)]
+
+    def iter_chunks(self, chunk_size):
+        """ Generator of (xout, yout) chunks (in memory), of at most ``chunk_size`` rows """
+        xout, yout = self.xout, self.yout
+        for start in range(0, len(self), chunk_size):
+            yield np.array(xout[start:start+chunk_size]), np.array(yout[start:start+chunk_size])
+
+    def as_arrays(self, selection=slice(None), unit_registry=None):
+        """ Returns (xout, yout, params) of the selected rows (in memory)
+
+        Parameters
+        ----------
+        selection : slice or index array
+        unit_registry : dict, optional
+            When given, ``xout`` & ``yout`` are expressed in the time & concentration units of
+            the registry (instead of the units of the store).
+
+        """
+        xout, yout = np.array(self.xout[selection]), np.array(self.yout[selection])
+        if unit_registry is not None:
+            from ..units import get_derived_unit, to_unitless
+            for key, unit in (('time', self.time_unit), ('concentration', self.conc_unit)):
+                if unit is None:
+                    continue
+                factor = to_unitless(unit, get_derived_unit(unit_registry, key))
+                if key == 'time':
+                    xout = xout*factor
+                else:
+                    yout = yout*factor
+        return xout, yout, self.params
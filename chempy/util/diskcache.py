@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+A small content addressed on-disk cache (pickled objects) with size bounded LRU eviction.
+
+Used e.g. by :func:`chempy.kinetics.ode.get_odesys` to avoid repeating (expensive)
+symbolic manipulations of unchanged reaction mechanisms between processes.
+"""
+from __future__ import (absolute_import, division, print_function)
+
+from contextlib import contextmanager
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+
+
+def default_cache_dir():
+    """ Returns the default cache directory
+
+    Taken from the environment variable ``CHEMPY_CACHE_DIR`` when set, otherwise
+    ``chempy`` under ``XDG_CACHE_HOME`` (default: ``~/.cache``).
+    """
+    if os.environ.get('CHEMPY_CACHE_DIR'):
+        return os.environ['CHEMPY_CACHE_DIR']
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'chempy')
+
+
+def content_hash(*parts):
+    """ Hex digest (SHA-256) of the ``repr`` of ``parts``
+
+    Examples
+    --------
+    >>> content_hash('A', 1) == content_hash('A', 1) != content_hash('A', 2)
+    True
+
+    """
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+
+@contextmanager
+def file_lock(path, timeout=None, stale=3600, poll=0.1):
+    """ Context manager holding an (advisory) lock file while in the block
+
+    The lock is held across processes: the lock file is created exclusively
+    and removed on exit.
+
+    Parameters
+    ----------
+    path : str
+        Path of the lock file.
+    timeout : float, optional
+        Maximum time (in seconds) to wait for the lock. Default: wait indefinitely.
+    stale : float, optional
+        Lock files older than this (in seconds) are considered left behind by
+        a crashed process, and are removed.
+    poll : float
+        Time (in seconds) between attempts.
+
+    Examples
+    --------
+    >>> import os, tempfile
+    >>> lock_path = os.path.join(tempfile.mkdtemp(), 'build.lock')
+    >>> with file_lock(lock_path):
+    ...     os.path.exists(lock_path)
+    True
+    >>> os.path.exists(lock_path)
+    False
+
+    """
+    t0 = time.time()
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except (IOError, OSError):
+            try:
+                if stale is not None and time.time() - os.stat(path).st_mtime > stale:
+                    os.unlink(path)
+                    continue
+            except OSError:
+                continue  # released in the mean time
+            if timeout is not None and time.time() - t0 > timeout:
+                raise IOError("Timed out waiting for lock: %s" % path)
+            time.sleep(poll)
+        else:
+            break
+    try:
+        os.write(fd, str(os.getpid()).encode('utf-8'))
+        os.close(fd)
+        yield path
+    finally:
+        os.unlink(path)
+
+
+class DiskCache(object):
+    """ Cache of pickled objects stored as files in a directory
+
+    Entries are written atomically (rename of a temporary file), reading an entry
+    updates its modification time, which is used to evict the least recently used
+    entries when the total size exceeds ``max_size``.
+
+    Parameters
+    ----------
+    path : str, optional
+        Directory of the cache (created when needed). Default: :func:`default_cache_dir`.
+    max_size : int
+        Maximum total size (in bytes) of the cache entries.
+    suffix : str
+        File name suffix of entries (allows multiple caches sharing a directory).
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> cache = DiskCache(tempfile.mkdtemp(), max_size=2**20)
+    >>> key = content_hash('some', 'content')
+    >>> cache.get(key) is None
+    True
+    >>> cache.put(key, {'a': 1})
+    >>> cache.get(key)
+    {'a': 1}
+
+    """
+
+    def __init__(self, path=None, max_size=256*2**20, suffix='.pkl'):
+        self.path = path or default_cache_dir()
+        self.max_size = max_size
+        self.suffix = suffix
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + self.suffix)
+
+    def __contains__(self, key):
+        return os.path.exists(self._entry_path(key))
+
+    def get(self, key, default=None):
+        """ Returns the object stored under ``key`` (or ``default`` when missing or unreadable) """
+        entry = self._entry_path(key)
+        try:
+            with open(entry, 'rb') as ifh:
+                obj = pickle.load(ifh)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return default
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass  # e.g. evicted by another process
+        return obj
+
+    def put(self, key, obj):
+        """ Stores ``obj`` (which needs to be picklable) under ``key`` """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as ofh:
+                pickle.dump(obj, ofh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._entry_path(key))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        self.evict()
+
+    def entries(self):
+        """ List of (mtime, size, path) for the entries, least recently used first """
+        result = []
+        if not os.path.isdir(self.path):
+            return result
+        for name in os.listdir(self.path):
+            if not name.endswith(self.suffix):
+                continue
+            entry = os.path.join(self.path, name)
+            try:
+                st = os.stat(entry)
+            except OSError:
+                continue
+            result.append((st.st_mtime, st.st_size, entry))
+        return sorted(result)
+
+    def evict(self, max_size=None):
+        """ Removes least recently used entries until the total size is at most ``max_size`` """
+        if max_size is None:
+            max_size = self.max_size
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= max_size:
+                break
+            try:
+                os.unlink(entry)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        """ Removes all entries """
+        self.evict(max_size=0)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import shutil
+import tempfile
+
+import pytest
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from chempy.units import units_library, default_units as u
+from chempy.util.testing import requires
+from ..chunkstore import ChunkedStore
+
+
+@requires('numpy')
+def test_ChunkedStore():
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, 'store')
+        store = ChunkedStore.create(path, ['A', 'B', 'C'], params=[3.0], note='test')
+        assert len(store) == 0 and store.yout.shape == (0, 3)
+        store.append(np.arange(4.0), np.arange(12.0).reshape((4, 3)))
+        store.append([4.0], [[12, 13, 14]])
+        with pytest.raises(ValueError):
+            store.append([5.0, 6.0], [[1, 2, 3]])
+        with pytest.raises(IOError):
+            ChunkedStore.create(path, ['A'])
+
+        reopened = ChunkedStore(path)
+        assert len(reopened) == 5
+        assert isinstance(reopened.yout, np.memmap)
+        assert reopened.yout.tolist() == np.arange(15.0).reshape((5, 3)).tolist()
+        assert reopened.named_dep('B').tolist() == [1, 4, 7, 10, 13]
+        assert reopened.params.tolist() == [3.0]
+        assert reopened.header['metadata'] == {'note': 'test'}
+        assert [len(x) for x, y in reopened.iter_chunks(2)] == [2, 2, 1]
+        x, y, p = reopened.as_arrays(slice(None, None, 2))
+        assert x.tolist() == [0, 2, 4] and y.shape == (3, 3)
+
+        with open(os.path.join(path, 'yout.f8'), 'ab') as ofh:
+            ofh.write(b'\0'*12)  # left behind by an interrupted append
+        reopened.append([5.0], [[15, 16, 17]])
+        assert ChunkedStore(path).named_dep('C').tolist() == [2, 5, 8, 11, 14, 17]
+    finally:
+        shutil.rmtree(tempdir)
+
+
+@requires('numpy', units_library)
+def test_ChunkedStore__units():
+    from chempy.units import SI_base_registry
+    tempdir = tempfile.mkdtemp()
+    try:
+        store = ChunkedStore.create(tempdir, ['A'], time_unit='s', conc_unit='mol/m**3')
+        store.append([1, 2]*u.minute, [[1], [2]]*u.molar)
+        assert store.xout.tolist() == [60, 120]
+        assert np.allclose(store.yout[:, 0], [1e3, 2e3])
+        assert abs(store.time_unit - 1*u.s) < 1e-15*u.s
+        x, y, _ = store.as_arrays(unit_registry=dict(SI_base_registry, time=u.minute))
+        assert np.allclose(x, [1, 2])
+        with pytest.raises(ValueError):
+            ChunkedStore.create(os.path.join(tempdir, 'sub'), ['A']).append([1]*u.s, [[1]])
+    finally:
+        shutil.rmtree(tempdir)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from ..diskcache import DiskCache, content_hash, file_lock
+
+
+def test_DiskCache():
+    tempdir = tempfile.mkdtemp()
+    try:
+        cache = DiskCache(os.path.join(tempdir, 'sub'), max_size=2500)
+        keys = [content_hash('entry', i) for i in range(3)]
+        assert cache.get(keys[0]) is None
+        assert cache.get(keys[0], 42) == 42
+        cache.put(keys[0], b'0'*1000)
+        cache.put(keys[1], b'1'*1000)
+        assert keys[0] in cache and keys[1] in cache
+        t = os.stat(cache._entry_path(keys[1])).st_mtime
+        os.utime(cache._entry_path(keys[0]), (t + 10, t + 10))  # recently used
+        os.utime(cache._entry_path(keys[1]), (t - 10, t - 10))
+        cache.put(keys[2], b'2'*1000)  # evicts least recently used
+        assert keys[1] not in cache
+        assert cache.get(keys[0]) == b'0'*1000
+        assert cache.get(keys[2]) == b'2'*1000
+        with open(cache._entry_path(keys[0]), 'wb') as ofh:
+            ofh.write(b'corrupted')
+        assert cache.get(keys[0]) is None
+        cache.clear()
+        assert cache.entries() == []
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_file_lock():
+    tempdir = tempfile.mkdtemp()
+    try:
+        lock_path = os.path.join(tempdir, 'a.lock')
+        with file_lock(lock_path):
+            assert os.path.exists(lock_path)
+            with pytest.raises(IOError):
+                with file_lock(lock_path, timeout=0.05, poll=0.01):
+                    pass
+            assert os.path.exists(lock_path)
+        assert not os.path.exists(lock_path)
+
+        open(lock_path, 'w').close()
+        with file_lock(lock_path, timeout=1, stale=-1):  # left behind by crashed process
+            pass
+        assert not os.path.exists(lock_path)
+    finally:
+        shutil.rmtree(tempdir)
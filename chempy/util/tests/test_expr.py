@@ -14,7 +14,9 @@ from chempy.units import (
 )
 from ..testing import requires
 from ..pyutil import defaultkeydict
-from .._expr import Expr, mk_Poly, mk_PiecewisePoly, create_Piecewise, create_Poly, Log10, Constant
+from .._expr import (
+    Expr, mk_Poly, mk_PiecewisePoly, create_Piecewise, create_Poly, Log10, Constant, EvaluationContext, StackedPoly
+)
 from ..parsing import parsing_library
 
 
@@ -504,6 +506,82 @@ def test_create_Piecewise():
     assert abs(res_b - ref_b) < 1e-14
 
 
+@requires('numpy')
+def test_create_Piecewise__numpy():
+    import numpy as np
+    PolyT = create_Poly('Tmpr')
+    calls = []
+
+    class Scaled(Expr):
+        parameter_keys = ('Tmpr', 'scale')
+
+        def __call__(self, variables, backend=math, **kwargs):
+            calls.append(np.shape(variables['Tmpr']))
+            return variables['Tmpr']*variables['scale']
+
+    pw = create_Piecewise('Tmpr')([0, PolyT([1, 0.1]), 10, Scaled(), 20, PolyT([3, -.1]), 30])
+    x = np.array([[5, 10, 15], [0, 25, 30]], dtype=np.float64)
+    res = pw({'Tmpr': x, 'scale': 2}, backend=np)
+    assert np.allclose(res, [[1.5, 2, 30], [1, 0.5, 0]])
+    assert calls == [(1,)]  # only evaluated for the active elements
+    assert np.allclose(res, [[pw({'Tmpr': xi, 'scale': 2}) for xi in row] for row in x])
+    res2 = pw({'Tmpr': x[:1, :], 'scale': np.array([[1], [2]])}, backend=np)  # broadcasting
+    assert np.allclose(res2, [[1.5, 2, 15], [1.5, 2, 30]])
+    with pytest.raises(ValueError):
+        pw({'Tmpr': np.array([5, 31]), 'scale': 2}, backend=np)
+    with pytest.raises(ValueError):
+        pw({'Tmpr': -1, 'scale': 2})
+
+    unordered = create_Piecewise('x')([0, 1, 10, 2, 5, 3, 20])
+    assert unordered({'x': 7}) == 1
+    assert np.allclose(unordered({'x': np.array([7, 12])}, backend=np), [1, 3])
+
+
+@requires('numpy')
+def test_StackedPoly():
+    import numpy as np
+    RPolyT = create_Poly('T', reciprocal=True)
+    SPolyT = create_Poly('T', shift=True)
+    polys = [RPolyT([1, 2, 3]), RPolyT([4])]
+    sp = StackedPoly(polys)
+    assert len(sp) == 2 and sp.parameter_key == 'T'
+    T = np.array([1.5, 2, 3])
+    assert np.allclose(sp(T), [[p({'T': t}) for p in polys] for t in T])
+    assert sp.from_variables({'T': 2.0}).shape == (2,)
+
+    polys = [SPolyT([1, 2, 3]), SPolyT([2, 2, 3, 4], unique_keys=('Tsh',)), SPolyT([0.5, 0, 0, 0, 1])]
+    sp = StackedPoly(polys, {'Tsh': -1})
+    assert np.allclose(sp.shifts, [1, -1, 0.5])
+    assert np.allclose(sp(T), [[p({'T': t, 'Tsh': -1}) for p in polys] for t in T])
+
+    with pytest.raises(ValueError):
+        StackedPoly([RPolyT([1]), create_Poly('T')([1])])
+    with pytest.raises(ValueError):
+        StackedPoly([create_Poly('x')([1]), create_Poly('T')([1])])
+    with pytest.raises(ValueError):
+        StackedPoly([Constant(3)])
+
+
+def _linear(args, x, backend=math):
+    return args[0] + args[1]*x
+
+
+def test_Expr__pickle():
+    import pickle
+    PolyT = create_Poly('T')
+    PiecewiseT = create_Piecewise('T')
+    assert create_Poly('T') is PolyT
+    pw = PiecewiseT([0, PolyT([1, 2]), 10, Constant(21), 20])
+    pw2 = pickle.loads(pickle.dumps(pw))
+    assert type(pw2) is PiecewiseT and type(pw2.args[1]) is PolyT
+    assert pw2({'T': 5}) == 11 and pw2({'T': 15}) == 21
+
+    Linear = Expr.from_callback(_linear, parameter_keys=('x',), nargs=2)
+    lin = pickle.loads(pickle.dumps(Linear([1, 2], unique_keys=('a',))))
+    assert lin({'x': 3}) == 7 and lin({'x': 3, 'a': 0}) == 6
+    assert lin.parameter_keys == ('x',) and type(lin) is Linear
+
+
 def test_create_Poly():
     PolyT = create_Poly('T')
     p = PolyT([1, 2, 3, 4, 5])
@@ -550,3 +628,57 @@ def test_implicit_str():
     assert abs(expr2({'x': 3, 'u': 5}) - 5/(1 + 2*3 + 3*9)) < 1e-12
     assert expr1.all_parameter_keys() == set(['x'])
     assert expr2.all_parameter_keys() == set(['x'])
+
+
+def test_EvaluationContext():
+    calls = []
+
+    class Square(Expr):
+        parameter_keys = ('x',)
+
+        def __call__(self, variables, backend=math, reaction=None):
+            calls.append(reaction)
+            return variables['x']**2
+
+    class Scaled(Expr):
+        argument_names = ('factor', 'inner')
+
+        def __call__(self, variables, backend=math, **kwargs):
+            factor, inner = self.all_args(variables, backend=backend, **kwargs)
+            return factor*inner
+
+    sq = Square()
+    exprs = [Scaled([3, sq]), Scaled([5, sq])]
+    ctx = EvaluationContext({'x': 7})
+    assert [e(ctx, reaction='r1') for e in exprs] == [147, 245]
+    assert calls == ['r1']
+    exprs[0](ctx, reaction='r2')  # reaction dependent (default)
+    assert calls == ['r1', 'r2']
+    Square.reaction_dependent = False
+    exprs[0](ctx, reaction='r3')
+    assert len(calls) == 3
+    exprs[1](ctx, reaction='r4')
+    assert len(calls) == 3
+    ctx['x'] = 2
+    assert exprs[1](ctx, reaction='r4') == 20
+    assert len(calls) == 4
+    assert [e({'x': 2}) for e in exprs] == [12, 20]
+    assert len(calls) == 6
+
+
+def test_EvaluationContext__hoisting():
+    class PolyTime(create_Poly('time')):
+        reaction_dependent = False
+
+    class Missing(Expr):
+        reaction_dependent = False
+
+        def __call__(self, variables, backend=math, **kwargs):
+            return variables['z']
+
+    ctx = EvaluationContext({'time': 3, 'T': PolyTime([1, 2]), 'y': Missing(), 'w': create_Poly('time')([0, 1])},
+                            math)
+    assert ctx['T'] == 7
+    assert isinstance(ctx['y'], Expr)  # 'z' missing
+    assert isinstance(ctx['w'], Expr)  # possibly reaction dependent: evaluated when looked up
+    assert ctx.evaluate(ctx['w'], math, reaction=None) == 3
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+
+import math
+import pickle
+
+import pytest
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ..testing import requires
+from .._expr import Expr, create_Poly, create_Piecewise
+from .._expr_compile import compile_exprs
+
+
+class Arrh(Expr):
+    argument_names = ('A', 'Ea_over_R')
+    parameter_keys = ('T',)
+
+    def __call__(self, variables, backend=math):
+        A, Ea_over_R = self.all_args(variables, backend=backend)
+        T, = self.all_params(variables, backend=backend)
+        return A*backend.exp(-Ea_over_R/T)
+
+
+class Branching(Expr):
+    parameter_keys = ('x',)
+
+    def __call__(self, variables, backend=math):
+        x, = self.all_params(variables, backend=backend)
+        return x if x > 0 else -x
+
+
+def _exprs():
+    return [Arrh([1e3, 500.0]), Arrh([2e3, 500.0]), Arrh([2, 3])*Arrh([5, 7]) + 1]
+
+
+@requires('numpy')
+@pytest.mark.parametrize('backend', ['numpy', 'numba'])
+def test_compile_exprs(backend):
+    if backend == 'numba':
+        pytest.importorskip('numba')
+    exprs = _exprs()
+    cb = compile_exprs(exprs, backend=backend)
+    assert cb.variable_order == ('T',)
+    T = np.array([[250.0], [300.0], [350.0]])
+    out = cb(T)
+    assert out.shape == (3, 1, 3)
+    for i, expr in enumerate(exprs):
+        assert np.allclose(out[..., i], expr({'T': T}, backend=np))
+    assert np.allclose(cb.from_dict({'T': 300.0, 'other': 1}), [e({'T': 300.0}) for e in exprs])
+
+
+@requires('numpy')
+def test_compile_exprs__cse():
+    # -500/T & exp(-500/T) are shared, leaving one multiplication per expression
+    assert compile_exprs(_exprs()[:2]).n_ops == 4
+    assert compile_exprs([Arrh([3, 4])*Arrh([5, 6])], constants={'T': 2.0}).n_ops == 0
+
+
+@requires('numpy')
+@pytest.mark.parametrize('backend', ['numpy', 'numba'])
+def test_compile_exprs__Piecewise(backend):
+    if backend == 'numba':
+        pytest.importorskip('numba')
+    TPiecewise = create_Piecewise('T')
+    TPoly = create_Poly('T')
+    pw = TPiecewise([0, TPoly([1, 2]), 10, TPoly([21, 0]), 20])
+    cb = compile_exprs([pw], backend=backend, squeeze=True)
+    assert np.allclose(cb([1, 5, 15]), [3, 11, 21])
+    for T in (25, [1, 25]):
+        with pytest.raises(ValueError):
+            pw({'T': np.asarray(T)}, backend=np)
+        with pytest.raises(ValueError):
+            cb(T)
+    with pytest.raises(ValueError):
+        compile_exprs([pw], constants={'T': 25})
+
+    nan_pw = create_Piecewise('T', nan_fallback=True)([0, TPoly([1, 2]), 10])
+    nan_cb = compile_exprs([nan_pw], backend=backend, squeeze=True)
+    assert np.allclose(nan_cb(5), 11) and np.isnan(nan_cb(25))
+
+
+@requires('numpy')
+def test_compile_exprs__variable_order():
+    cb = compile_exprs([Arrh([1, 2])], ['x', 'T'])
+    assert cb.variable_order == ('x', 'T')
+    assert np.allclose(cb(0, 2.0), math.exp(-1))
+    with pytest.raises(KeyError):
+        compile_exprs([Arrh([1, 2])], ['x'])
+
+
+@requires('numpy')
+def test_compile_exprs__NotImplementedError():
+    with pytest.raises(NotImplementedError):
+        compile_exprs([Branching()])
+
+
+@requires('numpy')
+def test_compile_exprs__pickle():
+    cb = compile_exprs(_exprs(), squeeze=False)
+    cb2 = pickle.loads(pickle.dumps(cb))
+    assert np.allclose(cb2(300.0), cb(300.0))
+    assert cb2.n_ops == cb.n_ops